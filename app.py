@@ -1,11 +1,50 @@
 import streamlit as st
 import pandas as pd
-from sqlalchemy import create_engine, text, inspect
 from datetime import datetime
 import os
 import io
 import tempfile
 import time
+from contextlib import nullcontext
+
+from ingest import (
+    REQUIRED_COLUMNS,
+    validate_file_format,
+    read_excel_file,
+    combine_files,
+    merge_files,
+)
+from upload_cache import UploadCache, hash_upload, frame_size
+from header_mapper import add_learned_synonyms, learned_synonyms
+from metrics import UploadMetrics, format_prometheus
+from export import EXPORT_FORMATS, build_export
+from snapshot import current_snapshot, refresh_snapshot, snapshot_filled_cells
+from database import (
+    DATABASE_URL,
+    get_cached_engine,
+    get_data_version,
+    ensure_table,
+    normalize_email_key,
+    review_keys,
+    count_matching_rows,
+    load_page_from_db,
+    count_filled_cells,
+    preview_changes,
+    update_database,
+    get_db_stats,
+    delete_rows_by_id,
+    update_rows_by_id,
+    delete_entire_database,
+    list_change_batches,
+    load_batch_changes,
+    load_email_history,
+    load_rows_as_of,
+    rollback_change_batch,
+    load_header_mappings,
+    save_header_mappings,
+    load_recent_metrics,
+    load_metrics_totals,
+)
 
 # Page configuration
 st.set_page_config(
@@ -17,709 +56,554 @@ st.set_page_config(
 # Initialize session state
 if 'db_updated' not in st.session_state:
     st.session_state.db_updated = False
-if 'last_file' not in st.session_state:
-    st.session_state.last_file = None
-if 'preview_data' not in st.session_state:
-    st.session_state.preview_data = None
+if 'preview_key' not in st.session_state:
+    st.session_state.preview_key = None
 if 'selected_updates' not in st.session_state:
     st.session_state.selected_updates = {}
 
-# Database connection string (SQLite)
-DB_NAME = "FW_data_base.db"
-DATABASE_URL = f"sqlite:///{DB_NAME}"
-
-# Required columns in order
-REQUIRED_COLUMNS = ['Company', 'Name', 'Surname', 'Email', 'Position', 'Phone']
-TABLE_NAME = "contacts_data"
+# Rows per page offered in the View Database tab
+PAGE_SIZE_OPTIONS = [25, 50, 100, 250, 500]
 
 def get_engine():
-    """Create database engine connection"""
+    """Return the process-wide database engine (created once, shared by every rerun and session)"""
     try:
-        return create_engine(DATABASE_URL, echo=False)
+        return get_cached_engine(DATABASE_URL)
     except Exception as e:
         st.error(f"❌ Database connection error: {str(e)}")
         return None
 
-def validate_columns(df):
-    """Validate that DataFrame has all required columns"""
-    # Normalize column names - remove all whitespace, convert to lowercase for comparison
-    df_columns_normalized = {}
-    for df_col in df.columns:
-        # Strip and normalize the column name
-        col_str = str(df_col).strip()
-        normalized = col_str.lower().replace(' ', '').replace('_', '').replace('-', '')
-        df_columns_normalized[normalized] = df_col
+@st.cache_data(max_entries=4, show_spinner=False)
+def cached_filled_cells(_engine, data_version):
+    """Filled-cell count, recomputed only when the data version changes
+    Counted on the columnar snapshot when it is current, otherwise in SQL (a stale snapshot is not refreshed for this)
+    """
+    try:
+        snapshot = current_snapshot(_engine)
+        if snapshot is not None:
+            return snapshot_filled_cells(snapshot)
+    except Exception:
+        pass
+    try:
+        return count_filled_cells(_engine)
+    except Exception:
+        return 0
+
+def refresh_snapshot_after_write(engine):
+    """Bring the columnar snapshot in step with a committed write (replaying just that batch); the write itself already succeeded"""
+    try:
+        refresh_snapshot(engine)
+    except Exception:
+        pass
+
+@st.cache_resource
+def get_upload_cache():
+    """Process-wide cache of parsed uploads and previews, kept across reruns"""
+    return UploadCache()
+
+def write_temp_file(file_bytes, file_extension):
+    """Save uploaded bytes to a temp file for the Excel readers and return its path"""
+    with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as tmp_file:
+        tmp_file.write(file_bytes)
+        return tmp_file.name
+
+def remove_temp_file(tmp_file_path):
+    """Delete a temp file, working around Windows file locks"""
+    if tmp_file_path and os.path.exists(tmp_file_path):
+        try:
+            time.sleep(0.1)
+            os.unlink(tmp_file_path)
+        except PermissionError:
+            try:
+                import ctypes
+                ctypes.windll.kernel32.SetFileAttributesW(tmp_file_path, 128)
+                os.unlink(tmp_file_path)
+            except:
+                pass
+        except Exception:
+            pass
+
+def show_read_error(error_msg, error_details):
+    """Explain why a workbook could not be opened"""
+    st.error(error_msg)
+    if error_details:
+        st.warning(error_details)
+        if "Encrypted" in error_msg or "Password-Protected" in error_msg:
+            st.markdown("**📋 What this means:**")
+            st.info("• The file might be password-protected")
+            st.info("• The file might be saved as an 'Internal' Excel format")
+            st.info("• The file might have security/permission restrictions")
+        else:
+            st.markdown("**🔧 Solution:** The file needs to be properly saved in Excel.")
+            st.info("**Please follow these steps:**")
+            st.info("1. ✅ Open the file in Excel")
+            st.info("2. ✅ Click **File** → **Save As**")
+            st.info("3. ✅ In the dropdown, select **'Excel Workbook (*.xlsx)'**")
+            st.info("4. ✅ Click **Save** (you can overwrite the file or use a new name)")
+            st.info("5. ✅ Upload the newly saved file here")
+
+def open_upload(upload, open_workbooks, tmp_file_paths, metrics):
+    """Write an upload to a temp file and open its workbook once; shows the read error on failure
+    Returns (success, sheet_names, workbook); the handle and temp path are tracked for cleanup
+    """
+    with metrics.stage('write_temp', bytes_read=len(upload['bytes'])):
+        tmp_file_path = write_temp_file(upload['bytes'], upload['extension'])
+    tmp_file_paths.append(tmp_file_path)
+    # Engine probing happens here
+    with metrics.stage('open', bytes_read=len(upload['bytes'])) as stage:
+        success, sheet_names, workbook, error_msg, error_details = read_excel_file(
+            tmp_file_path, upload['extension'], upload['engine_name']
+        )
+        if not success:
+            stage['status'] = 'failed'
+    if not success:
+        st.error(f"❌ **Could not read {upload['name']}**")
+        show_read_error(error_msg, error_details)
+        return False, None, None
+    open_workbooks[upload['hash']] = workbook
+    return True, sheet_names, workbook
+
+def summarize_files(df_processed, preview_result, file_reports, selected_updates=None):
+    """Per-file breakdown of a merged upload: rows read, rows superseded by later files and the planned changes
+    With selected_updates, only the selected updates and new rows are counted
+    Changes are traced back to their file by review key, so each row without an email counts for its own file
+    """
+    key_to_file = dict(zip(review_keys(df_processed, normalize_email_key(df_processed['Email'])), df_processed['_source_file']))
+    counts = {report['name']: {'To Update': 0, 'Unchanged': 0, 'New': 0, 'Duplicates': 0} for report in file_reports}
     
-    missing_cols = []
-    column_mapping = {}
+    def is_selected(review_key):
+        return selected_updates is None or selected_updates.get(review_key, True)
     
-    for req_col in REQUIRED_COLUMNS:
-        found = False
-        req_col_normalized = req_col.lower().replace(' ', '').replace('_', '').replace('-', '')
-        
-        # Try exact match first (case-insensitive, whitespace-insensitive)
-        if req_col_normalized in df_columns_normalized:
-            column_mapping[req_col] = df_columns_normalized[req_col_normalized]
-            found = True
-        else:
-            # Try direct comparison with original column names (case-insensitive)
-            for df_col in df.columns:
-                df_col_clean = str(df_col).strip()
-                if df_col_clean.lower() == req_col.lower():
-                    column_mapping[req_col] = df_col
-                    found = True
-                    break
-        
-        if not found:
-            missing_cols.append(req_col)
+    for update in preview_result['updates']:
+        file_counts = counts[key_to_file[update['review_key']]]
+        if update['type'] == 'no_change':
+            file_counts['Unchanged'] += 1
+        elif is_selected(update['review_key']):
+            file_counts['To Update'] += 1
+    for new_row in preview_result['new_rows']:
+        if is_selected(new_row['review_key']):
+            counts[key_to_file[new_row['review_key']]]['New'] += 1
+    for dup in preview_result['duplicates']:
+        counts[key_to_file[dup['review_key']]]['Duplicates'] += 1
     
-    return len(missing_cols) == 0, missing_cols, column_mapping
+    kept_rows = df_processed['_source_file'].value_counts()
+    return pd.DataFrame([
+        {
+            'File': report['name'],
+            'Sheets': report['sheets'],
+            'Rows Read': report['rows'],
+            'Superseded by Later Files': report['rows'] - int(kept_rows.get(report['name'], 0)),
+            **counts[report['name']]
+        }
+        for report in file_reports
+    ])
 
-def extract_required_columns(df, column_mapping):
-    """Extract and reorder DataFrame to have required columns in correct order"""
-    result_df = pd.DataFrame()
+def get_review_frame(preview_result):
+    """Updates with changes and new rows of a preview as one DataFrame (one row per review key: per email, and per row without one)
+    Built once per preview result and kept in the session, so reruns only slice it
+    """
+    cached = st.session_state.get('review_frame')
+    if cached is not None and cached[0] is preview_result:
+        return cached[1]
     
-    for req_col in REQUIRED_COLUMNS:
-        if req_col in column_mapping:
-            df_col = column_mapping[req_col]
-            result_df[req_col] = df[df_col]
-        else:
-            result_df[req_col] = None
+    rows = []
+    for update in preview_result.get('updates', []):
+        changed_cols = update.get('changed_columns')
+        if not changed_cols:
+            continue  # Skip if no changes
+        rows.append({
+            '_review_key': update['review_key'],
+            'Change': 'Update',
+            'Name': update.get('name', ''),
+            'Surname': update.get('surname', ''),
+            'Email': update.get('email', ''),
+            'Changed Columns': ", ".join(changed_cols),
+            'Details': " | ".join(f"{col}: {change.get('old', '')} → {change.get('new', '')}" for col, change in changed_cols.items())
+        })
+    for new_row in preview_result.get('new_rows', []):
+        row_data = new_row.get('row', {})
+        rows.append({
+            '_review_key': new_row['review_key'],
+            'Change': 'New',
+            'Name': new_row.get('name', ''),
+            'Surname': new_row.get('surname', ''),
+            'Email': new_row.get('email', ''),
+            'Changed Columns': '',
+            'Details': " | ".join(f"{col}: {row_data.get(col, '')}" for col in REQUIRED_COLUMNS if col not in ('Name', 'Surname', 'Email'))
+        })
+    review = pd.DataFrame(rows, columns=['_review_key', 'Change', 'Name', 'Surname', 'Email', 'Changed Columns', 'Details'])
+    st.session_state.review_frame = (preview_result, review)
+    st.session_state.review_editor_version = st.session_state.get('review_editor_version', 0) + 1
+    return review
+
+def render_review_grid(review):
+    """Filters, bulk selection and one paged st.data_editor over the review rows
+    The widget count does not depend on the size of the diff; selections live in st.session_state.selected_updates
+    """
+    selected_updates = st.session_state.selected_updates
+    # Everything starts selected (update_database only writes keys marked True)
+    for review_key in review['_review_key']:
+        selected_updates.setdefault(review_key, True)
     
-    # Convert to string to avoid serialization issues
-    for col in result_df.columns:
-        result_df[col] = result_df[col].astype(str).replace('nan', '')
+    # Filters
+    filter_col1, filter_col2, filter_col3 = st.columns([1, 2, 1])
+    with filter_col1:
+        change_types = st.multiselect("Change type", options=['Update', 'New'], default=['Update', 'New'], key="review_change_types")
+    with filter_col2:
+        changed_filter = st.multiselect("Changed column (updates only)", options=REQUIRED_COLUMNS, key="review_changed_columns")
+    with filter_col3:
+        status_filter = st.selectbox("Show", options=['All', 'Selected', 'Cancelled'], key="review_status")
     
-    return result_df
-
-def validate_file_format(uploaded_file):
-    """Validate file format and return file extension and validation status"""
-    # Reset file pointer
-    uploaded_file.seek(0)
+    mask = review['Change'].isin(change_types)
+    if changed_filter:
+        # New rows have no changed columns, so a column filter shows updates only
+        column_mask = pd.Series(False, index=review.index)
+        for col in changed_filter:
+            column_mask |= review['Changed Columns'].str.split(', ').apply(lambda cols, col=col: col in cols)
+        mask &= column_mask
+    is_selected = review['_review_key'].map(selected_updates).fillna(True).astype(bool)
+    if status_filter == 'Selected':
+        mask &= is_selected
+    elif status_filter == 'Cancelled':
+        mask &= ~is_selected
+    filtered = review[mask]
     
-    # Check if file is empty
-    if uploaded_file.size == 0:
-        return False, "Empty", "Uploaded file is empty!"
+    # Bulk selection applies to every filtered row, not only the current page
+    def set_filtered(value):
+        for review_key in filtered['_review_key']:
+            st.session_state.selected_updates[review_key] = value
+        # A fresh editor, so its stored edits do not override the bulk change
+        st.session_state.review_editor_version = st.session_state.get('review_editor_version', 0) + 1
     
-    # Get file extension
-    file_extension = uploaded_file.name.split('.')[-1].lower()
+    bulk_col1, bulk_col2, bulk_col3 = st.columns([1, 1, 2])
+    with bulk_col1:
+        st.button(f"✅ Select {len(filtered)} shown", key="review_select_all_btn", on_click=set_filtered, args=(True,),
+                  disabled=len(filtered) == 0)
+    with bulk_col2:
+        st.button(f"❌ Cancel {len(filtered)} shown", key="review_deselect_all_btn", on_click=set_filtered, args=(False,),
+                  disabled=len(filtered) == 0)
+    with bulk_col3:
+        st.caption(f"{int(is_selected.sum())} of {len(review)} change(s) selected")
     
-    # Validate file type
-    if file_extension not in ['xlsx', 'xls']:
-        return False, file_extension, f"Invalid file type '{file_extension}'. Please upload .xlsx or .xls files."
+    # Pagination controls
+    nav_col1, nav_col2, nav_col3, nav_col4, nav_col5 = st.columns([1, 1, 1, 1, 2])
+    with nav_col1:
+        page_size = st.selectbox("Rows per page", options=PAGE_SIZE_OPTIONS, index=2, key="review_page_size")
+    page_count = max(1, -(-len(filtered) // page_size))
     
-    # Determine engine
-    engine_name = 'xlrd' if file_extension == 'xls' else 'openpyxl'
+    # New filters or page size start again from the first page
+    review_query = (tuple(change_types), tuple(changed_filter), status_filter, page_size)
+    if st.session_state.get('review_page_query') != review_query:
+        st.session_state.review_page_query = review_query
+        st.session_state.review_page = 1
+    st.session_state.review_page = min(max(st.session_state.get('review_page', 1), 1), page_count)
     
-    return True, file_extension, engine_name
-
-def read_excel_file(tmp_file_path, file_extension, engine_name):
-    """Read Excel file and return sheet names - temp file should already exist"""
-    excel_file = None
+    def change_page(step):
+        st.session_state.review_page = min(max(st.session_state.review_page + step, 1), page_count)
     
-    try:
-        # Try multiple engines to read file
-        engines_to_try = []
-        if file_extension == 'xlsx':
-            engines_to_try = [
-                ('auto-detect', None),
-                ('openpyxl', 'openpyxl'),
-                ('xlrd', 'xlrd')
-            ]
-        else:  # .xls
-            engines_to_try = [
-                ('auto-detect', None),
-                ('xlrd', 'xlrd'),
-                ('openpyxl', 'openpyxl')
-            ]
-        
-        last_error = None
-        successful_engine = None
-        sheet_names = None
-        
-        for engine_display, engine_to_try in engines_to_try:
-            try:
-                if excel_file:
-                    try:
-                        excel_file.close()
-                    except:
-                        pass
-                
-                # Try reading with this engine
-                if engine_to_try is None:
-                    excel_file = pd.ExcelFile(tmp_file_path)
-                else:
-                    excel_file = pd.ExcelFile(tmp_file_path, engine=engine_to_try)
-                
-                sheet_names = excel_file.sheet_names
-                successful_engine = engine_to_try if engine_to_try else 'auto-detect'
-                engine_name = successful_engine if successful_engine != 'auto-detect' else 'openpyxl'
-                excel_file.close()
-                excel_file = None
-                break
-                
-            except Exception as e:
-                last_error = str(e)
-                error_lower = str(e).lower()
-                
-                # Check if file might be encrypted
-                is_encrypted = any(keyword in error_lower for keyword in [
-                    'password', 'encrypted', 'protected', 
-                    'ole2', 'compound document',
-                    'permission denied', 'access denied',
-                    'locked', 'security'
-                ])
-                
-                if engine_display == engines_to_try[-1][0]:
-                    # Last engine failed
-                    if is_encrypted or 'ole2' in error_lower or 'compound document' in error_lower:
-                        error_msg = "🔒 File is Encrypted or Password-Protected"
-                        details = "⚠️ The document appears to be encrypted or is an internal Excel file format."
-                        return False, None, None, error_msg, details
-                    else:
-                        error_msg = f"❌ Error reading Excel file: All methods failed"
-                        details = f"Last error ({engine_display}): {last_error}"
-                        return False, None, None, error_msg, details
-        
-        if not sheet_names:
-            return False, None, None, "❌ Could not read file with any method", ""
-        
-        return True, sheet_names, engine_name, None, None
-        
-    except Exception as e:
-        if excel_file:
-            try:
-                excel_file.close()
-            except:
-                pass
-        return False, None, None, f"Error reading file: {str(e)}", ""
-
-def process_sheet(tmp_file_path, sheet_name, engine_name):
-    """Process a single sheet: read, validate columns, and return processed DataFrame"""
-    try:
-        # Read the sheet
-        df = pd.read_excel(tmp_file_path, sheet_name=sheet_name, engine=engine_name, header=0)
-        
-        # Validate columns
-        is_valid, missing_cols, column_mapping = validate_columns(df)
-        
-        if not is_valid:
-            return False, None, f"Missing required columns: {', '.join(missing_cols)}", missing_cols, column_mapping
-        
-        # Extract required columns
-        df_processed = extract_required_columns(df, column_mapping)
-        
-        return True, df_processed, None, None, column_mapping
-        
-    except Exception as e:
-        return False, None, f"Error reading sheet '{sheet_name}': {str(e)}", None, None
+    with nav_col2:
+        st.write("")
+        st.write("")
+        st.button("◀ Previous", key="review_prev_page_btn", on_click=change_page, args=(-1,),
+                  disabled=st.session_state.review_page <= 1)
+    with nav_col3:
+        st.number_input("Page", min_value=1, max_value=page_count, step=1, key="review_page")
+    with nav_col4:
+        st.write("")
+        st.write("")
+        st.button("Next ▶", key="review_next_page_btn", on_click=change_page, args=(1,),
+                  disabled=st.session_state.review_page >= page_count)
+    
+    page_offset = (st.session_state.review_page - 1) * page_size
+    page = filtered.iloc[page_offset:page_offset + page_size].copy()
+    with nav_col5:
+        st.write("")
+        st.write("")
+        if len(page) > 0:
+            st.caption(f"Showing changes {page_offset + 1}-{page_offset + len(page)} of {len(filtered)} (page {st.session_state.review_page} of {page_count})")
+    
+    if len(page) == 0:
+        st.info("No changes match the filters.")
+        return
+    
+    page.insert(0, 'Select', page['_review_key'].map(selected_updates).fillna(True).astype(bool))
+    # The editor stores ticks by row position, so it is keyed by the rows it shows: ticks never carry over to other rows
+    editor_key = f"review_editor_{st.session_state.get('review_editor_version', 0)}_{hash(tuple(page['_review_key']))}"
+    edited = st.data_editor(
+        page.set_index('_review_key'),
+        column_config={
+            'Select': st.column_config.CheckboxColumn("Select", help="Tick to apply this change"),
+            'Details': st.column_config.TextColumn("Details", width="large")
+        },
+        disabled=['Change', 'Name', 'Surname', 'Email', 'Changed Columns', 'Details'],
+        hide_index=True,
+        use_container_width=True,
+        key=editor_key
+    )
+    # Write the ticks of this page back into the selection
+    for review_key, value in edited['Select'].items():
+        selected_updates[review_key] = bool(value)
 
-def load_data_from_db(engine):
-    """Load all data from database"""
-    try:
-        inspector = inspect(engine)
-        if TABLE_NAME in inspector.get_table_names():
-            df = pd.read_sql_table(TABLE_NAME, engine)
-            # Convert to string
-            for col in df.columns:
-                df[col] = df[col].astype(str).replace('nan', '')
-            return df
-        return pd.DataFrame(columns=REQUIRED_COLUMNS)
-    except Exception as e:
-        st.error(f"❌ Error loading data: {str(e)}")
-        return pd.DataFrame(columns=REQUIRED_COLUMNS)
+def get_upload_metrics(engine, uploaded_files):
+    """Metrics run of the current set of uploaded files; a new run starts when the files change"""
+    run_key = tuple((uploaded_file.name, uploaded_file.size) for uploaded_file in uploaded_files)
+    current = st.session_state.get('upload_metrics')
+    if current is None or current[0] != run_key:
+        source = ", ".join(uploaded_file.name for uploaded_file in uploaded_files)
+        current = (run_key, UploadMetrics(source, engine))
+        st.session_state.upload_metrics = current
+    return current[1]
 
-def preview_changes(engine, df, update_mode='replace'):
-    """Preview what would change without actually updating the database"""
-    try:
-        # Convert to string
-        df_copy = df.copy()
-        for col in df_copy.columns:
-            df_copy[col] = df_copy[col].astype(str).replace('nan', '')
-        
-        preview_changes_details = []  # Store change details
-        new_rows = []  # Store new rows
-        duplicate_rows = []  # Store duplicate rows (for append mode)
-        
-        inspector = inspect(engine)
-        
-        if TABLE_NAME in inspector.get_table_names():
-            # Load existing data
-            existing_df = load_data_from_db(engine)
-            
-            if len(existing_df) > 0:
-                # Normalize Email for comparison
-                df_copy['_email_key'] = df_copy['Email'].astype(str).str.lower().str.strip()
-                existing_df['_email_key'] = existing_df['Email'].astype(str).str.lower().str.strip()
-                
-                # Create a set of Email addresses from new file
-                new_emails = set(df_copy['_email_key'])
-                existing_emails = set(existing_df['_email_key'])
-                
-                if update_mode == 'replace':
-                    # Find matching records to update
-                    matching_emails = new_emails & existing_emails
-                    new_email_set = new_emails - existing_emails
-                    
-                    # Track changes for each updated record
-                    for email in matching_emails:
-                        old_row = existing_df[existing_df['_email_key'] == email].iloc[0]
-                        new_row = df_copy[df_copy['_email_key'] == email].iloc[0]
-                        
-                        # Compare each column
-                        changed_cols = {}
-                        for col in REQUIRED_COLUMNS:
-                            old_val = str(old_row.get(col, '')).strip()
-                            new_val = str(new_row.get(col, '')).strip()
-                            if old_val != new_val:
-                                changed_cols[col] = {
-                                    'old': old_val if old_val else '(empty)',
-                                    'new': new_val if new_val else '(empty)'
-                                }
-                        
-                        # Clean email from HTML tags if any
-                        clean_email = email
-                        if '<a href' in str(email):
-                            import re
-                            email_match = re.search(r'>(.*?)</a>', str(email))
-                            if email_match:
-                                clean_email = email_match.group(1)
-                            else:
-                                email_match = re.search(r'mailto:(.*?)[">]', str(email))
-                                if email_match:
-                                    clean_email = email_match.group(1)
-                        
-                        preview_changes_details.append({
-                            'email': clean_email,
-                            'email_key': email,
-                            'name': str(new_row.get('Name', '')),
-                            'surname': str(new_row.get('Surname', '')),
-                            'changed_columns': changed_cols,
-                            'old_row': old_row.to_dict(),
-                            'new_row': new_row.to_dict(),
-                            'type': 'update' if changed_cols else 'no_change'
-                        })
-                    
-                    # Find new rows
-                    for email in new_email_set:
-                        new_row = df_copy[df_copy['_email_key'] == email].iloc[0]
-                        clean_email = email
-                        if '<a href' in str(email):
-                            import re
-                            email_match = re.search(r'>(.*?)</a>', str(email))
-                            if email_match:
-                                clean_email = email_match.group(1)
-                            else:
-                                email_match = re.search(r'mailto:(.*?)[">]', str(email))
-                                if email_match:
-                                    clean_email = email_match.group(1)
-                        
-                        new_rows.append({
-                            'email': clean_email,
-                            'email_key': email,
-                            'name': str(new_row.get('Name', '')),
-                            'surname': str(new_row.get('Surname', '')),
-                            'row': new_row.to_dict(),
-                            'type': 'new'
-                        })
-                else:  # append mode
-                    # Find new rows (not in existing)
-                    new_email_set = new_emails - existing_emails
-                    duplicate_email_set = new_emails & existing_emails
-                    
-                    # Track new rows
-                    for email in new_email_set:
-                        new_row = df_copy[df_copy['_email_key'] == email].iloc[0]
-                        clean_email = email
-                        if '<a href' in str(email):
-                            import re
-                            email_match = re.search(r'>(.*?)</a>', str(email))
-                            if email_match:
-                                clean_email = email_match.group(1)
-                            else:
-                                email_match = re.search(r'mailto:(.*?)[">]', str(email))
-                                if email_match:
-                                    clean_email = email_match.group(1)
-                        
-                        new_rows.append({
-                            'email': clean_email,
-                            'email_key': email,
-                            'name': str(new_row.get('Name', '')),
-                            'surname': str(new_row.get('Surname', '')),
-                            'row': new_row.to_dict(),
-                            'type': 'new'
-                        })
-                    
-                    # Track duplicates
-                    for email in duplicate_email_set:
-                        new_row = df_copy[df_copy['_email_key'] == email].iloc[0]
-                        clean_email = email
-                        if '<a href' in str(email):
-                            import re
-                            email_match = re.search(r'>(.*?)</a>', str(email))
-                            if email_match:
-                                clean_email = email_match.group(1)
-                            else:
-                                email_match = re.search(r'mailto:(.*?)[">]', str(email))
-                                if email_match:
-                                    clean_email = email_match.group(1)
-                        
-                        duplicate_rows.append({
-                            'email': clean_email,
-                            'email_key': email,
-                            'name': str(new_row.get('Name', '')),
-                            'surname': str(new_row.get('Surname', '')),
-                            'row': new_row.to_dict(),
-                            'type': 'duplicate'
-                        })
-                
-                # Remove temporary key column
-                df_copy = df_copy.drop(columns=['_email_key'])
-            else:
-                # No existing data, all rows are new
-                for idx, row in df_copy.iterrows():
-                    clean_email = str(row.get('Email', '')).strip().lower()
-                    if '<a href' in clean_email:
-                        import re
-                        email_match = re.search(r'>(.*?)</a>', clean_email)
-                        if email_match:
-                            clean_email = email_match.group(1)
-                        else:
-                            email_match = re.search(r'mailto:(.*?)[">]', clean_email)
-                            if email_match:
-                                clean_email = email_match.group(1)
-                    
-                    new_rows.append({
-                        'email': clean_email,
-                        'email_key': clean_email.lower().strip(),
-                        'name': str(row.get('Name', '')),
-                        'surname': str(row.get('Surname', '')),
-                        'row': row.to_dict(),
-                        'type': 'new'
-                    })
-        else:
-            # Table doesn't exist, all rows are new
-            for idx, row in df_copy.iterrows():
-                clean_email = str(row.get('Email', '')).strip().lower()
-                if '<a href' in clean_email:
-                    import re
-                    email_match = re.search(r'>(.*?)</a>', clean_email)
-                    if email_match:
-                        clean_email = email_match.group(1)
-                    else:
-                        email_match = re.search(r'mailto:(.*?)[">]', clean_email)
-                        if email_match:
-                            clean_email = email_match.group(1)
-                
-                new_rows.append({
-                    'email': clean_email,
-                    'email_key': clean_email.lower().strip(),
-                    'name': str(row.get('Name', '')),
-                    'surname': str(row.get('Surname', '')),
-                    'row': row.to_dict(),
-                    'type': 'new'
-                })
-        
-        return {
-            'updates': preview_changes_details,
-            'new_rows': new_rows,
-            'duplicates': duplicate_rows,
-            'update_mode': update_mode
-        }
-    except Exception as e:
-        return {'error': str(e)}
-
-def update_database(engine, df, update_mode='replace', selected_items=None):
-    """Update database with DataFrame and return change details
-    selected_items: dict with email_key as key and True/False as value for which rows to update
+def render_preview(engine, df_processed, preview_result, update_mode_lower, file_reports=None, metrics=None, learned_headers=None):
+    """Show the previewed changes in a paged review grid with the update button
+    learned_headers: headers matched by similarity, saved for the next upload once the update succeeds
     """
-    try:
-        # Convert to string
-        df_copy = df.copy()
-        for col in df_copy.columns:
-            df_copy[col] = df_copy[col].astype(str).replace('nan', '')
-        
-        changes_details = []  # Store change details
-        inspector = inspect(engine)
-        
-        if selected_items is None:
-            selected_items = {}  # If None, update all
-        
-        # Update database
-        if update_mode == 'replace':
-            if TABLE_NAME in inspector.get_table_names():
-                existing_df = load_data_from_db(engine)
-                
-                if len(existing_df) > 0:
-                    # Normalize Email for comparison
-                    df_copy['_email_key'] = df_copy['Email'].astype(str).str.lower().str.strip()
-                    existing_df['_email_key'] = existing_df['Email'].astype(str).str.lower().str.strip()
-                    
-                    new_emails = set(df_copy['_email_key'])
-                    existing_emails = set(existing_df['_email_key'])
-                    
-                    # Filter based on selected_items
-                    if selected_items:
-                        # Only process selected items
-                        df_copy = df_copy[df_copy['_email_key'].isin([k for k, v in selected_items.items() if v])]
-                        new_emails = set(df_copy['_email_key'])
-                    
-                    # Find rows to keep (existing rows not in new file)
-                    rows_to_keep = existing_df[~existing_df['_email_key'].isin(new_emails)].copy()
-                    
-                    # Find matching records to update
-                    matching_emails = new_emails & existing_emails
-                    new_email_set = new_emails - existing_emails
-                    
-                    # Track changes for selected updated records
-                    for email in matching_emails:
-                        if selected_items and not selected_items.get(email, True):
-                            continue  # Skip if not selected
-                        
-                        old_row = existing_df[existing_df['_email_key'] == email].iloc[0]
-                        new_row = df_copy[df_copy['_email_key'] == email].iloc[0]
-                        
-                        # Compare each column
-                        changed_cols = {}
-                        for col in REQUIRED_COLUMNS:
-                            old_val = str(old_row.get(col, '')).strip()
-                            new_val = str(new_row.get(col, '')).strip()
-                            if old_val != new_val:
-                                changed_cols[col] = {
-                                    'old': old_val if old_val else '(empty)',
-                                    'new': new_val if new_val else '(empty)'
-                                }
-                        
-                        if changed_cols:
-                            # Clean email from HTML tags if any
-                            clean_email = email
-                            if '<a href' in str(email):
-                                import re
-                                email_match = re.search(r'>(.*?)</a>', str(email))
-                                if email_match:
-                                    clean_email = email_match.group(1)
-                                else:
-                                    email_match = re.search(r'mailto:(.*?)[">]', str(email))
-                                    if email_match:
-                                        clean_email = email_match.group(1)
-                            
-                            changes_details.append({
-                                'email': clean_email,
-                                'name': str(new_row.get('Name', '')),
-                                'surname': str(new_row.get('Surname', '')),
-                                'changed_columns': changed_cols
-                            })
-                    
-                    # Remove temporary key column
-                    df_copy = df_copy.drop(columns=['_email_key'])
-                    rows_to_keep = rows_to_keep.drop(columns=['_email_key'])
-                    
-                    # Combine: keep old rows + new/updated rows
-                    if len(rows_to_keep) > 0:
-                        final_df = pd.concat([rows_to_keep, df_copy], ignore_index=True)
+    updates = preview_result.get('updates', [])
+    new_rows = preview_result.get('new_rows', [])
+    duplicates = preview_result.get('duplicates', [])
+    
+    # Show summary
+    col1, col2, col3 = st.columns(3)
+    with col1:
+        st.metric("Rows to Update", len([u for u in updates if u.get('changed_columns')]))
+    with col2:
+        st.metric("New Rows to Add", len(new_rows))
+    with col3:
+        st.metric("Duplicates", len(duplicates))
+    
+    # Per-file breakdown when several files are merged
+    if file_reports and len(file_reports) > 1:
+        st.markdown("**📁 Per-file breakdown** (later files win on repeated emails)")
+        st.dataframe(summarize_files(df_processed, preview_result, file_reports), use_container_width=True, hide_index=True)
+    
+    # One editable grid over the updates and new rows, a page at a time
+    review = get_review_frame(preview_result)
+    if len(review) > 0:
+        st.markdown("---")
+        st.subheader("📝 Review Changes")
+        render_review_grid(review)
+    
+    # Show duplicates (existing emails in append mode, rows without an email that are already stored in both modes)
+    if len(duplicates) > 0:
+        st.markdown("---")
+        st.subheader("⚠️ Duplicate Records (Will be Skipped)")
+        st.caption("These emails already exist in the database; rows without an email are skipped when an identical row is already stored")
+        st.dataframe(
+            pd.DataFrame([{'Name': dup.get('name', ''), 'Surname': dup.get('surname', ''), 'Email': dup.get('email', '')} for dup in duplicates]),
+            use_container_width=True, hide_index=True
+        )
+    
+    # Update button
+    st.markdown("---")
+    selected_count = sum(1 for v in st.session_state.selected_updates.values() if v)
+    if selected_count > 0:
+        if st.button("🔄 Update Selected Records", type="primary", use_container_width=True):
+            with st.spinner(f"🔄 Updating {selected_count} selected record(s)..."):
+                source = ", ".join(report['name'] for report in file_reports) if file_reports else ''
+                with (metrics.stage('update', rows_in=selected_count) if metrics else nullcontext({})) as stage:
+                    success, result = update_database(engine, df_processed, update_mode_lower, st.session_state.selected_updates, source)
+                    if success:
+                        stage['rows_out'] = result.get('updated_count', 0) + result.get('new_count', 0)
                     else:
-                        final_df = df_copy
-                    
-                    # Replace entire table with merged data
-                    final_df.to_sql(TABLE_NAME, engine, index=False, if_exists='replace', method='multi')
-                    
-                    updated_count = len([e for e in matching_emails if selected_items.get(e, True)]) if selected_items else len(matching_emails)
-                    new_count = len(new_email_set) if not selected_items else len([e for e in new_email_set if selected_items.get(e, True)])
-                    kept_count = len(rows_to_keep)
-                    
-                    return True, {
-                        'message': f"✅ Successfully updated database! Updated: {updated_count} rows, Added: {new_count} rows, Kept: {kept_count} existing rows.",
-                        'updated_count': updated_count,
-                        'new_count': new_count,
-                        'kept_count': kept_count,
-                        'changes': changes_details
-                    }
-                else:
-                    # No existing data, just insert new (filter by selected if provided)
-                    if selected_items:
-                        df_copy['_email_key'] = df_copy['Email'].astype(str).str.lower().str.strip()
-                        df_copy = df_copy[df_copy['_email_key'].isin([k for k, v in selected_items.items() if v])]
-                        df_copy = df_copy.drop(columns=['_email_key'])
-                    
-                    df_copy.to_sql(TABLE_NAME, engine, index=False, if_exists='replace', method='multi')
-                    return True, {
-                        'message': f"✅ Successfully added {len(df_copy)} new rows!",
-                        'updated_count': 0,
-                        'new_count': len(df_copy),
-                        'kept_count': 0,
-                        'changes': []
-                    }
+                        stage['status'] = 'failed'
+            
+            if isinstance(result, dict):
+                message = result.get('message', 'Update completed successfully')
+                if result.get('batch_id'):
+                    message += f" Logged as change batch {result['batch_id']} (can be rolled back in the 🕘 History tab)."
             else:
-                # Table doesn't exist, create it
-                if selected_items:
-                    df_copy['_email_key'] = df_copy['Email'].astype(str).str.lower().str.strip()
-                    df_copy = df_copy[df_copy['_email_key'].isin([k for k, v in selected_items.items() if v])]
-                    df_copy = df_copy.drop(columns=['_email_key'])
-                
-                df_copy.to_sql(TABLE_NAME, engine, index=False, if_exists='replace', method='multi')
-                return True, {
-                    'message': f"✅ Successfully created table and added {len(df_copy)} rows!",
-                    'updated_count': 0,
-                    'new_count': len(df_copy),
-                    'kept_count': 0,
-                    'changes': []
-                }
-        else:
-            # Append mode - add only new rows (skip duplicates based on Email)
-            if TABLE_NAME in inspector.get_table_names():
-                existing_df = load_data_from_db(engine)
-                
-                if len(existing_df) > 0:
-                    # Normalize Email for comparison
-                    df_copy['_email_key'] = df_copy['Email'].astype(str).str.lower().str.strip()
-                    existing_df['_email_key'] = existing_df['Email'].astype(str).str.lower().str.strip()
-                    
-                    # Filter based on selected_items
-                    if selected_items:
-                        df_copy = df_copy[df_copy['_email_key'].isin([k for k, v in selected_items.items() if v])]
-                    
-                    # Find which rows are new (not in existing database)
-                    existing_emails = set(existing_df['_email_key'])
-                    df_copy['_is_new'] = ~df_copy['_email_key'].isin(existing_emails)
-                    
-                    # Filter to only new rows (skip duplicates)
-                    df_new_only = df_copy[df_copy['_is_new']].copy()
-                    
-                    # Remove temporary columns
-                    df_new_only = df_new_only.drop(columns=['_email_key', '_is_new'])
-                    
-                    if len(df_new_only) > 0:
-                        df_new_only.to_sql(TABLE_NAME, engine, index=False, if_exists='append', method='multi')
-                        
-                        duplicates_count = (~df_copy['_is_new']).sum()
-                        new_rows_count = len(df_new_only)
-                        
-                        return True, {
-                            'message': f"✅ Successfully appended {new_rows_count} new rows!" + (f" (Skipped {duplicates_count} duplicate email(s))" if duplicates_count > 0 else ""),
-                            'updated_count': 0,
-                            'new_count': new_rows_count,
-                            'kept_count': len(existing_df),
-                            'duplicates_count': duplicates_count,
-                            'changes': []
-                        }
-                    else:
-                        return True, {
-                            'message': f"⚠️ No new rows to add. All selected rows already exist in database (duplicate emails).",
-                            'updated_count': 0,
-                            'new_count': 0,
-                            'kept_count': len(existing_df),
-                            'duplicates_count': len(df_copy),
-                            'changes': []
-                        }
-                else:
-                    # No existing data, just insert all (filter by selected if provided)
-                    if selected_items:
-                        df_copy['_email_key'] = df_copy['Email'].astype(str).str.lower().str.strip()
-                        df_copy = df_copy[df_copy['_email_key'].isin([k for k, v in selected_items.items() if v])]
-                        df_copy = df_copy.drop(columns=['_email_key'])
-                    
-                    df_copy.to_sql(TABLE_NAME, engine, index=False, if_exists='append', method='multi')
-                    return True, {
-                        'message': f"✅ Successfully appended {len(df_copy)} rows!",
-                        'updated_count': 0,
-                        'new_count': len(df_copy),
-                        'kept_count': 0,
-                        'duplicates_count': 0,
-                        'changes': []
-                    }
+                message = result
+            
+            if success:
+                with (metrics.stage('snapshot') if metrics else nullcontext({})):
+                    refresh_snapshot_after_write(engine)
+                # Remember headers that were matched by similarity for the next upload
+                if learned_headers:
+                    try:
+                        save_header_mappings(engine, learned_headers)
+                        add_learned_synonyms(learned_headers)
+                    except Exception as e:
+                        message += f" ⚠️ Could not save learned column mappings: {str(e)}"
+                st.session_state.db_updated = True
+                st.session_state.update_message = message
+                if file_reports and len(file_reports) > 1:
+                    st.session_state.update_summary = summarize_files(
+                        df_processed, preview_result, file_reports, st.session_state.selected_updates
+                    )
+                # Clear selections; the preview is rebuilt because the database changed
+                st.session_state.selected_updates = {}
+                st.rerun()
             else:
-                # Table doesn't exist, create it
-                if selected_items:
-                    df_copy['_email_key'] = df_copy['Email'].astype(str).str.lower().str.strip()
-                    df_copy = df_copy[df_copy['_email_key'].isin([k for k, v in selected_items.items() if v])]
-                    df_copy = df_copy.drop(columns=['_email_key'])
-                
-                df_copy.to_sql(TABLE_NAME, engine, index=False, if_exists='replace', method='multi')
-                return True, {
-                    'message': f"✅ Successfully created table and added {len(df_copy)} rows!",
-                    'updated_count': 0,
-                    'new_count': len(df_copy),
-                    'kept_count': 0,
-                    'duplicates_count': 0,
-                    'changes': []
-                }
-    except Exception as e:
-        return False, f"❌ Error: {str(e)}"
-
-def get_db_stats(engine):
-    """Get database statistics"""
-    try:
-        inspector = inspect(engine)
-        if TABLE_NAME in inspector.get_table_names():
-            with engine.connect() as conn:
-                result = conn.execute(text(f"SELECT COUNT(*) FROM {TABLE_NAME}"))
-                count = result.scalar()
-            return {'exists': True, 'row_count': count}
-        return {'exists': False, 'row_count': 0}
-    except:
-        return {'exists': False, 'row_count': 0}
-
-def delete_row_from_db(engine, row_data_dict):
-    """Delete a row from database based on all column values"""
-    try:
-        conditions = []
-        params = {}
-        for idx, (col, val) in enumerate(row_data_dict.items()):
-            param_name = f"val_{idx}"
-            conditions.append(f'"{col}" = :{param_name}')
-            params[param_name] = val
-        
-        delete_query = f'DELETE FROM {TABLE_NAME} WHERE {" AND ".join(conditions)}'
-        
-        with engine.connect() as conn:
-            conn.execute(text(delete_query), params)
-            conn.commit()
-        
-        return True, "Row deleted successfully!"
-    except Exception as e:
-        return False, f"Error deleting row: {str(e)}"
+                st.error(message)
+    else:
+        st.warning("⚠️ No records selected. Please tick records in the Select column of the review grid.")
 
-def update_row_in_db(engine, old_row_data, new_row_data):
-    """Update a row in database"""
-    try:
-        # Build WHERE clause from old row data
-        conditions = []
-        params = {}
-        for idx, (col, val) in enumerate(old_row_data.items()):
-            param_name = f"where_{idx}"
-            conditions.append(f'"{col}" = :{param_name}')
-            params[param_name] = val
-        
-        # Build SET clause from new row data
-        set_clauses = []
-        for idx, (col, val) in enumerate(new_row_data.items()):
-            param_name = f"set_{idx}"
-            set_clauses.append(f'"{col}" = :{param_name}')
-            params[param_name] = val
-        
-        update_query = f'UPDATE {TABLE_NAME} SET {", ".join(set_clauses)} WHERE {" AND ".join(conditions)}'
-        
-        with engine.connect() as conn:
-            conn.execute(text(update_query), params)
-            conn.commit()
+def render_history(engine):
+    """Change log browser: recent batches, their rows, batch rollback, data as of a batch and per-email history"""
+    st.header("🕘 Change History")
+    st.caption("Every upload, edit and delete is logged with the rows before and after the change.")
+    if 'history_message' in st.session_state:
+        st.success(st.session_state.pop('history_message'))
+    
+    batches = list_change_batches(engine)
+    if len(batches) == 0:
+        st.info("📭 **No changes logged yet.** Uploads, edits and deletes will appear here.")
+        return
+    
+    st.subheader("📜 Change Batches")
+    st.dataframe(
+        batches.rename(columns={
+            'batch_id': 'Batch', 'operation': 'Operation', 'source': 'Source', 'created_at': 'Time',
+            'rollback_of': 'Rolls Back', 'rolled_back_by': 'Rolled Back By', 'changes': 'Rows'
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    batch_labels = {
+        int(row.batch_id): f"Batch {row.batch_id} - {row.operation}{f' ({row.source})' if row.source else ''} - {row.changes} row(s)"
+        for row in batches.itertuples()
+    }
+    selected_batch = st.selectbox(
+        "Select a batch to inspect:",
+        options=list(batch_labels),
+        format_func=lambda batch_id: batch_labels[batch_id],
+        key="history_batch_selector"
+    )
+    
+    if selected_batch is not None:
+        try:
+            st.dataframe(load_batch_changes(engine, selected_batch), use_container_width=True, hide_index=True)
+        except Exception as e:
+            st.error(f"❌ Error loading batch: {str(e)}")
         
-        return True, "Row updated successfully!"
-    except Exception as e:
-        return False, f"Error updating row: {str(e)}"
+        batch_row = batches[batches['batch_id'] == selected_batch].iloc[0]
+        if pd.notna(batch_row['rolled_back_by']):
+            st.info(f"↩️ This batch was rolled back by batch {batch_row['rolled_back_by']}.")
+        else:
+            confirm_key = f"confirm_rollback_{selected_batch}"
+            if not st.session_state.get(confirm_key):
+                if st.button(f"↩️ Roll Back Batch {selected_batch}", key=f"rollback_btn_{selected_batch}"):
+                    st.session_state[confirm_key] = True
+                    st.rerun()
+            else:
+                st.warning(f"⚠️ **Roll back batch {selected_batch}?** Its {batch_row['changes']} row change(s) will be undone.")
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("✅ Confirm Rollback", type="primary", key=f"confirm_rollback_btn_{selected_batch}"):
+                        with st.spinner("Rolling back..."):
+                            success, message = rollback_change_batch(engine, selected_batch)
+                        st.session_state[confirm_key] = False
+                        if success:
+                            refresh_snapshot_after_write(engine)
+                            st.session_state.history_message = message
+                            st.rerun()
+                        else:
+                            st.error(message)
+                with col2:
+                    if st.button("❌ Cancel", key=f"cancel_rollback_btn_{selected_batch}"):
+                        st.session_state[confirm_key] = False
+                        st.rerun()
+    
+    st.markdown("---")
+    st.subheader("⏪ Data As Of a Batch")
+    asof_col1, asof_col2 = st.columns([3, 1])
+    with asof_col1:
+        asof_batch = st.selectbox(
+            "Show the records as they were right after:",
+            options=list(batch_labels) + [0],
+            format_func=lambda batch_id: batch_labels.get(batch_id, "Before the first logged change"),
+            key="history_asof_selector"
+        )
+    with asof_col2:
+        st.write("")
+        st.write("")
+        show_asof = st.button("📂 Load", key="history_asof_btn")
+    if show_asof:
+        with st.spinner("Rebuilding records from the change log..."):
+            try:
+                df_asof = load_rows_as_of(engine, asof_batch)
+                st.session_state.history_asof = (asof_batch, get_data_version(engine), df_asof)
+            except Exception as e:
+                st.error(f"❌ Error loading records: {str(e)}")
+    
+    # Kept until another batch is chosen or the data changes
+    asof = st.session_state.get('history_asof')
+    if asof and asof[0] == asof_batch and asof[1] == get_data_version(engine):
+        df_asof = asof[2]
+        st.caption(f"{len(df_asof)} record(s)")
+        st.dataframe(df_asof.head(1000), use_container_width=True, height=400)
+        st.download_button(
+            label="📥 Download as CSV",
+            data=df_asof.to_csv(index=False).encode('utf-8'),
+            file_name=f"database_as_of_batch_{asof_batch}.csv",
+            mime="text/csv",
+            key="history_asof_download"
+        )
+    
+    st.markdown("---")
+    st.subheader("🔎 History of an Email")
+    history_email = st.text_input("Email:", key="history_email_input")
+    if history_email:
+        try:
+            df_history = load_email_history(engine, history_email)
+            if len(df_history) > 0:
+                st.dataframe(df_history, use_container_width=True, hide_index=True)
+            else:
+                st.info("No logged changes for this email.")
+        except Exception as e:
+            st.error(f"❌ Error loading history: {str(e)}")
 
-def delete_entire_database(engine):
-    """Delete the entire database table"""
+def render_performance(engine):
+    """Recent upload runs with per-stage timings, stage totals and the Prometheus text export"""
+    st.header("⏱️ Upload Performance")
+    st.caption("Wall time, rows, bytes read and peak memory of each upload stage (app and command line).")
+    
     try:
-        inspector = inspect(engine)
-        if TABLE_NAME in inspector.get_table_names():
-            with engine.connect() as conn:
-                conn.execute(text(f'DROP TABLE IF EXISTS {TABLE_NAME}'))
-                conn.commit()
-            return True, "Database table deleted successfully!"
-        else:
-            return False, "Table does not exist"
+        df_metrics = load_recent_metrics(engine)
+        df_totals = load_metrics_totals(engine)
     except Exception as e:
-        return False, f"Error deleting database: {str(e)}"
+        st.error(f"❌ Error loading metrics: {str(e)}")
+        return
+    if len(df_metrics) == 0:
+        st.info("📭 **No uploads measured yet.** Stage timings appear here after the next upload.")
+        return
+    
+    # One row per run, one column per stage
+    stage_seconds = df_metrics.pivot_table(index='run_id', columns='stage', values='seconds', aggfunc='sum')
+    runs = df_metrics.groupby('run_id', sort=False).agg(
+        Started=('started_at', 'min'),
+        Source=('source', 'first'),
+        Rows=('rows_out', 'max'),
+        Bytes=('bytes_read', 'max'),
+        PeakRSS=('peak_rss', 'max'),
+        Failed=('status', lambda status: (status == 'failed').any()),
+        Total=('seconds', 'sum')
+    )
+    runs['Peak RSS (MB)'] = (runs.pop('PeakRSS') / (1024 * 1024)).round(1)
+    runs = runs.join(stage_seconds.round(3)).rename(columns={'Total': 'Total (s)'})
+    
+    st.subheader("📋 Recent Runs")
+    st.dataframe(runs.iloc[::-1].reset_index(drop=True), use_container_width=True, hide_index=True)
+    
+    st.subheader("📊 Stage Totals")
+    df_totals = df_totals.assign(avg_seconds=(df_totals['seconds'] / df_totals['runs']).round(4))
+    st.bar_chart(df_totals.set_index('stage')['avg_seconds'])
+    st.dataframe(
+        df_totals.rename(columns={
+            'stage': 'Stage', 'runs': 'Runs', 'seconds': 'Total (s)', 'rows_out': 'Rows Out', 'bytes_read': 'Bytes Read',
+            'failures': 'Failures', 'last_seconds': 'Last (s)', 'peak_rss': 'Peak RSS (bytes)', 'avg_seconds': 'Average (s)'
+        }),
+        use_container_width=True,
+        hide_index=True
+    )
+    
+    st.download_button(
+        label="📥 Download Prometheus metrics",
+        data=format_prometheus(df_totals).encode('utf-8'),
+        file_name="bulkupdate_metrics.prom",
+        mime="text/plain",
+        key="prometheus_download"
+    )
 
 def main():
     st.title("📊 Excel Bulk Update Tool - Auto Upload")
@@ -732,6 +616,13 @@ def main():
         st.error("❌ Failed to connect to database!")
         st.stop()
     
+    # Bring tables created by older versions up to the current schema
+    try:
+        with engine.begin() as conn:
+            ensure_table(conn, create=False)
+    except Exception as e:
+        st.error(f"❌ Database migration error: {str(e)}")
+    
     # Sidebar with database info and settings
     with st.sidebar:
         st.header("📊 Database Info")
@@ -742,7 +633,7 @@ def main():
             st.metric("Total Records", stats['row_count'])
         else:
             st.info("📭 Database empty - upload file to create")
-        
+            
             st.markdown("---")
         st.header("📋 Required Columns")
         for col in REQUIRED_COLUMNS:
@@ -754,7 +645,7 @@ def main():
         # Delete entire database option
         if stats['exists'] and stats['row_count'] > 0:
             st.warning("⚠️ **Danger Zone**")
-            st.caption(f"This will permanently delete all {stats['row_count']} records from the database.")
+            st.caption(f"This will delete all {stats['row_count']} records from the database (the deletion can be rolled back in the 🕘 History tab).")
             
             # Use session state for confirmation
             if 'confirm_delete_db' not in st.session_state:
@@ -765,13 +656,14 @@ def main():
                     st.session_state.confirm_delete_db = True
                     st.rerun()
             else:
-                st.error("⚠️ **Are you sure?** This action cannot be undone!")
+                st.error("⚠️ **Are you sure?** All records will be removed!")
                 col1, col2 = st.columns(2)
                 with col1:
                     if st.button("✅ Confirm Delete", type="primary", key="confirm_delete_btn"):
                         with st.spinner("Deleting database..."):
                             success, message = delete_entire_database(engine)
                         if success:
+                            refresh_snapshot_after_write(engine)
                             st.success(message)
                             st.session_state.confirm_delete_db = False
                             st.rerun()
@@ -786,7 +678,7 @@ def main():
             st.info("📭 No data to delete")
     
     # Main content area
-    tab1, tab2 = st.tabs(["📤 Upload & Auto Update", "📋 View Database"])
+    tab1, tab2, tab3, tab4 = st.tabs(["📤 Upload & Auto Update", "📋 View Database", "🕘 History", "⏱️ Performance"])
     
     with tab1:
         st.header("Drag & Drop Excel File")
@@ -810,522 +702,232 @@ def main():
         else:  # Append
             st.info("💡 **Append Mode (No Duplicates):** This will **add only NEW records** to the existing database. Records with duplicate Email addresses will be **skipped automatically**. Existing records will be kept unchanged, and only new emails will be added.")
         
-        # File uploader with auto-update
-        uploaded_file = st.file_uploader(
-            "Drop your Excel file here (supports .xlsx, .xls)",
+        # File uploader with auto-update (several files are merged into one update)
+        uploaded_files = st.file_uploader(
+            "Drop your Excel file(s) here (supports .xlsx, .xls)",
             type=['xlsx', 'xls'],
-            help="The file will be automatically processed and updated to database"
+            accept_multiple_files=True,
+            help="The files will be automatically processed and updated to database. With several files, later files win on repeated emails."
         )
         
-        # Auto-process when file is uploaded
-        if uploaded_file is not None:
-            # Check if this is a new file
-            file_id = f"{uploaded_file.name}_{uploaded_file.size}"
-            is_new_file = st.session_state.last_file != file_id
+        # Auto-process when files are uploaded
+        if uploaded_files:
+            # Result of the last update survives the rerun that follows it
+            if 'update_message' in st.session_state:
+                st.success(st.session_state.pop('update_message'))
+                if 'update_summary' in st.session_state:
+                    st.dataframe(st.session_state.pop('update_summary'), use_container_width=True, hide_index=True)
+                st.balloons()
             
-            # If we have preview data and it's the same file, show preview directly
-            if st.session_state.preview_data is not None and not is_new_file and 'df_processed' in st.session_state:
-                # Check if update mode matches
-                stored_mode = st.session_state.get('update_mode', update_mode_lower)
-                if stored_mode != update_mode_lower:
-                    # Update mode changed, regenerate preview
-                    with st.spinner("🔄 Regenerating preview for new update mode..."):
-                        df_processed = st.session_state.df_processed
-                        preview_result = preview_changes(engine, df_processed, update_mode_lower)
-                        st.session_state.preview_data = preview_result
-                        st.session_state.update_mode = update_mode_lower
-                        st.session_state.selected_updates = {}  # Reset selections
-                else:
-                    # Use existing preview data
-                    preview_result = st.session_state.preview_data
-                    df_processed = st.session_state.df_processed
-                
-                if 'error' not in preview_result:
-                    updates = preview_result.get('updates', [])
-                    new_rows = preview_result.get('new_rows', [])
-                    duplicates = preview_result.get('duplicates', [])
-                    
-                    # Show summary
-                    st.success(f"✅ File loaded successfully! Found {len(df_processed)} total rows")
-                    st.subheader("📊 Data Preview")
-                    st.dataframe(df_processed.head(10), use_container_width=True)
+            upload_cache = get_upload_cache()
+            metrics = get_upload_metrics(engine, uploaded_files)
+            uploads = []  # one dict per file, in upload order
+            open_workbooks = {}  # file_hash -> WorkbookSession opened in this run
+            tmp_file_paths = []
+            try:
+                for uploaded_file in uploaded_files:
+                    # Validate file format
+                    is_valid_file, file_extension, file_result = validate_file_format(uploaded_file)
                     
-                    st.markdown("---")
-                    st.subheader("🔍 Preview Changes")
+                    if not is_valid_file:
+                        st.error(f"❌ **Error in {uploaded_file.name}:** {file_result}")
+                        st.stop()
                     
-                    # Initialize selected_updates if not exists
-                    if 'selected_updates' not in st.session_state:
-                        st.session_state.selected_updates = {}
+                    file_bytes = uploaded_file.getvalue()
+                    upload = {
+                        'name': uploaded_file.name,
+                        'bytes': file_bytes,
+                        'hash': hash_upload(file_bytes),
+                        'extension': file_extension,
+                        'engine_name': file_result
+                    }
                     
-                    # Show summary
-                    col1, col2, col3 = st.columns(3)
-                    with col1:
-                        st.metric("Rows to Update", len([u for u in updates if u.get('changed_columns')]))
-                    with col2:
-                        st.metric("New Rows to Add", len(new_rows))
-                    with col3:
-                        st.metric("Duplicates", len(duplicates))
+                    # Sheet names are cached by content, so reruns skip the temp file and the workbook
+                    sheet_names = upload_cache.get(('sheets', upload['hash']))
+                    if sheet_names is None:
+                        with st.spinner(f"🔄 Processing {uploaded_file.name}..."):
+                            success, sheet_names, workbook = open_upload(upload, open_workbooks, tmp_file_paths, metrics)
+                        if not success:
+                            st.stop()
+                        upload_cache.put(('sheets', upload['hash']), sheet_names)
                     
-                    # Show updates with tick/cross
-                    if len(updates) > 0:
-                        st.markdown("---")
-                        st.subheader("📝 Records to Update")
+                    # If multiple sheets, let user choose
+                    if len(sheet_names) > 1:
+                        selected_sheets = st.multiselect(
+                            f"📋 Select sheet(s) to process from **{uploaded_file.name}** (can select multiple for bulk upload):",
+                            options=sheet_names,
+                            default=[sheet_names[0]],
+                            key=f"sheet_selector_{upload['hash']}"
+                        )
                         
-                        for idx, update in enumerate(updates):
-                            if not update.get('changed_columns'):
-                                continue  # Skip if no changes
-                            
-                            email_key = update.get('email_key', '')
-                            # Initialize selection if not set (default: True)
-                            if email_key not in st.session_state.selected_updates:
-                                st.session_state.selected_updates[email_key] = True
-                            
-                            with st.container():
-                                col1, col2 = st.columns([10, 1])
-                                with col1:
-                                    st.markdown(f"**{idx+1}. {update.get('name', '')} {update.get('surname', '')}** ({update.get('email', '')})")
-                                    # Show changed columns
-                                    changed_cols = update.get('changed_columns', {})
-                                    if changed_cols:
-                                        change_text = []
-                                        for col_name, col_change in changed_cols.items():
-                                            old_val = col_change.get('old', '')
-                                            new_val = col_change.get('new', '')
-                                            change_text.append(f"**{col_name}:** `{old_val}` → `{new_val}`")
-                                        st.markdown(" | ".join(change_text))
-                                with col2:
-                                    # Tick/Cross buttons
-                                    if st.button("✅", key=f"tick_{email_key}_{idx}", help="Update this row"):
-                                        st.session_state.selected_updates[email_key] = True
-                                        st.rerun()
-                                    if st.button("❌", key=f"cross_{email_key}_{idx}", help="Cancel this row"):
-                                        st.session_state.selected_updates[email_key] = False
-                                        st.rerun()
-                                    
-                                    # Show current status
-                                    if st.session_state.selected_updates.get(email_key, True):
-                                        st.success("✓ Selected")
-                                    else:
-                                        st.error("✗ Cancelled")
-                                
-                                st.markdown("---")
+                        if not selected_sheets:
+                            st.warning(f"⚠️ Please select at least one sheet to process from {uploaded_file.name}.")
+                            st.stop()
+                    else:
+                        selected_sheets = [sheet_names[0]]
+                        st.info(f"📋 Using sheet: **{sheet_names[0]}** from {uploaded_file.name}")
                     
-                    # Show new rows with tick/cross
-                    if len(new_rows) > 0:
-                        st.markdown("---")
-                        st.subheader("➕ New Records to Add")
+                    upload['sheets'] = tuple(selected_sheets)
+                    upload['parsed'] = upload_cache.get(('parsed', upload['hash'], upload['sheets']))
+                    uploads.append(upload)
+                
+                # Parsed and validated sheets, cached per file content and sheet selection
+                to_parse = [upload for upload in uploads if upload['parsed'] is None]
+                if to_parse:
+                    with st.spinner(f"🔄 Processing {len(to_parse)} file(s)..."):
+                        # Header layouts resolved in earlier sessions match by lookup (loaded before workers start)
+                        if engine is not None:
+                            add_learned_synonyms(load_header_mappings(engine))
+                        jobs = []
+                        for upload in to_parse:
+                            workbook = open_workbooks.get(upload['hash'])
+                            if workbook is None:
+                                success, _, workbook = open_upload(upload, open_workbooks, tmp_file_paths, metrics)
+                                if not success:
+                                    st.stop()
+                            jobs.append((workbook, list(upload['sheets'])))
                         
-                        for idx, new_row in enumerate(new_rows):
-                            email_key = new_row.get('email_key', '')
-                            # Initialize selection if not set (default: True)
-                            if email_key not in st.session_state.selected_updates:
-                                st.session_state.selected_updates[email_key] = True
-                            
-                            with st.container():
-                                col1, col2 = st.columns([10, 1])
-                                with col1:
-                                    row_data = new_row.get('row', {})
-                                    st.markdown(f"**{idx+1}. {new_row.get('name', '')} {new_row.get('surname', '')}** ({new_row.get('email', '')})")
-                                    row_text = []
-                                    for col in REQUIRED_COLUMNS:
-                                        val = row_data.get(col, '')
-                                        row_text.append(f"**{col}:** `{val}`")
-                                    st.markdown(" | ".join(row_text))
-                                with col2:
-                                    # Tick/Cross buttons
-                                    if st.button("✅", key=f"tick_new_{email_key}_{idx}", help="Add this row"):
-                                        st.session_state.selected_updates[email_key] = True
-                                        st.rerun()
-                                    if st.button("❌", key=f"cross_new_{email_key}_{idx}", help="Cancel this row"):
-                                        st.session_state.selected_updates[email_key] = False
-                                        st.rerun()
-                                    
-                                    # Show current status
-                                    if st.session_state.selected_updates.get(email_key, True):
-                                        st.success("✓ Selected")
-                                    else:
-                                        st.error("✗ Cancelled")
-                                
-                                st.markdown("---")
-                    
-                    # Show duplicates (for append mode)
-                    if len(duplicates) > 0:
-                        st.markdown("---")
-                        st.subheader("⚠️ Duplicate Records (Will be Skipped)")
-                        for dup in duplicates:
-                            st.info(f"**{dup.get('name', '')} {dup.get('surname', '')}** ({dup.get('email', '')}) - Already exists in database")
+                        # Files are parsed in parallel; later sheets win on repeated emails within a file
+                        with metrics.stage('parse', bytes_read=sum(len(upload['bytes']) for upload in to_parse)) as stage:
+                            for upload, parsed in zip(to_parse, combine_files(jobs)):
+                                upload['parsed'] = parsed
+                                upload_cache.put(('parsed', upload['hash'], upload['sheets']), parsed, frame_size(parsed[0]))
+                            stage['rows_out'] = sum(len(upload['parsed'][0]) for upload in to_parse if upload['parsed'][0] is not None)
+            except Exception as e:
+                st.error(f"❌ Error processing file: {str(e)}")
+                import traceback
+                with st.expander("🔍 Error Details"):
+                    st.code(traceback.format_exc())
+                st.stop()
+            finally:
+                # Release the workbook handles before removing the temp files
+                for workbook in open_workbooks.values():
+                    workbook.close()
+                for tmp_file_path in tmp_file_paths:
+                    remove_temp_file(tmp_file_path)
+            
+            # Show validation results per file
+            file_reports = []
+            for upload in uploads:
+                df_file, processed_sheets, failed_sheets = upload['parsed']
+                label = f" in {upload['name']}" if len(uploads) > 1 else ""
+                
+                if failed_sheets:
+                    st.error(f"❌ **Validation failed for {len(failed_sheets)} sheet(s){label}:**")
+                    for failed in failed_sheets:
+                        with st.expander(f"❌ Sheet: {failed['name']}"):
+                            st.error(f"**Error:** {failed['error']}")
+                            if failed['missing_cols']:
+                                st.warning(f"⚠️ Missing columns: {', '.join(failed['missing_cols'])}")
+                                st.info(f"**Required columns:** {', '.join(REQUIRED_COLUMNS)}")
+                
+                # Show successful sheets
+                if processed_sheets:
+                    st.success(f"✅ **Successfully processed {len(processed_sheets)} sheet(s){label}!**")
                     
-                    # Update button
-                    st.markdown("---")
-                    selected_count = sum(1 for v in st.session_state.selected_updates.values() if v)
-                    if selected_count > 0:
-                        if st.button("🔄 Update Selected Records", type="primary", use_container_width=True):
-                            with st.spinner(f"🔄 Updating {selected_count} selected record(s)..."):
-                                result = update_database(engine, df_processed, update_mode_lower, st.session_state.selected_updates)
-                            
-                            if isinstance(result, tuple):
-                                success, message = result
-                                result_dict = None
-                            else:
-                                success, result_dict = result
-                                if isinstance(result_dict, dict):
-                                    message = result_dict.get('message', 'Update completed successfully')
-                                elif isinstance(result_dict, str):
-                                    message = result_dict
-                                else:
-                                    message = 'Update completed successfully'
-                            
-                            if success:
-                                st.success(message)
-                                st.balloons()
-                                st.session_state.db_updated = True
-                                # Clear preview and selections
-                                st.session_state.preview_data = None
-                                st.session_state.selected_updates = {}
-                                st.session_state.df_processed = None
-                                st.rerun()
-                            else:
-                                st.error(message)
-                    else:
-                        st.warning("⚠️ No records selected. Please select records to update using ✅/❌ buttons.")
+                    # Show column mapping only if there are differences
+                    for sheet_info in processed_sheets:
+                        mapping_changes = {k: v for k, v in sheet_info['mapping'].items() if k != v}
+                        if mapping_changes:
+                            st.write(f"**Sheet '{sheet_info['name']}' column mapping:**")
+                            for req_col, found_col in mapping_changes.items():
+                                st.write(f"  • '{req_col}' → '{found_col}'")
+                
+                file_reports.append({
+                    'name': upload['name'],
+                    'sheets': len(processed_sheets),
+                    'rows': sum(s['rows'] for s in processed_sheets),
+                    'failed_sheets': len(failed_sheets)
+                })
+            
+            # Later files win on repeated emails (timed only when files were parsed in this run)
+            with (metrics.stage('merge', rows_in=sum(report['rows'] for report in file_reports)) if to_parse else nullcontext({})) as stage:
+                df_processed = merge_files([(upload['name'], upload['parsed'][0]) for upload in uploads])
+                stage['rows_out'] = 0 if df_processed is None else len(df_processed)
+            # Only stop if every sheet of every file failed
+            if df_processed is None:
+                st.stop()
+            processed_count = sum(report['sheets'] for report in file_reports)
+            
+            # Headers matched by similarity are remembered only once the update using them succeeds
+            learned_headers = {}
+            for upload in uploads:
+                for sheet_info in upload['parsed'][1]:
+                    learned_headers.update(learned_synonyms(sheet_info['mapping']))
             
-            elif is_new_file:
-                # New file - process it
-                st.session_state.last_file = file_id
-                # Clear old preview data
-                st.session_state.preview_data = None
+            st.info(f"📋 **Found columns in Excel:** {', '.join(REQUIRED_COLUMNS)}")
+            st.info(f"📊 **Total rows from {processed_count} sheet(s) in {len(uploads)} file(s):** {len(df_processed)}")
+            
+            # Display preview
+            st.success(f"✅ File(s) loaded successfully! Found {len(df_processed)} total rows")
+            st.subheader("📊 Data Preview")
+            preview_columns = REQUIRED_COLUMNS + (['_source_file'] if len(uploads) > 1 else [])
+            st.dataframe(
+                df_processed[preview_columns].head(10).rename(columns={'_source_file': 'Source File'}),
+                use_container_width=True
+            )
+            
+            # Show summary of processed sheets
+            if processed_count > 1:
+                st.markdown("---")
+                st.subheader("📋 Processed Sheets Summary")
+                summary_data = {
+                    'File': [upload['name'] for upload in uploads for s in upload['parsed'][1]],
+                    'Sheet Name': [s['name'] for upload in uploads for s in upload['parsed'][1]],
+                    'Rows': [s['rows'] for upload in uploads for s in upload['parsed'][1]]
+                }
+                summary_df = pd.DataFrame(summary_data)
+                st.dataframe(summary_df, use_container_width=True, hide_index=True)
+            
+            # Preview changes before updating
+            st.markdown("---")
+            st.subheader("🔍 Preview Changes")
+            
+            # Preview is cached per files, sheets and mode, and recomputed whenever the database changed
+            preview_key = (tuple((upload['hash'], upload['sheets']) for upload in uploads), update_mode_lower)
+            data_version = get_data_version(engine)
+            cached_preview = upload_cache.get(('preview',) + preview_key)
+            if cached_preview is not None and cached_preview['data_version'] == data_version:
+                preview_result = cached_preview['result']
+            else:
+                with st.spinner("🔄 Analyzing changes..."), metrics.stage('preview', rows_in=len(df_processed)) as stage:
+                    preview_result = preview_changes(engine, df_processed, update_mode_lower)
+                    stage['rows_out'] = len(preview_result.get('updates', [])) + len(preview_result.get('new_rows', []))
+                    if 'error' in preview_result:
+                        stage['status'] = 'failed'
+                if 'error' not in preview_result:
+                    upload_cache.put(
+                        ('preview',) + preview_key,
+                        {'data_version': data_version, 'result': preview_result},
+                        frame_size(df_processed)
+                    )
+            
+            # Different files, sheets or mode: start from a fresh selection
+            if st.session_state.preview_key != preview_key:
+                st.session_state.preview_key = preview_key
                 st.session_state.selected_updates = {}
-                st.session_state.df_processed = None
-                
-                try:
-                    with st.spinner("🔄 Processing file..."):
-                        # Validate file format
-                        is_valid_file, file_extension, file_result = validate_file_format(uploaded_file)
-                        
-                        if not is_valid_file:
-                            st.error(f"❌ **Error:** {file_result}")
-                            st.stop()
-                        
-                        engine_name = file_result
-                        
-                        # Save file to temp for processing
-                        with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{file_extension}') as tmp_file:
-                            uploaded_file.seek(0)
-                            tmp_file.write(uploaded_file.read())
-                            tmp_file_path = tmp_file.name
-                        
-                        try:
-                            # Read Excel file - get sheet names
-                            success, sheet_names, engine_name, error_msg, error_details = read_excel_file(
-                                tmp_file_path, file_extension, engine_name
-                            )
-                            
-                            if not success:
-                                st.error(error_msg)
-                                if error_details:
-                                    st.warning(error_details)
-                                    if "Encrypted" in error_msg or "Password-Protected" in error_msg:
-                                        st.markdown("**📋 What this means:**")
-                                        st.info("• The file might be password-protected")
-                                        st.info("• The file might be saved as an 'Internal' Excel format")
-                                        st.info("• The file might have security/permission restrictions")
-                                    else:
-                                        st.markdown("**🔧 Solution:** The file needs to be properly saved in Excel.")
-                                        st.info("**Please follow these steps:**")
-                                        st.info("1. ✅ Open the file in Excel")
-                                        st.info("2. ✅ Click **File** → **Save As**")
-                                        st.info("3. ✅ In the dropdown, select **'Excel Workbook (*.xlsx)'**")
-                                        st.info("4. ✅ Click **Save** (you can overwrite the file or use a new name)")
-                                        st.info("5. ✅ Upload the newly saved file here")
-                                st.stop()
-                            
-                            # If multiple sheets, let user choose
-                            if len(sheet_names) > 1:
-                                selected_sheets = st.multiselect(
-                                    "📋 Select sheet(s) to process (can select multiple for bulk upload):",
-                                    options=sheet_names,
-                                    default=[sheet_names[0]],
-                                    key="sheet_selector"
-                                )
-                                
-                                if not selected_sheets:
-                                    st.warning("⚠️ Please select at least one sheet to process.")
-                                    st.stop()
-                            else:
-                                selected_sheets = [sheet_names[0]]
-                                st.info(f"📋 Using sheet: **{sheet_names[0]}**")
-                            
-                            # Process selected sheets
-                            all_processed_data = []
-                            processed_sheets = []
-                            failed_sheets = []
-                            
-                            for sheet_name in selected_sheets:
-                                # Process each sheet
-                                success, df_processed, error_msg, missing_cols, column_mapping = process_sheet(
-                                    tmp_file_path, sheet_name, engine_name
-                                )
-                                
-                                if success:
-                                    all_processed_data.append(df_processed)
-                                    processed_sheets.append({
-                                        'name': sheet_name,
-                                        'rows': len(df_processed),
-                                        'mapping': column_mapping
-                                    })
-                                else:
-                                    failed_sheets.append({
-                                        'name': sheet_name,
-                                        'error': error_msg,
-                                        'missing_cols': missing_cols
-                                    })
-                            
-                            # Show validation results
-                            if failed_sheets:
-                                st.error(f"❌ **Validation failed for {len(failed_sheets)} sheet(s):**")
-                                for failed in failed_sheets:
-                                    with st.expander(f"❌ Sheet: {failed['name']}"):
-                                        st.error(f"**Error:** {failed['error']}")
-                                        if failed['missing_cols']:
-                                            st.warning(f"⚠️ Missing columns: {', '.join(failed['missing_cols'])}")
-                                            st.info(f"**Required columns:** {', '.join(REQUIRED_COLUMNS)}")
-                                
-                                # Only stop if all sheets failed
-                                if len(failed_sheets) == len(selected_sheets):
-                                    st.stop()
-                            
-                            # Show successful sheets
-                            if processed_sheets:
-                                st.success(f"✅ **Successfully processed {len(processed_sheets)} sheet(s)!**")
-                                
-                                # Show column mapping only if there are differences
-                                for sheet_info in processed_sheets:
-                                    mapping_changes = {k: v for k, v in sheet_info['mapping'].items() if k != v}
-                                    if mapping_changes:
-                                        st.write(f"**Sheet '{sheet_info['name']}' column mapping:**")
-                                        for req_col, found_col in mapping_changes.items():
-                                            st.write(f"  • '{req_col}' → '{found_col}'")
-                            
-                            # Combine all processed data from all sheets
-                            if all_processed_data:
-                                df_processed = pd.concat(all_processed_data, ignore_index=True)
-                                    
-                                # Remove duplicates based on Email (if any sheet had duplicate emails)
-                                df_processed = df_processed.drop_duplicates(subset=['Email'], keep='last')
-                                
-                                st.info(f"📋 **Found columns in Excel:** {', '.join(REQUIRED_COLUMNS)}")
-                                st.info(f"📊 **Total rows from {len(processed_sheets)} sheet(s):** {len(df_processed)}")
-                                
-                                # Display preview
-                                st.success(f"✅ File loaded successfully! Found {len(df_processed)} total rows")
-                                st.subheader("📊 Data Preview")
-                                st.dataframe(df_processed.head(10), use_container_width=True)
-                                
-                                # Show summary of processed sheets
-                                if len(processed_sheets) > 1:
-                                    st.markdown("---")
-                                    st.subheader("📋 Processed Sheets Summary")
-                                    summary_data = {
-                                        'Sheet Name': [s['name'] for s in processed_sheets],
-                                        'Rows': [s['rows'] for s in processed_sheets]
-                                    }
-                                    summary_df = pd.DataFrame(summary_data)
-                                    st.dataframe(summary_df, use_container_width=True, hide_index=True)
-                                
-                                # Preview changes before updating
-                                st.markdown("---")
-                                st.subheader("🔍 Preview Changes")
-                                
-                                # Store processed data and preview
-                                with st.spinner("🔄 Analyzing changes..."):
-                                    preview_result = preview_changes(engine, df_processed, update_mode_lower)
-                                    st.session_state.preview_data = preview_result
-                                    st.session_state.df_processed = df_processed
-                                    st.session_state.update_mode = update_mode_lower
-                                
-                                if 'error' in preview_result:
-                                    st.error(f"❌ Error previewing changes: {preview_result['error']}")
-                                else:
-                                    updates = preview_result.get('updates', [])
-                                    new_rows = preview_result.get('new_rows', [])
-                                    duplicates = preview_result.get('duplicates', [])
-                                    
-                                    # Initialize selected_updates if not exists
-                                    if 'selected_updates' not in st.session_state:
-                                        st.session_state.selected_updates = {}
-                                    
-                                    # Show summary
-                                    col1, col2, col3 = st.columns(3)
-                                    with col1:
-                                        st.metric("Rows to Update", len([u for u in updates if u.get('changed_columns')]))
-                                    with col2:
-                                        st.metric("New Rows to Add", len(new_rows))
-                                    with col3:
-                                        st.metric("Duplicates", len(duplicates))
-                                    
-                                    # Show updates with tick/cross
-                                    if len(updates) > 0:
-                                        st.markdown("---")
-                                        st.subheader("📝 Records to Update")
-                                        
-                                        for idx, update in enumerate(updates):
-                                            if not update.get('changed_columns'):
-                                                continue  # Skip if no changes
-                                            
-                                            email_key = update.get('email_key', '')
-                                            # Initialize selection if not set (default: True)
-                                            if email_key not in st.session_state.selected_updates:
-                                                st.session_state.selected_updates[email_key] = True
-                                            
-                                            with st.container():
-                                                col1, col2 = st.columns([10, 1])
-                                                with col1:
-                                                    st.markdown(f"**{idx+1}. {update.get('name', '')} {update.get('surname', '')}** ({update.get('email', '')})")
-                                                    # Show changed columns
-                                                    changed_cols = update.get('changed_columns', {})
-                                                    if changed_cols:
-                                                        change_text = []
-                                                        for col_name, col_change in changed_cols.items():
-                                                            old_val = col_change.get('old', '')
-                                                            new_val = col_change.get('new', '')
-                                                            change_text.append(f"**{col_name}:** `{old_val}` → `{new_val}`")
-                                                        st.markdown(" | ".join(change_text))
-                                                with col2:
-                                                    # Tick/Cross buttons
-                                                    if st.button("✅", key=f"tick_{email_key}_{idx}", help="Update this row"):
-                                                        st.session_state.selected_updates[email_key] = True
-                                                        st.rerun()
-                                                    if st.button("❌", key=f"cross_{email_key}_{idx}", help="Cancel this row"):
-                                                        st.session_state.selected_updates[email_key] = False
-                                                        st.rerun()
-                                                    
-                                                    # Show current status
-                                                    if st.session_state.selected_updates.get(email_key, True):
-                                                        st.success("✓ Selected")
-                                                    else:
-                                                        st.error("✗ Cancelled")
-                                                
-                                                st.markdown("---")
-                                    
-                                    # Show new rows with tick/cross
-                                    if len(new_rows) > 0:
-                                        st.markdown("---")
-                                        st.subheader("➕ New Records to Add")
-                                        
-                                        for idx, new_row in enumerate(new_rows):
-                                            email_key = new_row.get('email_key', '')
-                                            # Initialize selection if not set (default: True)
-                                            if email_key not in st.session_state.selected_updates:
-                                                st.session_state.selected_updates[email_key] = True
-                                            
-                                            with st.container():
-                                                col1, col2 = st.columns([10, 1])
-                                                with col1:
-                                                    row_data = new_row.get('row', {})
-                                                    st.markdown(f"**{idx+1}. {new_row.get('name', '')} {new_row.get('surname', '')}** ({new_row.get('email', '')})")
-                                                    row_text = []
-                                                    for col in REQUIRED_COLUMNS:
-                                                        val = row_data.get(col, '')
-                                                        row_text.append(f"**{col}:** `{val}`")
-                                                    st.markdown(" | ".join(row_text))
-                                                with col2:
-                                                    # Tick/Cross buttons
-                                                    if st.button("✅", key=f"tick_new_{email_key}_{idx}", help="Add this row"):
-                                                        st.session_state.selected_updates[email_key] = True
-                                                        st.rerun()
-                                                    if st.button("❌", key=f"cross_new_{email_key}_{idx}", help="Cancel this row"):
-                                                        st.session_state.selected_updates[email_key] = False
-                                                        st.rerun()
-                                                    
-                                                    # Show current status
-                                                    if st.session_state.selected_updates.get(email_key, True):
-                                                        st.success("✓ Selected")
-                                                    else:
-                                                        st.error("✗ Cancelled")
-                                                
-                                                st.markdown("---")
-                                    
-                                    # Show duplicates (for append mode)
-                                    if len(duplicates) > 0:
-                                        st.markdown("---")
-                                        st.subheader("⚠️ Duplicate Records (Will be Skipped)")
-                                        for dup in duplicates:
-                                            st.info(f"**{dup.get('name', '')} {dup.get('surname', '')}** ({dup.get('email', '')}) - Already exists in database")
-                                    
-                                    # Update button
-                                    st.markdown("---")
-                                    selected_count = sum(1 for v in st.session_state.selected_updates.values() if v)
-                                    if selected_count > 0:
-                                        if st.button("🔄 Update Selected Records", type="primary", use_container_width=True):
-                                            with st.spinner(f"🔄 Updating {selected_count} selected record(s)..."):
-                                                result = update_database(engine, df_processed, update_mode_lower, st.session_state.selected_updates)
-                                            
-                                            if isinstance(result, tuple):
-                                                success, message = result
-                                                result_dict = None
-                                            else:
-                                                success, result_dict = result
-                                                if isinstance(result_dict, dict):
-                                                    message = result_dict.get('message', 'Update completed successfully')
-                                                elif isinstance(result_dict, str):
-                                                    message = result_dict
-                                                else:
-                                                    message = 'Update completed successfully'
-                                            
-                                            if success:
-                                                st.success(message)
-                                                st.balloons()
-                                                st.session_state.db_updated = True
-                                                # Clear preview and selections
-                                                st.session_state.preview_data = None
-                                                st.session_state.selected_updates = {}
-                                                st.rerun()
-                                            else:
-                                                st.error(message)
-                                    else:
-                                        st.warning("⚠️ No records selected. Please select records to update using ✅/❌ buttons.")
-                                    
-                        finally:
-                            # Clean up temp file
-                            if tmp_file_path and os.path.exists(tmp_file_path):
-                                try:
-                                    time.sleep(0.1)
-                                    os.unlink(tmp_file_path)
-                                except PermissionError:
-                                    try:
-                                        import ctypes
-                                        ctypes.windll.kernel32.SetFileAttributesW(tmp_file_path, 128)
-                                        os.unlink(tmp_file_path)
-                                    except:
-                                        pass
-                                except Exception:
-                                    pass
-                        
-                except Exception as e:
-                    st.error(f"❌ Error processing file: {str(e)}")
-                    import traceback
-                    with st.expander("🔍 Error Details"):
-                        st.code(traceback.format_exc())
+            
+            if 'error' in preview_result:
+                st.error(f"❌ Error previewing changes: {preview_result['error']}")
+            else:
+                render_preview(engine, df_processed, preview_result, update_mode_lower, file_reports, metrics, learned_headers)
         
         else:
-            st.info("👆 **Drag and drop an Excel file above to get started**")
+            st.info("👆 **Drag and drop one or more Excel files above to get started**")
     
     with tab2:
         st.header("📋 Database Records")
         
-        # Load and display data from database
-        df_db = load_data_from_db(engine)
-            
-        if len(df_db) > 0:
+        # Only the current page is loaded; totals come from the database
+        if stats['exists'] and stats['row_count'] > 0:
             # Display summary metrics
             col1, col2, col3 = st.columns(3)
             with col1:
-                st.metric("Total Records", len(df_db))
+                st.metric("Total Records", stats['row_count'])
             with col2:
-                st.metric("Columns", len(df_db.columns))
+                st.metric("Columns", len(REQUIRED_COLUMNS))
             with col3:
-                non_empty = df_db.replace('', pd.NA).notna().sum().sum()
-                st.metric("Filled Cells", non_empty)
+                st.metric("Filled Cells", cached_filled_cells(engine, get_data_version(engine)))
             
             st.markdown("---")
             
@@ -1342,102 +944,201 @@ def main():
             
             # Filter data if search term provided
             if search_term:
-                mask = df_db.astype(str).apply(
-                    lambda x: x.str.contains(search_term, case=False, na=False)
-                ).any(axis=1)
-                df_display = df_db[mask]
-                st.info(f"📊 Found {len(df_display)} records matching '{search_term}'")
+                try:
+                    total_rows, search_method = count_matching_rows(engine, search_term)
+                except Exception as e:
+                    st.error(f"❌ Error searching data: {str(e)}")
+                    total_rows, search_method = 0, 'like'
+                st.info(f"📊 Found {total_rows} records matching '{search_term}'")
             else:
-                df_display = df_db
+                total_rows, search_method = stats['row_count'], 'like'
             
-            # Display data with edit/delete options
+            # Pagination controls
             st.subheader("📊 Data Table")
-            st.dataframe(df_display, use_container_width=True, height=500)
+            nav_col1, nav_col2, nav_col3, nav_col4, nav_col5 = st.columns([1, 1, 1, 1, 2])
+            with nav_col1:
+                page_size = st.selectbox("Rows per page", options=PAGE_SIZE_OPTIONS, index=1, key="page_size")
+            page_count = max(1, -(-total_rows // page_size))
             
-            st.markdown("---")
-            st.subheader("✏️ Edit or Delete Records")
+            # A new search or page size starts again from the first page
+            if st.session_state.get('db_page_query') != (search_term, page_size):
+                st.session_state.db_page_query = (search_term, page_size)
+                st.session_state.db_page = 1
+            st.session_state.db_page = min(max(st.session_state.get('db_page', 1), 1), page_count)
             
-            # Select row to edit/delete
-            row_indices = list(range(len(df_display)))
+            def change_page(step):
+                st.session_state.db_page = min(max(st.session_state.db_page + step, 1), page_count)
             
-            def format_row_label(idx):
-                row = df_display.iloc[idx]
-                name = str(row.get('Name', 'N/A'))
-                surname = str(row.get('Surname', 'N/A'))
-                company = str(row.get('Company', 'N/A'))
-                return f"Row {idx+1} - {name} {surname} ({company})"
+            with nav_col2:
+                st.write("")
+                st.write("")
+                st.button("◀ Previous", key="prev_page_btn", on_click=change_page, args=(-1,),
+                          disabled=st.session_state.db_page <= 1)
+            with nav_col3:
+                st.number_input("Page", min_value=1, max_value=page_count, step=1, key="db_page")
+            with nav_col4:
+                st.write("")
+                st.write("")
+                st.button("Next ▶", key="next_page_btn", on_click=change_page, args=(1,),
+                          disabled=st.session_state.db_page >= page_count)
+            
+            page_offset = (st.session_state.db_page - 1) * page_size
+            try:
+                df_display = load_page_from_db(engine, page_offset, page_size, search_term, search_method, with_ids=True)
+            except Exception as e:
+                st.error(f"❌ Error loading data: {str(e)}")
+                df_display = pd.DataFrame(columns=REQUIRED_COLUMNS)
+            with nav_col5:
+                st.write("")
+                st.write("")
+                if len(df_display) > 0:
+                    st.caption(f"Showing records {page_offset + 1}-{page_offset + len(df_display)} of {total_rows} (page {st.session_state.db_page} of {page_count})")
             
-            selected_row_idx = st.selectbox(
-                "Select row to edit or delete:",
-                options=row_indices,
-                format_func=format_row_label,
-                key="row_selector"
+            # Cells are edited in place; all edited rows are saved together
+            if 'db_edit_message' in st.session_state:
+                st.success(st.session_state.pop('db_edit_message'))
+            # A fresh editor for every page and every data version, so unsaved edits never move to other rows
+            editor_key = f"db_editor_{get_data_version(engine)}_{st.session_state.get('db_editor_version', 0)}_{hash(tuple(df_display.index))}"
+            df_grid = df_display.copy()
+            df_grid.insert(0, 'Delete', False)
+            df_edited = st.data_editor(
+                df_grid,
+                column_config={
+                    '_index': st.column_config.NumberColumn("ID", help="Record id (stable)"),
+                    'Delete': st.column_config.CheckboxColumn("🗑️", help="Tick to delete this record")
+                },
+                use_container_width=True,
+                height=500,
+                num_rows="fixed",
+                key=editor_key
             )
             
-            if selected_row_idx is not None:
-                selected_row = df_display.iloc[selected_row_idx]
-                
-                # Create two columns for edit and delete
-                edit_col, delete_col = st.columns(2)
-                
-                with edit_col:
-                    st.markdown("#### ✏️ Edit Row")
-                    # Create editable form
-                    edited_data = {}
-                    for col in REQUIRED_COLUMNS:
-                        edited_data[col] = st.text_input(
-                            col,
-                            value=str(selected_row[col]) if col in selected_row else "",
-                            key=f"edit_{col}_{selected_row_idx}"
-                        )
-                    
-                    if st.button("💾 Save Changes", key=f"save_{selected_row_idx}", type="primary"):
-                        # Convert row to dict for comparison
-                        old_row_dict = selected_row.to_dict()
-                        # Check if anything changed
-                        has_changes = any(str(old_row_dict.get(col, '')) != edited_data[col] for col in REQUIRED_COLUMNS)
-                        
-                        if has_changes:
-                            with st.spinner("Updating row..."):
-                                success, message = update_row_in_db(engine, old_row_dict, edited_data)
-                            if success:
-                                st.success(message)
-                                st.rerun()
-                        else:
-                                st.error(message)
-                    else:
-                            st.info("No changes detected.")
-                
-                with delete_col:
-                    st.markdown("#### 🗑️ Delete Row")
-                    st.write("**Current row data:**")
-                    for col in REQUIRED_COLUMNS:
-                        if col in selected_row:
-                            st.write(f"**{col}:** {selected_row[col]}")
-                    
-                    st.warning("⚠️ This action cannot be undone!")
-                    if st.button("🗑️ Delete Row", key=f"delete_{selected_row_idx}", type="secondary"):
-                        # Convert row to dict
-                        row_dict = selected_row.to_dict()
-                        with st.spinner("Deleting row..."):
-                            success, message = delete_row_from_db(engine, row_dict)
+            # Rows with at least one edited cell, and their changed columns
+            delete_ids = df_edited.index[df_edited['Delete'].fillna(False).astype(bool)].tolist()
+            df_edited = df_edited[REQUIRED_COLUMNS].fillna('').astype(str)
+            edits = []
+            for record_id, shown_row in df_display.iterrows():
+                new_values = {
+                    col: df_edited.at[record_id, col] for col in REQUIRED_COLUMNS
+                    if df_edited.at[record_id, col] != shown_row[col]
+                }
+                if new_values:
+                    edits.append((record_id, shown_row.to_dict(), new_values))
+            
+            def discard_edits():
+                st.session_state.db_editor_version = st.session_state.get('db_editor_version', 0) + 1
+                st.session_state.confirm_delete_rows = False
+            
+            save_col, delete_col, discard_col, info_col = st.columns([1, 1, 1, 2])
+            with save_col:
+                save_clicked = st.button(
+                    f"💾 Save {len(edits)} edited row(s)", key="save_edits_btn", type="primary", disabled=not edits
+                )
+            with delete_col:
+                if st.button(f"🗑️ Delete {len(delete_ids)} selected row(s)", key="delete_rows_btn", disabled=not delete_ids):
+                    st.session_state.confirm_delete_rows = True
+            with discard_col:
+                st.button("↩️ Discard changes", key="discard_edits_btn", disabled=not (edits or delete_ids), on_click=discard_edits)
+            with info_col:
+                st.caption("Double-click a cell to edit it, tick 🗑️ to select rows for deletion. Saved edits and deletions can be rolled back in the 🕘 History tab.")
+            
+            if save_clicked:
+                with st.spinner(f"Updating {len(edits)} row(s)..."):
+                    success, message = update_rows_by_id(engine, edits)
+                if success:
+                    refresh_snapshot_after_write(engine)
+                    # Only the current page is read again
+                    st.session_state.db_edit_message = message
+                    st.rerun()
+                else:
+                    st.error(message)
+            
+            if st.session_state.get('confirm_delete_rows') and delete_ids:
+                st.error(f"⚠️ **Are you sure?** {len(delete_ids)} record(s) will be removed (IDs: {', '.join(str(record_id) for record_id in delete_ids[:20])}{' ...' if len(delete_ids) > 20 else ''})")
+                col1, col2 = st.columns(2)
+                with col1:
+                    if st.button("✅ Confirm Delete", type="primary", key="confirm_delete_rows_btn"):
+                        with st.spinner(f"Deleting {len(delete_ids)} row(s)..."):
+                            success, message = delete_rows_by_id(engine, delete_ids)
+                        st.session_state.confirm_delete_rows = False
                         if success:
-                            st.success(message)
+                            refresh_snapshot_after_write(engine)
+                            st.session_state.db_edit_message = message
                             st.rerun()
                         else:
                             st.error(message)
+                with col2:
+                    if st.button("❌ Cancel", key="cancel_delete_rows_btn"):
+                        st.session_state.confirm_delete_rows = False
+                        st.rerun()
             
-            # Download option
+            # Export: built only when requested, streamed from the database into a spooled temp file
             st.markdown("---")
-            csv = df_display.to_csv(index=False).encode('utf-8')
-            st.download_button(
-                label="📥 Download as CSV",
-                data=csv,
-                file_name=f"database_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv",
-                mime="text/csv"
-            )
+            st.subheader("📦 Export")
+            export_col1, export_col2, export_col3 = st.columns([1, 2, 1])
+            with export_col1:
+                export_format = st.selectbox(
+                    "Format", options=list(EXPORT_FORMATS), format_func=lambda fmt: EXPORT_FORMATS[fmt][0], key="export_format"
+                )
+            with export_col2:
+                st.write("")
+                st.write("")
+                export_filtered = st.checkbox(
+                    f"Only records matching the search ({total_rows})" if search_term else "Only records matching the search",
+                    value=bool(search_term), disabled=not search_term, key=f"export_filtered_{bool(search_term)}"
+                )
+            export_search = search_term if export_filtered else ''
+            export_key = (export_format, export_search, get_data_version(engine))
+            with export_col3:
+                st.write("")
+                st.write("")
+                if st.button("📦 Prepare export", key="prepare_export_btn"):
+                    # Only one prepared export is kept per session
+                    if st.session_state.get('export_file'):
+                        st.session_state.export_file[1].close()
+                        del st.session_state['export_file']
+                    with st.spinner("Preparing export..."):
+                        try:
+                            export_file, export_rows = build_export(engine, export_format, export_search, search_method)
+                            st.session_state.export_file = (export_key, export_file, export_rows)
+                        except Exception as e:
+                            st.error(f"❌ Error preparing export: {str(e)}")
+            
+            # A downloaded export has been closed; drop it so the session no longer holds it
+            if st.session_state.get('export_file') and st.session_state.export_file[1].closed:
+                del st.session_state['export_file']
+                st.caption("✅ Export downloaded. Prepare it again to download another copy.")
+            
+            if st.session_state.get('export_file') and st.session_state.export_file[0] == export_key:
+                _, export_file, export_rows = st.session_state.export_file
+                label, extension, mime = EXPORT_FORMATS[export_format]
+                
+                def download_export():
+                    """Read the export only when the button is clicked, then close the temp file"""
+                    if export_file.closed:
+                        raise ValueError("Export already downloaded, prepare it again")
+                    export_file.seek(0)
+                    try:
+                        return export_file.read()
+                    finally:
+                        export_file.close()
+                
+                # No rerun on click: the deferred read runs on its own request and must not race a rerun
+                st.download_button(
+                    label=f"📥 Download {export_rows} record(s) as {label}",
+                    data=download_export,
+                    file_name=f"database_export_{datetime.now().strftime('%Y%m%d_%H%M%S')}{extension}",
+                    mime=mime,
+                    on_click="ignore"
+                )
         else:
             st.info("📭 **Database is empty. Upload an Excel file to add data.**")
+    
+    with tab3:
+        render_history(engine)
+    
+    with tab4:
+        render_performance(engine)
 
 if __name__ == "__main__":
     main()
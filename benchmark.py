@@ -0,0 +1,269 @@
+"""Benchmark harness: synthetic contact workbooks and timings of the ingest, diff, write and search paths
+
+Generates workbooks shaped like the vendor exports (messy headers, noise columns, HTML-wrapped emails,
+repeated emails, several sheets), seeds a scratch SQLite database and times process_sheet, combine_sheets,
+preview_changes, update_database (replace and append) and the View Database search. Results are written
+to JSON so runs of different versions can be compared.
+
+Examples:
+    python benchmark.py --sizes 10k
+    python benchmark.py --sizes 10k 100k 1M --db-rows 200k --label before-refactor
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+import pandas as pd
+from openpyxl import Workbook
+from sqlalchemy import text
+
+from ingest import SHEET_WORKERS, REQUIRED_COLUMNS, read_excel_file, process_sheet, combine_sheets, normalize_frame
+from database import get_cached_engine, update_database, preview_changes, count_matching_rows, load_page_from_db
+from metrics import UploadMetrics
+
+# Header spellings seen in real exports, per required column (resolved by header_mapper)
+MESSY_HEADERS = {
+    'Company': ['Company', 'Company Name', ' company ', 'Organisation'],
+    'Name': ['Name', 'First Name', 'first_name', 'Given Name'],
+    'Surname': ['Surname', 'Last Name', 'last-name', 'Family Name'],
+    'Email': ['Email', 'E-mail Address', 'EMAIL', 'Work Email'],
+    'Position': ['Position', 'Job Title', 'Title', 'Role'],
+    'Phone': ['Phone', 'Mobile', 'Phone Number', 'Telephone']
+}
+NOISE_HEADERS = ['Country', 'City', 'LinkedIn', 'Industry', 'Employees', 'Source', 'Notes', 'Created']
+
+FIRST_NAMES = ['James', 'Mary', 'Ahmed', 'Fatima', 'Wei', 'Olga', 'Carlos', 'Priya', 'John', 'Aisha', 'Noah', 'Sara']
+LAST_NAMES = ['Smith', 'Khan', 'Garcia', 'Chen', 'Ivanova', 'Patel', 'Brown', 'Haddad', 'Silva', 'Novak', 'Kim', 'Ali']
+COMPANIES = ['Adnoc', 'Docusign', 'Intel', 'Emirates', 'Aramco', 'Siemens', 'Oracle', 'Etisalat', 'Unilever', 'Nestle']
+POSITIONS = ['Manager', 'Director', 'Engineer', 'Analyst', 'Head of IT', 'CFO', 'Consultant', 'Procurement Lead']
+
+DEFAULT_OUTPUT_DIR = "benchmark_results"
+
+def parse_size(value):
+    """Row count from '10000', '10k' or '1M'"""
+    value = value.strip().lower()
+    multiplier = {'k': 1000, 'm': 1000000}.get(value[-1:], 1)
+    return int(float(value.rstrip('km')) * multiplier)
+
+def make_contacts(start, count, rng, variant=0):
+    """Contacts with ids start..start+count-1; the same id always has the same email
+    variant changes Position/Phone for part of the rows, so a later file has real updates
+    """
+    rows = []
+    for contact_id in range(start, start + count):
+        first = FIRST_NAMES[contact_id % len(FIRST_NAMES)]
+        last = LAST_NAMES[(contact_id // len(FIRST_NAMES)) % len(LAST_NAMES)]
+        company = COMPANIES[contact_id % len(COMPANIES)]
+        changed = variant and rng.random() < 0.3
+        rows.append([
+            f"{company} {contact_id % 97}",
+            first,
+            last,
+            f"{first.lower()}.{last.lower()}{contact_id}@{company.lower()}.com",
+            POSITIONS[(contact_id + (variant if changed else 0)) % len(POSITIONS)],
+            971500000000 + contact_id + (1 if changed else 0)
+        ])
+    return pd.DataFrame(rows, columns=REQUIRED_COLUMNS)
+
+def messy_sheet(df, rng, noise_columns, html_email_ratio, duplicate_ratio):
+    """Turn clean contacts into a vendor-style sheet: renamed and shuffled headers, noise columns,
+    HTML/mailto-wrapped and upper-cased emails, repeated rows; returns (headers, rows)
+    """
+    df = df.copy()
+    emails = df['Email'].tolist()
+    for pos, email in enumerate(emails):
+        draw = rng.random()
+        if draw < html_email_ratio:
+            emails[pos] = f'<a href="mailto:{email}">{email}</a>'
+        elif draw < html_email_ratio * 2:
+            emails[pos] = email.upper()
+    df['Email'] = emails
+    
+    if duplicate_ratio > 0 and len(df) > 0:
+        repeats = df.sample(n=int(len(df) * duplicate_ratio), random_state=rng.randrange(2 ** 31))
+        df = pd.concat([df, repeats], ignore_index=True)
+    
+    headers = [rng.choice(MESSY_HEADERS[col]) for col in REQUIRED_COLUMNS]
+    columns = [list(df[col]) for col in REQUIRED_COLUMNS]
+    for name in NOISE_HEADERS[:noise_columns]:
+        headers.append(name)
+        columns.append([f"{name.lower()} {rng.randrange(1000)}" for _ in range(len(df))])
+    
+    order = list(range(len(headers)))
+    rng.shuffle(order)
+    headers = [headers[pos] for pos in order]
+    rows = zip(*(columns[pos] for pos in order))
+    return headers, rows
+
+def write_workbook(file_path, df, sheets, rng, noise_columns, html_email_ratio, duplicate_ratio):
+    """Split contacts over several sheets of a write-only workbook (streams rows, constant memory)"""
+    workbook = Workbook(write_only=True)
+    sheet_size = -(-len(df) // sheets)
+    for sheet_index in range(sheets):
+        part = df.iloc[sheet_index * sheet_size:(sheet_index + 1) * sheet_size]
+        headers, rows = messy_sheet(part, rng, noise_columns, html_email_ratio, duplicate_ratio)
+        worksheet = workbook.create_sheet(f"Leads {sheet_index + 1}")
+        worksheet.append(headers)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(file_path)
+
+def git_revision():
+    """Short commit hash of the working tree (None outside a git checkout)"""
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__))
+        ).stdout.strip()
+    except Exception:
+        return None
+
+def copy_database(engine, source_path, target_path):
+    """Checkpoint the WAL and copy a SQLite database file"""
+    with engine.connect() as conn:
+        conn.execute(text('PRAGMA wal_checkpoint(TRUNCATE)'))
+    engine.dispose()
+    shutil.copyfile(source_path, target_path)
+
+def run_size(rows, args, work_dir, results):
+    """Generate the workbook and database for one file size and time every stage"""
+    rng = random.Random(args.seed)
+    db_rows = args.db_rows if args.db_rows is not None else rows
+    metrics = UploadMetrics(f"{rows} rows")
+    
+    # Workbooks are reused between runs with the same parameters
+    file_name = f"contacts_{rows}_{args.sheets}s_{args.noise_columns}n_{args.seed}.xlsx"
+    file_path = os.path.join(work_dir, file_name)
+    if not os.path.exists(file_path):
+        print(f"Generating {file_name}...", flush=True)
+        # Half of the file overlaps the database, with changed values on part of the overlap
+        file_df = make_contacts(db_rows // 2, rows, rng, variant=1)
+        write_workbook(file_path, file_df, args.sheets, rng, args.noise_columns, args.html_email_ratio, args.duplicate_ratio)
+    
+    with metrics.stage('read_excel_file', bytes_read=os.path.getsize(file_path)):
+        success, sheet_names, workbook, error_msg, error_details = read_excel_file(file_path, 'xlsx', 'openpyxl')
+    if not success:
+        raise RuntimeError(f"{error_msg} {error_details}")
+    try:
+        for sheet_name in sheet_names:
+            with metrics.stage('process_sheet') as stage:
+                sheet_success, df_sheet, error_msg, missing_cols, column_mapping = process_sheet(workbook, sheet_name)
+                if not sheet_success:
+                    raise RuntimeError(error_msg)
+                stage['rows_out'] = len(df_sheet)
+        with metrics.stage('combine_sheets') as stage:
+            df_file, processed_sheets, failed_sheets = combine_sheets(workbook, sheet_names)
+            stage['rows_out'] = len(df_file)
+    finally:
+        workbook.close()
+    
+    # Seeded database, copied for each write benchmark so every mode starts from the same rows
+    base_path = os.path.join(work_dir, f"base_{rows}.db")
+    for path in (base_path, base_path + '-wal', base_path + '-shm'):
+        if os.path.exists(path):
+            os.remove(path)
+    base_engine = get_cached_engine(f"sqlite:///{base_path}")
+    with metrics.stage('seed_database', rows_in=db_rows) as stage:
+        seed_df = normalize_frame(make_contacts(0, db_rows, random.Random(args.seed + 1)))
+        seed_success, seed_result = update_database(base_engine, seed_df, 'replace')
+        if not seed_success:
+            raise RuntimeError(seed_result)
+        stage['rows_out'] = seed_result['new_count']
+    
+    for mode in ('replace', 'append'):
+        with metrics.stage(f'preview_changes_{mode}', rows_in=len(df_file)) as stage:
+            preview_result = preview_changes(base_engine, df_file, mode)
+            stage['rows_out'] = len(preview_result.get('updates', [])) + len(preview_result.get('new_rows', []))
+    
+    # Search: a full-text hit, a substring-only term (LIKE fallback) and a deep page
+    search_terms = {'search_fts': 'adnoc', 'search_like': 'ocusig'}
+    for stage_name, term in search_terms.items():
+        with metrics.stage(stage_name, rows_in=db_rows) as stage:
+            count, method = count_matching_rows(base_engine, term)
+            page = load_page_from_db(base_engine, 0, 100, term, method)
+            stage['rows_out'] = count
+            stage['method'] = method
+            stage['page_rows'] = len(page)
+    with metrics.stage('search_last_page', rows_in=db_rows) as stage:
+        stage['rows_out'] = len(load_page_from_db(base_engine, max(db_rows - 100, 0), 100))
+    
+    for mode in ('replace', 'append'):
+        mode_path = os.path.join(work_dir, f"{mode}_{rows}.db")
+        copy_database(base_engine, base_path, mode_path)
+        mode_engine = get_cached_engine(f"sqlite:///{mode_path}")
+        with metrics.stage(f'update_database_{mode}', rows_in=len(df_file)) as stage:
+            update_success, update_result = update_database(mode_engine, df_file, mode)
+            if not update_success:
+                raise RuntimeError(update_result)
+            stage['rows_out'] = update_result['updated_count'] + update_result['new_count']
+        mode_engine.dispose()
+    base_engine.dispose()
+    
+    for record in metrics.stages:
+        result = {'file_rows': rows, 'db_rows': db_rows, **{k: v for k, v in record.items() if k not in ('run_id', 'source', 'started_at')}}
+        rate_rows = record['rows_in'] or record['rows_out']
+        result['rows_per_second'] = round(rate_rows / record['seconds']) if rate_rows and record['seconds'] else None
+        results.append(result)
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Time ingest, diff, write and search on synthetic contact workbooks.")
+    parser.add_argument('--sizes', nargs='+', default=['10k'], help="File sizes in rows, e.g. 10k 100k 1M (default: 10k)")
+    parser.add_argument('--db-rows', type=parse_size, help="Rows in the seeded database (default: same as the file size)")
+    parser.add_argument('--sheets', type=int, default=2, help="Sheets per workbook (default: 2)")
+    parser.add_argument('--noise-columns', type=int, default=4, help=f"Extra columns per sheet, up to {len(NOISE_HEADERS)} (default: 4)")
+    parser.add_argument('--html-email-ratio', type=float, default=0.05, help="Share of HTML-wrapped emails (default: 0.05)")
+    parser.add_argument('--duplicate-ratio', type=float, default=0.02, help="Share of repeated rows per sheet (default: 0.02)")
+    parser.add_argument('--seed', type=int, default=42, help="Random seed (default: 42)")
+    parser.add_argument('--work-dir', help="Folder for generated workbooks and databases (default: a temp folder, removed afterwards)")
+    parser.add_argument('--output', help=f"Result JSON file (default: {DEFAULT_OUTPUT_DIR}/benchmark_<time>.json)")
+    parser.add_argument('--label', default='', help="Free text stored with the results, e.g. a version name")
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    sizes = [parse_size(size) for size in args.sizes]
+    work_dir = args.work_dir or tempfile.mkdtemp(prefix='bulkupdate_bench_')
+    os.makedirs(work_dir, exist_ok=True)
+    
+    results = []
+    try:
+        for rows in sizes:
+            print(f"Benchmarking {rows} rows...", flush=True)
+            run_size(rows, args, work_dir, results)
+    finally:
+        if not args.work_dir:
+            shutil.rmtree(work_dir, ignore_errors=True)
+    
+    report = {
+        'label': args.label,
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'git_revision': git_revision(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'platform': platform.platform(),
+        'cpu_count': os.cpu_count(),
+        'sheet_workers': SHEET_WORKERS,
+        'parameters': {key: value for key, value in vars(args).items() if key not in ('output', 'work_dir')},
+        'results': results
+    }
+    output = args.output or os.path.join(DEFAULT_OUTPUT_DIR, f"benchmark_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+    
+    # Summary table
+    summary = pd.DataFrame(results)[['file_rows', 'db_rows', 'stage', 'seconds', 'rows_in', 'rows_out', 'rows_per_second', 'peak_rss']]
+    with pd.option_context('display.max_rows', None, 'display.width', 200):
+        print(summary.to_string(index=False))
+    print(f"Results written to {output}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,288 @@
+"""Command-line bulk update: load Excel files into the database without the Streamlit UI
+
+Examples:
+    python bulkupdate.py FW_Data_Base/*.xlsx --mode replace
+    python bulkupdate.py "FW_Data_Base/**/*.xls*" --mode append --dry-run --json
+"""
+import argparse
+import glob
+import json
+import os
+import signal
+import sys
+import time
+from contextlib import nullcontext
+
+from ingest import validate_file_format, read_excel_file, combine_sheets, list_workbooks, is_excel_lock_file
+from database import (
+    DATABASE_URL,
+    check_database_url,
+    get_cached_engine,
+    preview_changes,
+    update_database,
+    load_header_mappings,
+    save_header_mappings,
+    rollback_change_batch,
+)
+from header_mapper import add_learned_synonyms, learned_synonyms
+from metrics import UploadMetrics
+from snapshot import refresh_snapshot
+from watcher import FolderWatcher, POLL_INTERVAL_SECONDS, DEBOUNCE_SECONDS, WATCH_WORKERS
+
+# Counters reported per file and summed in the final summary (kept_count is per file only: rows already stored)
+COUNT_KEYS = ['rows', 'updated_count', 'unchanged_count', 'new_count', 'duplicates_count']
+
+def expand_paths(patterns):
+    """Expand files, directories and glob patterns into a list of unique paths (argument order kept)"""
+    paths = []
+    for pattern in patterns:
+        if os.path.isdir(pattern):
+            matches = list_workbooks(pattern)
+        elif glob.has_magic(pattern):
+            # Skip Excel lock files (~$Book.xlsx) left next to open workbooks
+            matches = sorted(path for path in glob.glob(pattern, recursive=True) if not is_excel_lock_file(path))
+        else:
+            # Missing files are reported when they are processed
+            matches = [pattern]
+        paths.extend(matches)
+    return list(dict.fromkeys(paths))
+
+def load_file(file_path, sheet_filter=None, metrics=None):
+    """Validate, open and parse one Excel file (all sheets, or only those in sheet_filter)
+    Returns (success, df_processed, report); the 'open' and 'parse' stages are recorded in metrics
+    """
+    metrics = metrics or UploadMetrics(file_path)
+    report = {'file': file_path, 'sheets': [], 'failed_sheets': []}
+    if not os.path.isfile(file_path):
+        report['error'] = "File not found"
+        return False, None, report
+    
+    # Format check and engine probing
+    with metrics.stage('open', bytes_read=os.path.getsize(file_path)) as stage:
+        is_valid_file, file_extension, file_result = validate_file_format(file_path)
+        if not is_valid_file:
+            stage['status'] = 'failed'
+            report['error'] = file_result
+            return False, None, report
+        
+        success, sheet_names, workbook, error_msg, error_details = read_excel_file(file_path, file_extension, file_result)
+        if not success:
+            stage['status'] = 'failed'
+            report['error'] = error_msg
+            return False, None, report
+    
+    try:
+        selected_sheets = [name for name in sheet_names if not sheet_filter or name in sheet_filter]
+        if not selected_sheets:
+            report['error'] = f"None of the requested sheets found (available: {', '.join(sheet_names)})"
+            return False, None, report
+        with metrics.stage('parse') as stage:
+            df_processed, processed_sheets, failed_sheets = combine_sheets(workbook, selected_sheets)
+            stage['rows_out'] = 0 if df_processed is None else len(df_processed)
+            if df_processed is None:
+                stage['status'] = 'failed'
+    finally:
+        workbook.close()
+    
+    report['sheets'] = [{'name': s['name'], 'rows': s['rows']} for s in processed_sheets]
+    # Headers matched by similarity, stored after a successful update
+    report['learned_headers'] = {}
+    for sheet_info in processed_sheets:
+        report['learned_headers'].update(learned_synonyms(sheet_info['mapping']))
+    report['failed_sheets'] = failed_sheets
+    if df_processed is None:
+        report['error'] = "No sheet has the required columns"
+        return False, None, report
+    
+    report['rows'] = len(df_processed)
+    return True, df_processed, report
+
+def run_file(engine, file_path, update_mode, dry_run=False, sheet_filter=None, write_lock=None):
+    """Load one file and preview (dry run) or apply it; returns the file report
+    write_lock (optional) is held around the database write when several files are processed at once
+    """
+    started = time.perf_counter()
+    # Dry runs write nothing, not even metrics (they are still logged)
+    metrics = UploadMetrics(file_path, None if dry_run else engine)
+    success, df_processed, report = load_file(file_path, sheet_filter, metrics)
+    report['run_id'] = metrics.run_id
+    
+    if success and dry_run:
+        with metrics.stage('preview', rows_in=len(df_processed)) as stage:
+            preview_result = preview_changes(engine, df_processed, update_mode)
+            stage['rows_out'] = len(preview_result.get('updates', [])) + len(preview_result.get('new_rows', []))
+            if 'error' in preview_result:
+                stage['status'] = 'failed'
+        if 'error' in preview_result:
+            success = False
+            report['error'] = preview_result['error']
+        else:
+            report['updated_count'] = sum(1 for u in preview_result['updates'] if u['type'] == 'update')
+            report['unchanged_count'] = sum(1 for u in preview_result['updates'] if u['type'] == 'no_change')
+            report['new_count'] = len(preview_result['new_rows'])
+            report['duplicates_count'] = len(preview_result['duplicates'])
+    elif success:
+        with write_lock or nullcontext():
+            with metrics.stage('update', rows_in=len(df_processed)) as stage:
+                success, result = update_database(engine, df_processed, update_mode, source=file_path)
+                if success:
+                    stage['rows_out'] = result.get('updated_count', 0) + result.get('new_count', 0)
+                else:
+                    stage['status'] = 'failed'
+            if success and report['learned_headers']:
+                save_header_mappings(engine, report['learned_headers'])
+                add_learned_synonyms(report['learned_headers'])
+            if success:
+                # Keep the columnar snapshot in step with the committed batch; the update itself already succeeded
+                try:
+                    with metrics.stage('snapshot'):
+                        refresh_snapshot(engine)
+                except Exception:
+                    pass
+        if not success:
+            report['error'] = result
+        else:
+            for key in ['new_count', 'kept_count', 'duplicates_count', 'batch_id']:
+                report[key] = result.get(key, 0)
+            # Matched rows are split into changed and unchanged, like the dry run counts them
+            report['unchanged_count'] = result.get('unchanged_count', 0)
+            report['updated_count'] = result.get('updated_count', 0) - report['unchanged_count']
+    
+    report['status'] = 'failed' if not success else ('previewed' if dry_run else 'updated')
+    report['seconds'] = round(time.perf_counter() - started, 3)
+    return report
+
+def format_report(index, total, report):
+    """One human-readable progress line for a processed file"""
+    prefix = f"[{index}/{total}] {report['file']}" if total else f"[{index}] {report['file']}"
+    if report['status'] == 'failed':
+        line = f"{prefix}: FAILED - {report['error']}"
+    elif report['status'] == 'skipped':
+        line = f"{prefix}: skipped - {report['message']}"
+    else:
+        counts = ", ".join(f"{key.replace('_count', '')} {report[key]}" for key in COUNT_KEYS[1:] + ['kept_count'] if key in report)
+        line = f"{prefix}: {report['status']} {report['rows']} rows from {len(report['sheets'])} sheet(s) ({counts}) in {report['seconds']}s"
+        if report.get('batch_id'):
+            line += f" - change batch {report['batch_id']}"
+    for failed in report['failed_sheets']:
+        line += f"\n    sheet '{failed['name']}' skipped: {failed['error']}"
+    return line
+
+def emit(event, as_json, text_line):
+    """Write one progress event immediately: a JSON line or a text line"""
+    print(json.dumps(event, default=str) if as_json else text_line, flush=True)
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='bulkupdate',
+        description="Bulk update the contacts database from Excel files (.xlsx, .xls)."
+    )
+    parser.add_argument('paths', nargs='*', help="Excel files, directories or glob patterns (quote patterns with **)")
+    parser.add_argument('--mode', choices=['replace', 'append'], default='replace',
+                        help="replace: update matching emails and add new ones; append: only add new emails (default: replace)")
+    parser.add_argument('--dry-run', action='store_true', help="Preview the change counts without writing to the database")
+    parser.add_argument('--json', action='store_true', help="Emit one JSON object per line instead of text")
+    parser.add_argument('--sheet', action='append', dest='sheets', metavar='NAME',
+                        help="Only process this sheet (repeatable; default: all sheets)")
+    parser.add_argument('--watch', metavar='DIR',
+                        help="Keep running and ingest workbooks dropped into DIR (each file content only once)")
+    parser.add_argument('--poll-interval', type=float, default=POLL_INTERVAL_SECONDS,
+                        help=f"--watch: seconds between directory scans (default: {POLL_INTERVAL_SECONDS})")
+    parser.add_argument('--debounce', type=float, default=DEBOUNCE_SECONDS,
+                        help=f"--watch: seconds a file must stay unchanged before it is read (default: {DEBOUNCE_SECONDS})")
+    parser.add_argument('--workers', type=int, default=WATCH_WORKERS,
+                        help=f"--watch: files parsed at the same time (default: {WATCH_WORKERS})")
+    parser.add_argument('--rollback', type=int, metavar='BATCH',
+                        help="Undo one logged change batch (the batch_id reported for an update) and exit")
+    parser.add_argument('--database-url', default=DATABASE_URL, help="SQLite database URL, e.g. sqlite:///contacts.db (default: DATABASE_URL or the local SQLite file)")
+    return parser
+
+def watch(args):
+    """Run the watch-folder daemon until interrupted"""
+    if not os.path.isdir(args.watch):
+        print(f"Not a directory: {args.watch}", file=sys.stderr)
+        return 1
+    
+    engine = get_cached_engine(args.database_url)
+    add_learned_synonyms(load_header_mappings(engine))
+    processed = []
+    
+    def on_report(report):
+        processed.append(report)
+        emit({'event': 'file', 'index': len(processed), **report}, args.json, format_report(len(processed), None, report))
+    
+    folder_watcher = FolderWatcher(
+        args.watch, engine, args.mode, args.dry_run, on_report,
+        poll_interval=args.poll_interval, debounce_seconds=args.debounce, max_workers=args.workers
+    )
+    emit(
+        {'event': 'watch', 'directory': args.watch, 'mode': args.mode, 'dry_run': args.dry_run},
+        args.json,
+        f"Watching {args.watch} in {args.mode} mode{' (dry run)' if args.dry_run else ''} - press Ctrl+C to stop"
+    )
+    # Service managers stop daemons with SIGTERM: finish the queued files like on Ctrl+C
+    signal.signal(signal.SIGTERM, lambda signum, frame: folder_watcher.stop())
+    folder_watcher.run()
+    failed = sum(1 for report in processed if report['status'] == 'failed')
+    emit(
+        {'event': 'stopped', 'files': len(processed), 'failed': failed},
+        args.json,
+        f"Stopped after {len(processed)} file(s), {failed} failed"
+    )
+    return 0
+
+def main(argv=None):
+    parser = build_parser()
+    args = parser.parse_args(argv)
+    try:
+        check_database_url(args.database_url)
+    except ValueError as e:
+        parser.error(str(e))
+    if args.rollback is not None:
+        success, message = rollback_change_batch(get_cached_engine(args.database_url), args.rollback)
+        emit({'event': 'rollback', 'batch_id': args.rollback, 'success': success, 'message': message}, args.json, message)
+        return 0 if success else 1
+    if args.watch:
+        return watch(args)
+    if not args.paths:
+        parser.error("give files, directories or glob patterns, --watch DIR or --rollback BATCH")
+    
+    file_paths = expand_paths(args.paths)
+    if not file_paths:
+        print("No files matched.", file=sys.stderr)
+        return 1
+    
+    engine = get_cached_engine(args.database_url)
+    # Header layouts learned by earlier runs resolve by lookup
+    add_learned_synonyms(load_header_mappings(engine))
+    started = time.perf_counter()
+    emit(
+        {'event': 'start', 'files': len(file_paths), 'mode': args.mode, 'dry_run': args.dry_run},
+        args.json,
+        f"{'Previewing' if args.dry_run else 'Updating'} {len(file_paths)} file(s) in {args.mode} mode"
+    )
+    
+    # Files are applied one after another, each in its own transaction
+    totals = dict.fromkeys(COUNT_KEYS, 0)
+    failed_files = []
+    for index, file_path in enumerate(file_paths, start=1):
+        report = run_file(engine, file_path, args.mode, args.dry_run, args.sheets)
+        if report['status'] == 'failed':
+            failed_files.append(file_path)
+        for key in COUNT_KEYS:
+            totals[key] += report.get(key, 0)
+        emit({'event': 'file', 'index': index, 'total': len(file_paths), **report}, args.json, format_report(index, len(file_paths), report))
+    
+    summary = {
+        'event': 'summary',
+        'files': len(file_paths),
+        'failed_files': failed_files,
+        'seconds': round(time.perf_counter() - started, 3),
+        **totals
+    }
+    counts = ", ".join(f"{key.replace('_count', '')} {totals[key]}" for key in COUNT_KEYS)
+    emit(summary, args.json, f"Done: {len(file_paths) - len(failed_files)}/{len(file_paths)} file(s) OK ({counts}) in {summary['seconds']}s")
+    return 1 if failed_files else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,1290 @@
+"""Database access shared by the Streamlit app and the command line (no Streamlit imports)
+Engine setup, schema migrations, search, diffing uploads against stored rows and writing them
+Every write is recorded in an append-only change log (before/after image per row) in the same transaction
+"""
+import json
+import os
+import secrets
+from collections import Counter
+from datetime import datetime
+from functools import lru_cache
+
+import pandas as pd
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.exc import IntegrityError
+
+from ingest import REQUIRED_COLUMNS, CHUNK_SIZE, normalize_frame, canonicalize_emails, normalize_email_key
+
+# Database connection string (set DATABASE_URL to use another SQLite file, e.g. sqlite:///C:/data/contacts.db)
+DB_NAME = "FW_data_base.db"
+DATABASE_URL = os.environ.get('DATABASE_URL', f"sqlite:///{DB_NAME}")
+
+TABLE_NAME = "contacts_data"
+META_TABLE = "db_meta"
+FTS_TABLE = "contacts_fts"
+LEDGER_TABLE = "ingest_ledger"
+HEADER_MAP_TABLE = "header_mappings"
+CHANGE_BATCH_TABLE = "change_batches"
+CHANGE_LOG_TABLE = "change_log"
+METRICS_TABLE = "upload_metrics"
+
+# Quoted required columns for SELECT lists
+REQUIRED_COLUMNS_SQL = ", ".join(f'"{col}"' for col in REQUIRED_COLUMNS)
+
+# Bumped when the canonical email form changes; stored emails are rewritten once per bump
+EMAIL_FORMAT_VERSION = 1
+
+# Applied to every new SQLite connection: WAL lets the UI read while an upload writes
+SQLITE_PRAGMAS = [
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=30000",
+    "PRAGMA cache_size=-65536",  # 64 MB page cache
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA foreign_keys=ON",
+]
+
+# Connection pool sizing (sessions and watch-folder workers each hold a connection while they work)
+POOL_SIZE = int(os.environ.get('DB_POOL_SIZE', 5))
+POOL_MAX_OVERFLOW = int(os.environ.get('DB_POOL_MAX_OVERFLOW', 10))
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record):
+    cursor = dbapi_connection.cursor()
+    try:
+        for pragma in SQLITE_PRAGMAS:
+            cursor.execute(pragma)
+    finally:
+        cursor.close()
+
+def check_database_url(database_url):
+    """Raise ValueError for a database the data layer cannot use
+    Only SQLite is supported: storage relies on rowid, FTS5, ON CONFLICT upserts, LIMIT/OFFSET and a unique index that allows many NULL keys
+    """
+    if not database_url.startswith('sqlite'):
+        raise ValueError(
+            f"Unsupported database '{database_url.split(':', 1)[0]}': only SQLite is supported "
+            f"(DATABASE_URL=sqlite:///path/to/file.db)"
+        )
+
+@lru_cache(maxsize=None)
+def get_cached_engine(database_url=DATABASE_URL):
+    """Create the SQLite engine for database_url once per process and reuse it (with its pool) afterwards"""
+    check_database_url(database_url)
+    engine = create_engine(
+        database_url,
+        echo=False,
+        pool_size=POOL_SIZE,
+        max_overflow=POOL_MAX_OVERFLOW,
+        # Streamlit runs each session in its own thread
+        connect_args={'check_same_thread': False, 'timeout': 30}
+    )
+    event.listen(engine, 'connect', _apply_sqlite_pragmas)
+    return engine
+
+def get_meta_value(conn, key):
+    """Read an integer from the metadata table (None when unset)"""
+    if not inspect(conn).has_table(META_TABLE):
+        return None
+    return conn.execute(text(f"SELECT value FROM {META_TABLE} WHERE key = :key"), {'key': key}).scalar()
+
+def set_meta_value(conn, key, value):
+    """Store an integer in the metadata table"""
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS {META_TABLE} (key TEXT PRIMARY KEY, value INTEGER NOT NULL)'))
+    conn.execute(
+        text(f"INSERT INTO {META_TABLE} (key, value) VALUES (:key, :value) ON CONFLICT (key) DO UPDATE SET value = excluded.value"),
+        {'key': key, 'value': value}
+    )
+
+def bump_data_version(conn):
+    """Increment the database data version; cached previews built on an older version are discarded"""
+    conn.execute(text(f'CREATE TABLE IF NOT EXISTS {META_TABLE} (key TEXT PRIMARY KEY, value INTEGER NOT NULL)'))
+    conn.execute(text(
+        f"INSERT INTO {META_TABLE} (key, value) VALUES ('data_version', 1) "
+        f"ON CONFLICT (key) DO UPDATE SET value = value + 1"
+    ))
+
+def get_database_id(conn):
+    """Random identifier of this database, created on first use
+    Tells apart files kept next to different databases (e.g. snapshots) that would otherwise share a data version
+    """
+    database_id = get_meta_value(conn, 'database_id')
+    if database_id is None:
+        database_id = secrets.randbits(62)
+        set_meta_value(conn, 'database_id', database_id)
+    return database_id
+
+def get_data_version(engine):
+    """Current data version, bumped by every write (0 before the first one)"""
+    try:
+        with engine.connect() as conn:
+            version = conn.execute(text(f"SELECT value FROM {META_TABLE} WHERE key = 'data_version'")).scalar()
+        return version or 0
+    except Exception:
+        return 0
+
+def load_data_from_db(engine):
+    """Load all data from database (an empty frame when the table does not exist yet)"""
+    inspector = inspect(engine)
+    if TABLE_NAME in inspector.get_table_names():
+        columns_sql = ", ".join(f'"{col}"' for col in REQUIRED_COLUMNS)
+        return normalize_frame(pd.read_sql_query(f'SELECT {columns_sql} FROM {TABLE_NAME}', engine))
+    return pd.DataFrame(columns=REQUIRED_COLUMNS)
+
+def build_search_filter(search_term):
+    """WHERE clause and parameters matching search_term anywhere in any column (case-insensitive)"""
+    if not search_term:
+        return "", {}
+    # Treat % and _ in the search term literally
+    escaped = search_term.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    conditions = [f'"{col}" LIKE :search_pattern ESCAPE \'\\\'' for col in REQUIRED_COLUMNS]
+    return f"WHERE {' OR '.join(conditions)}", {'search_pattern': f"%{escaped}%"}
+
+def build_fts_query(search_term):
+    """FTS5 query where every word of the search term must start a word in some column"""
+    # Each word becomes a quoted prefix phrase, so "john.smi" matches john.smith@... and punctuation is never syntax
+    terms = [term.replace('"', '""') for term in search_term.split()]
+    return " ".join(f'"{term}"*' for term in terms if term.strip('"'))
+
+def count_matching_rows(engine, search_term):
+    """Number of records matching the search term and the search method used ('fts' or 'like')
+    Uses the ranked full-text index when available; falls back to a substring scan when it finds nothing
+    """
+    with engine.connect() as conn:
+        fts_query = build_fts_query(search_term)
+        if fts_query and inspect(conn).has_table(FTS_TABLE):
+            count = conn.execute(
+                text(f'SELECT COUNT(*) FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_query'),
+                {'fts_query': fts_query}
+            ).scalar()
+            if count:
+                return count, 'fts'
+        
+        # Substring match (e.g. the middle of a word)
+        where_sql, params = build_search_filter(search_term)
+        count = conn.execute(text(f'SELECT COUNT(*) FROM {TABLE_NAME} {where_sql}'), params).scalar()
+        return count or 0, 'like'
+
+def build_records_query(search_term='', search_method='like', with_ids=False):
+    """SELECT of the records matching a search term (every record without one) and its parameters
+    Full-text results are ordered by relevance (bm25), everything else in insertion order
+    """
+    columns_sql = ", ".join(f'"{col}"' for col in REQUIRED_COLUMNS)
+    if with_ids:
+        # The search index rowid is the record id
+        columns_sql = f'rowid AS id, {columns_sql}'
+    if search_term and search_method == 'fts':
+        query = f'SELECT {columns_sql} FROM {FTS_TABLE} WHERE {FTS_TABLE} MATCH :fts_query ORDER BY rank'
+        params = {'fts_query': build_fts_query(search_term)}
+    else:
+        where_sql, params = build_search_filter(search_term)
+        query = f'SELECT {columns_sql} FROM {TABLE_NAME} {where_sql} ORDER BY id'
+    return query, params
+
+def load_page_from_db(engine, offset, limit, search_term='', search_method='like', with_ids=False):
+    """Load one page of records, optionally filtered by a search term
+    with_ids: index the page by the record id, for update_rows_by_id and delete_rows_by_id
+    """
+    query, params = build_records_query(search_term, search_method, with_ids)
+    params.update({'limit': limit, 'offset': offset})
+    page = pd.read_sql_query(text(f'{query} LIMIT :limit OFFSET :offset'), engine, params=params)
+    if with_ids:
+        page = page.set_index('id')
+    return normalize_frame(page)
+
+def iter_records_from_db(engine, search_term='', search_method='like', chunk_size=CHUNK_SIZE):
+    """Yield the records matching a search term (every record without one) as DataFrame chunks
+    Rows come from a streaming cursor, so the whole result is never held in memory at once
+    """
+    query, params = build_records_query(search_term, search_method)
+    with engine.connect() as conn:
+        result = conn.execution_options(stream_results=True).execute(text(query), params)
+        while True:
+            rows = result.fetchmany(chunk_size)
+            if not rows:
+                break
+            yield normalize_frame(pd.DataFrame(rows, columns=REQUIRED_COLUMNS))
+
+def count_filled_cells(engine):
+    """Number of non-empty cells, computed in SQL"""
+    filled_sql = " + ".join(
+        f"""SUM(CASE WHEN "{col}" IS NULL OR "{col}" = '' THEN 0 ELSE 1 END)"""
+        for col in REQUIRED_COLUMNS
+    )
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT {filled_sql} FROM {TABLE_NAME}')).scalar() or 0
+
+def ensure_table(conn, create=True):
+    """Create the contacts table if missing and migrate older tables to the current schema
+    Returns False when the table does not exist and create is False
+    """
+    inspector = inspect(conn)
+    if not inspector.has_table(TABLE_NAME):
+        if not create:
+            return False
+        create_contacts_table(conn, TABLE_NAME)
+        conn.execute(text(f'CREATE UNIQUE INDEX ux_{TABLE_NAME}_email_key ON {TABLE_NAME} (email_key)'))
+        ensure_search_index(conn)
+        return True
+    
+    table_columns = [col['name'] for col in inspector.get_columns(TABLE_NAME)]
+    if 'email_key' not in table_columns:
+        # Tables written by older versions: add the key column and fill it in place
+        conn.execute(text(f'ALTER TABLE {TABLE_NAME} ADD COLUMN email_key TEXT'))
+        
+        existing = pd.read_sql_query(text(f'SELECT rowid AS row_id, {REQUIRED_COLUMNS_SQL} FROM {TABLE_NAME}'), conn)
+        existing['email_key'] = normalize_email_key(canonicalize_emails(existing['Email']))
+        has_key = existing['email_key'] != ''
+        
+        # Only the first row per email can be kept under the unique index; the others are removed and logged
+        is_repeat = has_key & existing['email_key'].duplicated(keep='first')
+        repeated_ids = existing.loc[is_repeat, 'row_id'].tolist()
+        if repeated_ids:
+            conn.execute(text(f'DELETE FROM {TABLE_NAME} WHERE rowid = :row_id'), [{'row_id': row_id} for row_id in repeated_ids])
+            log_migration_deletes(conn, "email_key", existing[is_repeat])
+        
+        keyed = existing[has_key & ~is_repeat]
+        if len(keyed) > 0:
+            conn.execute(
+                text(f'UPDATE {TABLE_NAME} SET email_key = :email_key WHERE rowid = :row_id'),
+                keyed[['row_id', 'email_key']].to_dict('records')
+            )
+        
+        conn.execute(text(f'DROP INDEX IF EXISTS ux_{TABLE_NAME}_email'))
+        conn.execute(text(f'CREATE UNIQUE INDEX ux_{TABLE_NAME}_email_key ON {TABLE_NAME} (email_key)'))
+    
+    if 'id' not in table_columns:
+        add_primary_key(conn)
+    
+    if (get_meta_value(conn, 'email_format') or 0) < EMAIL_FORMAT_VERSION:
+        canonicalize_stored_emails(conn)
+        set_meta_value(conn, 'email_format', EMAIL_FORMAT_VERSION)
+    
+    ensure_search_index(conn)
+    return True
+
+def create_contacts_table(conn, table_name):
+    """Create an empty contacts table: integer primary key id (an alias of rowid), the required columns and email_key"""
+    columns_sql = ", ".join(f'"{col}" TEXT' for col in REQUIRED_COLUMNS)
+    conn.execute(text(f'CREATE TABLE {table_name} (id INTEGER PRIMARY KEY, {columns_sql}, email_key TEXT)'))
+
+def add_primary_key(conn):
+    """Rebuild a table written by an older version with an id primary key; every row keeps its rowid as its id
+    A plain rowid may change on VACUUM, an INTEGER PRIMARY KEY never does
+    """
+    rebuild_table = f'{TABLE_NAME}_rebuild'
+    conn.execute(text(f'DROP TABLE IF EXISTS {rebuild_table}'))
+    create_contacts_table(conn, rebuild_table)
+    conn.execute(text(
+        f'INSERT INTO {rebuild_table} (id, {REQUIRED_COLUMNS_SQL}, email_key) '
+        f'SELECT rowid, {REQUIRED_COLUMNS_SQL}, email_key FROM {TABLE_NAME}'
+    ))
+    # Dropping the old table also drops its index and the search index triggers
+    conn.execute(text(f'DROP TABLE {TABLE_NAME}'))
+    conn.execute(text(f'ALTER TABLE {rebuild_table} RENAME TO {TABLE_NAME}'))
+    conn.execute(text(f'CREATE UNIQUE INDEX ux_{TABLE_NAME}_email_key ON {TABLE_NAME} (email_key)'))
+    # Recreated with its triggers by ensure_search_index
+    conn.execute(text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
+
+def canonicalize_stored_emails(conn):
+    """Rewrite stored HTML/mailto emails to canonical form and re-key them (runs once per database)
+    A row whose canonical email already belongs to another row is removed (and logged); the existing row is kept
+    """
+    wrapped = pd.read_sql_query(
+        text(f'''SELECT rowid AS row_id, {REQUIRED_COLUMNS_SQL} FROM {TABLE_NAME} WHERE "Email" LIKE '%<a %' OR "Email" LIKE '%mailto:%' ORDER BY rowid'''),
+        conn
+    )
+    if len(wrapped) == 0:
+        return
+    
+    wrapped['Email'] = canonicalize_emails(wrapped['Email'])
+    wrapped['email_key'] = normalize_email_key(wrapped['Email'])
+    
+    # Keys already held by rows that are not being rewritten (a wrapped row may already carry its own canonical key)
+    wrapped_ids = set(wrapped['row_id'].tolist())
+    taken_keys = set()
+    for placeholders, params in in_clause_chunks(key for key in wrapped['email_key'].unique() if key):
+        result = conn.execute(text(f'SELECT email_key, rowid FROM {TABLE_NAME} WHERE email_key IN ({placeholders})'), params)
+        taken_keys.update(email_key for email_key, row_id in result if row_id not in wrapped_ids)
+    
+    has_key = wrapped['email_key'] != ''
+    is_repeat = has_key & (wrapped['email_key'].isin(taken_keys) | wrapped['email_key'].duplicated(keep='first'))
+    repeated_ids = wrapped.loc[is_repeat, 'row_id'].tolist()
+    if repeated_ids:
+        conn.execute(text(f'DELETE FROM {TABLE_NAME} WHERE rowid = :row_id'), [{'row_id': row_id} for row_id in repeated_ids])
+        log_migration_deletes(conn, "email_format", wrapped[is_repeat])
+    
+    kept = wrapped[~is_repeat]
+    if len(kept) > 0:
+        conn.execute(
+            text(f'UPDATE {TABLE_NAME} SET "Email" = :email, email_key = :email_key WHERE rowid = :row_id'),
+            [
+                {'row_id': int(row_id), 'email': email, 'email_key': email_key or None}
+                for row_id, email, email_key in zip(kept['row_id'], kept['Email'], kept['email_key'])
+            ]
+        )
+
+def log_migration_deletes(conn, source, removed):
+    """Log rows a schema migration removed as a 'migration' change batch, with their canonical email and their id
+    They are logged without an email key: the row kept under that email is not theirs, so as-of views and a rollback
+    bring them back next to it as rows without a key instead of replacing it
+    """
+    rows = removed[REQUIRED_COLUMNS].astype(object)
+    rows = rows.where(rows.notna(), None)
+    rows['Email'] = canonicalize_emails(removed['Email']).tolist()
+    rows['id'] = removed['row_id'].astype(int).tolist()
+    rows['email_key'] = None
+    batch_id = start_change_batch(conn, 'migration', source)
+    log_changes(conn, batch_id, [('delete', row, None) for row in rows.to_dict('records')])
+
+def ensure_search_index(conn):
+    """Create the FTS5 search index over the contacts table (SQLite only), kept in sync by triggers
+    Returns False when full-text search is not available and searches fall back to LIKE
+    """
+    if conn.dialect.name != 'sqlite':
+        return False
+    if inspect(conn).has_table(FTS_TABLE):
+        return True
+    
+    columns_sql = ", ".join(f'"{col}"' for col in REQUIRED_COLUMNS)
+    new_values_sql = ", ".join(f'new."{col}"' for col in REQUIRED_COLUMNS)
+    old_values_sql = ", ".join(f'old."{col}"' for col in REQUIRED_COLUMNS)
+    try:
+        # External content table: the index stores tokens only, the text stays in contacts_data
+        conn.execute(text(
+            f"CREATE VIRTUAL TABLE {FTS_TABLE} USING fts5({columns_sql}, "
+            f"content='{TABLE_NAME}', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2')"
+        ))
+    except Exception:
+        # SQLite built without FTS5
+        return False
+    
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ai AFTER INSERT ON {TABLE_NAME} BEGIN "
+        f"INSERT INTO {FTS_TABLE} (rowid, {columns_sql}) VALUES (new.rowid, {new_values_sql}); END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_ad AFTER DELETE ON {TABLE_NAME} BEGIN "
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {columns_sql}) VALUES ('delete', old.rowid, {old_values_sql}); END"
+    ))
+    conn.execute(text(
+        f"CREATE TRIGGER IF NOT EXISTS {FTS_TABLE}_au AFTER UPDATE ON {TABLE_NAME} BEGIN "
+        f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rowid, {columns_sql}) VALUES ('delete', old.rowid, {old_values_sql}); "
+        f"INSERT INTO {FTS_TABLE} (rowid, {columns_sql}) VALUES (new.rowid, {new_values_sql}); END"
+    ))
+    # Rank matches in Email and Company (the usual lookups) above the other columns
+    weights = ", ".join('2.0' if col in ('Email', 'Company') else '1.0' for col in REQUIRED_COLUMNS)
+    conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}, rank) VALUES ('rank', 'bm25({weights})')"))
+    # Index the rows already in the table
+    conn.execute(text(f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"))
+    return True
+
+def in_clause_chunks(values, prefix='k', chunk_size=500):
+    """Yield (placeholders, params) for an 'IN (...)' lookup over values, chunk_size values at a time
+    SQLite caps the number of bound parameters per statement
+    """
+    values = list(values)
+    for start in range(0, len(values), chunk_size):
+        params = {f'{prefix}{idx}': value for idx, value in enumerate(values[start:start + chunk_size])}
+        yield ", ".join(f':{name}' for name in params), params
+
+def fetch_rows_by_email_keys(conn, email_keys, chunk_size=500):
+    """Load only the stored rows whose email_key is in email_keys (indexed lookup)"""
+    columns_sql = ", ".join(f'"{col}"' for col in REQUIRED_COLUMNS)
+    email_keys = [key for key in dict.fromkeys(email_keys) if key]
+    
+    chunks = []
+    for placeholders, params in in_clause_chunks(email_keys, 'k', chunk_size):
+        query = text(f'SELECT {columns_sql} FROM {TABLE_NAME} WHERE email_key IN ({placeholders})')
+        chunks.append(pd.read_sql_query(query, conn, params=params))
+    
+    if not chunks:
+        return pd.DataFrame(columns=REQUIRED_COLUMNS)
+    return normalize_frame(pd.concat(chunks, ignore_index=True))
+
+def upsert_rows(conn, rows, update_existing=True, with_ids=False):
+    """Insert rows keyed on email_key in one executemany call
+    update_existing: overwrite matching rows (replace) or leave them untouched (append)
+    with_ids: the rows carry the record 'id' to insert them under (the caller checks it is free)
+    """
+    if not rows:
+        return
+    
+    insert_columns = (['id'] if with_ids else []) + REQUIRED_COLUMNS + ['email_key']
+    columns_sql = ", ".join(f'"{col}"' for col in insert_columns)
+    values_sql = ", ".join(f':{col}' for col in insert_columns)
+    if update_existing:
+        set_sql = ", ".join(f'"{col}" = excluded."{col}"' for col in REQUIRED_COLUMNS)
+        conflict_sql = f'DO UPDATE SET {set_sql}'
+    else:
+        conflict_sql = 'DO NOTHING'
+    
+    upsert_query = f'INSERT INTO {TABLE_NAME} ({columns_sql}) VALUES ({values_sql}) ON CONFLICT (email_key) {conflict_sql}'
+    conn.execute(text(upsert_query), rows)
+
+def fetch_unkeyed_rows(conn):
+    """Stored rows without an email (the email_key index finds them)"""
+    query = text(f'SELECT {REQUIRED_COLUMNS_SQL} FROM {TABLE_NAME} WHERE email_key IS NULL')
+    return normalize_frame(pd.read_sql_query(query, conn))
+
+def review_keys(df, email_keys):
+    """Selection key of each upload row: its email_key, or ' row <index label>' for a row without an email
+    Email keys are stripped, so the leading space never collides with one
+    """
+    return email_keys.where(email_keys != '', pd.Series(' row ' + df.index.astype(str), index=df.index))
+
+def compute_changes(existing_df, df, update_mode='replace', unkeyed_df=None):
+    """Diff file rows against existing rows with a single hash join on the normalized Email
+    Rows without an email are compared on all their values with the stored rows without one (unkeyed_df):
+    an identical row is a duplicate in both modes, so uploading the same file twice stores it once
+    Returns (updates, new_rows, duplicates) lists, rows with an email first, each in file order;
+    every entry carries its 'review_key' (see review_keys)
+    """
+    df_new = df[REQUIRED_COLUMNS].copy()
+    df_new['_email_key'] = normalize_email_key(df_new['Email'])
+    is_unkeyed = df_new['_email_key'] == ''
+    df_unkeyed = df_new[is_unkeyed]
+    # One entry per email; the last occurrence in the file wins, like in prepare_upload
+    df_new = df_new[~is_unkeyed].drop_duplicates(subset=['_email_key'], keep='last')
+    
+    if existing_df is not None and len(existing_df) > 0:
+        df_old = existing_df[REQUIRED_COLUMNS].copy()
+        df_old['_email_key'] = normalize_email_key(df_old['Email'])
+        # Rows without an email can never be matched
+        df_old = df_old[df_old['_email_key'] != '']
+        df_old = df_old.drop_duplicates(subset=['_email_key'], keep='first')
+    else:
+        df_old = pd.DataFrame(columns=REQUIRED_COLUMNS + ['_email_key'])
+    
+    # Left join keeps the file order; '_merge' tells which emails already exist
+    merged = df_new.merge(df_old, on='_email_key', how='left', suffixes=('', '_old'), indicator=True)
+    is_match = (merged['_merge'] == 'both').to_numpy()
+    
+    # Compare every column for all matched rows at once
+    old_vals = {}
+    new_vals = {}
+    changed = {}
+    for col in REQUIRED_COLUMNS:
+        # Unmatched rows have no old values after the left join
+        old_vals[col] = merged[f'{col}_old'].fillna('').str.strip().to_numpy()
+        new_vals[col] = merged[col].str.strip().to_numpy()
+        changed[col] = (old_vals[col] != new_vals[col]) & is_match
+    
+    new_records = merged[REQUIRED_COLUMNS].to_dict('records')
+    keys = merged['_email_key'].tolist()
+    
+    updates = []
+    new_rows = []
+    duplicates = []
+    for pos, email_key in enumerate(keys):
+        new_row = new_records[pos]
+        entry = {
+            'email': str(new_row.get('Email', '')),
+            'email_key': email_key,
+            'review_key': email_key,
+            'name': str(new_row.get('Name', '')),
+            'surname': str(new_row.get('Surname', ''))
+        }
+        
+        if not is_match[pos]:
+            entry.update({'row': new_row, 'type': 'new'})
+            new_rows.append(entry)
+        elif update_mode == 'replace':
+            changed_cols = {}
+            for col in REQUIRED_COLUMNS:
+                if changed[col][pos]:
+                    old_val = old_vals[col][pos]
+                    new_val = new_vals[col][pos]
+                    changed_cols[col] = {
+                        'old': old_val if old_val else '(empty)',
+                        'new': new_val if new_val else '(empty)'
+                    }
+            entry.update({
+                'changed_columns': changed_cols,
+                'old_row': {col: old_vals[col][pos] for col in REQUIRED_COLUMNS},
+                'new_row': new_row,
+                'type': 'update' if changed_cols else 'no_change'
+            })
+            updates.append(entry)
+        else:  # append mode
+            entry.update({'row': new_row, 'type': 'duplicate'})
+            duplicates.append(entry)
+    
+    # Rows without an email: new unless the same values are stored already or came earlier in the file
+    seen_values = set()
+    if unkeyed_df is not None:
+        seen_values.update(tuple(value.strip() for value in row) for row in unkeyed_df[REQUIRED_COLUMNS].itertuples(index=False, name=None))
+    unkeyed_review_keys = review_keys(df_unkeyed, df_unkeyed['_email_key'])
+    for review_key, new_row in zip(unkeyed_review_keys, df_unkeyed[REQUIRED_COLUMNS].to_dict('records')):
+        values = tuple(new_row[col].strip() for col in REQUIRED_COLUMNS)
+        entry = {
+            'email': '',
+            'email_key': '',
+            'review_key': review_key,
+            'name': str(new_row.get('Name', '')),
+            'surname': str(new_row.get('Surname', '')),
+            'row': new_row,
+            'type': 'duplicate' if values in seen_values else 'new'
+        }
+        (duplicates if values in seen_values else new_rows).append(entry)
+        seen_values.add(values)
+    
+    return updates, new_rows, duplicates
+
+def prepare_upload(df, selected_items=None):
+    """Attach '_email_key' to the upload rows, optionally keep only the selected rows (by review key)
+    The last row per email wins, like in combine_sheets and merge_files; rows without an email are all kept
+    """
+    df_copy = df[REQUIRED_COLUMNS].copy()
+    df_copy['_email_key'] = normalize_email_key(df_copy['Email'])
+    if selected_items:
+        df_copy = df_copy[review_keys(df_copy, df_copy['_email_key']).isin([k for k, v in selected_items.items() if v])]
+    
+    is_last = ~df_copy['_email_key'].duplicated(keep='last')
+    return df_copy[is_last | (df_copy['_email_key'] == '')]
+
+def preview_changes(engine, df, update_mode='replace'):
+    """Preview what would change without actually updating the database"""
+    try:
+        with engine.begin() as conn:
+            table_exists = ensure_table(conn, create=False)
+            
+            df_copy = prepare_upload(df)
+            if table_exists:
+                # Load only the stored rows sharing an email with the upload (and those without one, when needed)
+                existing_df = fetch_rows_by_email_keys(conn, df_copy['_email_key'])
+                unkeyed_df = fetch_unkeyed_rows(conn) if (df_copy['_email_key'] == '').any() else None
+            else:
+                # Table doesn't exist, all rows are new
+                existing_df = None
+                unkeyed_df = None
+            
+            preview_changes_details, new_rows, duplicate_rows = compute_changes(existing_df, df_copy, update_mode, unkeyed_df)
+        
+        return {
+            'updates': preview_changes_details,
+            'new_rows': new_rows,
+            'duplicates': duplicate_rows,
+            'update_mode': update_mode
+        }
+    except Exception as e:
+        return {'error': str(e)}
+
+def update_database(engine, df, update_mode='replace', selected_items=None, source=''):
+    """Update database with DataFrame and return change details
+    selected_items: dict with the review key (see review_keys) as key and True/False as value for which rows to update
+    Only new and changed rows are written, in a single transaction, CHUNK_SIZE upload rows at a time
+    The written rows are logged as one change batch (source names the uploaded files); its id is returned as 'batch_id'
+    updated_count counts every matched row, unchanged_count the matched rows that were already up to date
+    """
+    try:
+        changes_details = []  # Store change details
+        updated_count = 0
+        unchanged_count = 0
+        duplicates_count = 0
+        batch_id = None
+        
+        if selected_items is None:
+            selected_items = {}  # If None, update all
+        
+        # Read, diff and write in one transaction
+        with engine.begin() as conn:
+            table_exists = ensure_table(conn, create=False)
+            existing_count = conn.execute(text(f'SELECT COUNT(*) FROM {TABLE_NAME}')).scalar() if table_exists else 0
+            ensure_table(conn)
+            
+            # Normalize Email for matching and filter based on selected_items; the last row per email wins over the whole upload
+            df_copy = prepare_upload(df, selected_items)
+            unkeyed_df = fetch_unkeyed_rows(conn) if (df_copy['_email_key'] == '').any() else None
+            
+            # Diffed and written CHUNK_SIZE rows at a time: emails are unique after prepare_upload, so chunks never overlap,
+            # and only one chunk's stored rows, diff entries and log images are held at once
+            new_count = 0
+            for start in range(0, len(df_copy), CHUNK_SIZE):
+                df_chunk = df_copy.iloc[start:start + CHUNK_SIZE]
+                
+                # Indexed lookup of the stored rows sharing an email with the chunk
+                existing_df = fetch_rows_by_email_keys(conn, df_chunk['_email_key'])
+                updates, new_rows, duplicates = compute_changes(existing_df, df_chunk, update_mode, unkeyed_df)
+                new_keys = {row['email_key'] for row in new_rows if row['email_key']}
+                duplicates_count += len(duplicates)
+                
+                if update_mode == 'replace':
+                    # Track changes for selected updated records
+                    changed_keys = set()
+                    for update in updates:
+                        if update['changed_columns']:
+                            changed_keys.add(update['email_key'])
+                            changes_details.append({
+                                'email': update['email'],
+                                'name': update['name'],
+                                'surname': update['surname'],
+                                'changed_columns': update['changed_columns']
+                            })
+                    write_keys = changed_keys | new_keys
+                    updated_count += len(updates)
+                    unchanged_count += len(updates) - len(changed_keys)
+                else:
+                    # Append mode - add only new rows (skip duplicates based on Email)
+                    write_keys = new_keys
+                
+                df_write = df_chunk[df_chunk['_email_key'].isin(write_keys)]
+                rows_to_write = df_write[REQUIRED_COLUMNS].to_dict('records')
+                for row, email_key in zip(rows_to_write, df_write['_email_key']):
+                    row['email_key'] = email_key
+                # Rows without an email are stored with a NULL key so they never collide
+                unkeyed_rows = [entry['row'] for entry in new_rows if not entry['email_key']]
+                rows_to_write.extend({**row, 'email_key': None} for row in unkeyed_rows)
+                
+                upsert_rows(conn, rows_to_write, update_existing=(update_mode == 'replace'))
+                new_count += len(new_rows)
+                
+                # Before/after images go to the change log in the same transaction, one batch for the whole upload
+                if rows_to_write:
+                    if batch_id is None:
+                        batch_id = start_change_batch(conn, f'upload_{update_mode}', source)
+                    stored_rows = dict(zip(normalize_email_key(existing_df['Email']), existing_df[REQUIRED_COLUMNS].to_dict('records')))
+                    log_changes(conn, batch_id, [
+                        ('insert', None, row) if row['email_key'] is None or row['email_key'] in new_keys
+                        else ('update', stored_rows[row['email_key']], row)
+                        for row in rows_to_write
+                    ])
+                
+                # Rows without an email written by this chunk count as stored for the next chunks
+                if unkeyed_rows:
+                    written_df = pd.DataFrame(unkeyed_rows, columns=REQUIRED_COLUMNS)
+                    unkeyed_df = written_df if unkeyed_df is None else pd.concat([unkeyed_df, written_df], ignore_index=True)
+            
+            bump_data_version(conn)
+        
+        if not table_exists:
+            message = f"✅ Successfully created table and added {new_count} rows!"
+        elif existing_count == 0:
+            message = f"✅ Successfully {'added' if update_mode == 'replace' else 'appended'} {new_count} new rows!"
+        elif update_mode == 'replace':
+            kept_count = existing_count - updated_count
+            message = f"✅ Successfully updated database! Updated: {updated_count} rows, Added: {new_count} rows, Kept: {kept_count} existing rows."
+            if duplicates_count > 0:
+                message += f" Skipped {duplicates_count} row(s) without an email that are already stored."
+            
+            return True, {
+                'message': message,
+                'updated_count': updated_count,
+                'unchanged_count': unchanged_count,
+                'new_count': new_count,
+                'kept_count': kept_count,
+                'duplicates_count': duplicates_count,
+                'changes': changes_details,
+                'batch_id': batch_id
+            }
+        else:
+            if new_count > 0:
+                message = f"✅ Successfully appended {new_count} new rows!" + (f" (Skipped {duplicates_count} duplicate email(s))" if duplicates_count > 0 else "")
+            else:
+                message = f"⚠️ No new rows to add. All selected rows already exist in database (duplicate emails)."
+            
+            return True, {
+                'message': message,
+                'updated_count': 0,
+                'unchanged_count': 0,
+                'new_count': new_count,
+                'kept_count': existing_count,
+                'duplicates_count': duplicates_count,
+                'changes': [],
+                'batch_id': batch_id
+            }
+        
+        return True, {
+            'message': message,
+            'updated_count': 0,
+            'unchanged_count': 0,
+            'new_count': new_count,
+            'kept_count': 0,
+            'duplicates_count': duplicates_count,
+            'changes': [],
+            'batch_id': batch_id
+        }
+    except Exception as e:
+        return False, f"❌ Error: {str(e)}"
+
+def get_db_stats(engine):
+    """Get database statistics"""
+    try:
+        inspector = inspect(engine)
+        if TABLE_NAME in inspector.get_table_names():
+            with engine.connect() as conn:
+                result = conn.execute(text(f"SELECT COUNT(*) FROM {TABLE_NAME}"))
+                count = result.scalar()
+            return {'exists': True, 'row_count': count}
+        return {'exists': False, 'row_count': 0}
+    except:
+        return {'exists': False, 'row_count': 0}
+
+def fetch_rows_by_ids(conn, ids, chunk_size=500):
+    """Stored rows for the given record ids as a DataFrame with an 'id' column (primary key lookups)"""
+    frames = []
+    for placeholders, params in in_clause_chunks([int(record_id) for record_id in ids], 'id', chunk_size):
+        frames.append(pd.read_sql_query(
+            text(f'SELECT id, {REQUIRED_COLUMNS_SQL} FROM {TABLE_NAME} WHERE id IN ({placeholders})'),
+            conn, params=params
+        ))
+    if not frames:
+        return pd.DataFrame(columns=['id'] + REQUIRED_COLUMNS)
+    return pd.concat(frames, ignore_index=True)
+
+def delete_rows_by_id(engine, ids):
+    """Delete the records with the given ids in one transaction and log them as one 'delete' change batch"""
+    try:
+        with engine.begin() as conn:
+            # Keep the deleted rows in the change log so they can be restored
+            deleted_df = fetch_rows_by_ids(conn, ids)
+            if len(deleted_df) == 0:
+                return False, "Rows not found (already deleted?)"
+            for placeholders, params in in_clause_chunks([int(record_id) for record_id in deleted_df['id']], 'id'):
+                conn.execute(text(f'DELETE FROM {TABLE_NAME} WHERE id IN ({placeholders})'), params)
+            # The id is logged with each row, so a rollback restores it under the same id
+            deleted_rows = deleted_df[['id'] + REQUIRED_COLUMNS].to_dict('records')
+            source = deleted_rows[0]['Email'] if len(deleted_rows) == 1 else f"{len(deleted_rows)} row(s)"
+            batch_id = start_change_batch(conn, 'delete', source)
+            log_changes(conn, batch_id, [('delete', row, None) for row in deleted_rows])
+            bump_data_version(conn)
+        
+        if len(deleted_rows) == 1:
+            return True, "Row deleted successfully!"
+        return True, f"{len(deleted_rows)} rows deleted successfully!"
+    except Exception as e:
+        return False, f"Error deleting rows: {str(e)}"
+
+def delete_row_from_db(engine, record_id):
+    """Delete one record by its id"""
+    return delete_rows_by_id(engine, [record_id])
+
+def update_row_in_db(engine, record_id, new_row_data):
+    """Update the given columns of one record by its id"""
+    return update_rows_by_id(engine, [(record_id, None, new_row_data)])
+
+def update_rows_by_id(engine, edits):
+    """Write several edited rows in one transaction, keyed by record id, and log them as one 'edit' change batch
+    edits: [(id, shown_row, new_values)] with shown_row the values the edit started from (or None) and new_values the changed columns
+    Rows changed or deleted since they were shown are skipped rather than overwritten
+    """
+    try:
+        with engine.begin() as conn:
+            # Current values of the edited rows (primary key lookups)
+            stored_df = fetch_rows_by_ids(conn, [record_id for record_id, _, _ in edits])
+            stored_ids = stored_df['id'].astype(int).tolist()
+            stored_rows = dict(zip(stored_ids, stored_df[['id'] + REQUIRED_COLUMNS].to_dict('records')))
+            # Compared in the same text form the page was shown in
+            current_rows = dict(zip(stored_ids, normalize_frame(stored_df).to_dict('records')))
+            
+            # Rows editing the same columns share one executemany statement
+            statements = {}
+            changes = []
+            skipped = 0
+            for record_id, shown_row, new_values in edits:
+                record_id = int(record_id)
+                current = current_rows.get(record_id)
+                if current is None or (shown_row is not None and any(current[col] != shown_row[col] for col in REQUIRED_COLUMNS)):
+                    skipped += 1
+                    continue
+                
+                # Edited emails are stored in canonical form, like uploaded ones
+                new_values = dict(new_values)
+                params = {'id': record_id}
+                set_clauses = []
+                if 'Email' in new_values:
+                    new_values['Email'] = canonicalize_emails(pd.Series([new_values['Email']])).iloc[0]
+                    set_clauses.append('email_key = :email_key')
+                    params['email_key'] = normalize_email_key(pd.Series([new_values['Email']])).iloc[0] or None
+                for idx, col in enumerate(REQUIRED_COLUMNS):
+                    if col in new_values:
+                        set_clauses.append(f'"{col}" = :set_{idx}')
+                        params[f'set_{idx}'] = new_values[col]
+                
+                statements.setdefault(f'UPDATE {TABLE_NAME} SET {", ".join(set_clauses)} WHERE id = :id', []).append(params)
+                changes.append(('update', stored_rows[record_id], {**stored_rows[record_id], **new_values}))
+            
+            for statement, params in statements.items():
+                conn.execute(text(statement), params)
+            if changes:
+                batch_id = start_change_batch(conn, 'edit', f"{len(changes)} row(s)")
+                log_changes(conn, batch_id, changes)
+                bump_data_version(conn)
+        
+        message = f"{len(changes)} row(s) updated successfully!"
+        if skipped:
+            message += f" {skipped} row(s) were changed or deleted by someone else in the meantime and were skipped."
+        return True, message
+    except IntegrityError:
+        return False, "Error updating rows: an edited Email already belongs to another record. Nothing was saved."
+    except Exception as e:
+        return False, f"Error updating rows: {str(e)}"
+
+def delete_entire_database(engine):
+    """Delete the entire database table"""
+    try:
+        inspector = inspect(engine)
+        if TABLE_NAME in inspector.get_table_names():
+            with engine.connect() as conn:
+                # Every row is logged as deleted first, so the drop can be rolled back
+                all_rows = conn.execute(text(f'SELECT id, {REQUIRED_COLUMNS_SQL} FROM {TABLE_NAME} ORDER BY id')).mappings().all()
+                if all_rows:
+                    batch_id = start_change_batch(conn, 'delete_all')
+                    log_changes(conn, batch_id, [('delete', dict(row), None) for row in all_rows])
+                conn.execute(text(f'DROP TABLE IF EXISTS {TABLE_NAME}'))
+                # The search index mirrors the table (its triggers were dropped with it)
+                conn.execute(text(f'DROP TABLE IF EXISTS {FTS_TABLE}'))
+                bump_data_version(conn)
+                conn.commit()
+            return True, "Database table deleted successfully!"
+        else:
+            return False, "Table does not exist"
+    except Exception as e:
+        return False, f"Error deleting database: {str(e)}"
+
+def ensure_ingest_ledger(conn):
+    """Create the ledger of ingested files (one row per file content hash)"""
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {LEDGER_TABLE} ('
+        f'file_hash TEXT PRIMARY KEY, file_path TEXT, file_size INTEGER, status TEXT, '
+        f'rows INTEGER, message TEXT, ingested_at TEXT)'
+    ))
+
+def get_ingested_file(engine, file_hash):
+    """Ledger entry for a file content hash as a dict, or None if that content was never ingested"""
+    with engine.begin() as conn:
+        ensure_ingest_ledger(conn)
+        row = conn.execute(
+            text(f'SELECT file_hash, file_path, file_size, status, rows, message, ingested_at FROM {LEDGER_TABLE} WHERE file_hash = :file_hash'),
+            {'file_hash': file_hash}
+        ).mappings().first()
+    return dict(row) if row else None
+
+def record_ingested_file(engine, file_hash, file_path, file_size, status, rows=0, message=''):
+    """Add or replace the ledger entry for a file content hash"""
+    with engine.begin() as conn:
+        ensure_ingest_ledger(conn)
+        conn.execute(
+            text(
+                f'INSERT INTO {LEDGER_TABLE} (file_hash, file_path, file_size, status, rows, message, ingested_at) '
+                f'VALUES (:file_hash, :file_path, :file_size, :status, :rows, :message, :ingested_at) '
+                f'ON CONFLICT (file_hash) DO UPDATE SET file_path = excluded.file_path, file_size = excluded.file_size, '
+                f'status = excluded.status, rows = excluded.rows, message = excluded.message, ingested_at = excluded.ingested_at'
+            ),
+            {
+                'file_hash': file_hash,
+                'file_path': file_path,
+                'file_size': file_size,
+                'status': status,
+                'rows': rows,
+                'message': message,
+                'ingested_at': datetime.now().isoformat(timespec='seconds')
+            }
+        )
+
+def ensure_header_mappings(conn):
+    """Create the table of learned header mappings (normalized header -> required column)"""
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {HEADER_MAP_TABLE} ('
+        f'header TEXT PRIMARY KEY, column_name TEXT NOT NULL, hits INTEGER NOT NULL DEFAULT 0, updated_at TEXT)'
+    ))
+
+def load_header_mappings(engine):
+    """Learned header mappings as {normalized header: required column} ({} when none or unreadable)"""
+    try:
+        with engine.begin() as conn:
+            ensure_header_mappings(conn)
+            rows = conn.execute(text(f'SELECT header, column_name FROM {HEADER_MAP_TABLE}')).all()
+        return {header: column_name for header, column_name in rows}
+    except Exception:
+        return {}
+
+def save_header_mappings(engine, mappings):
+    """Store {normalized header: required column} pairs learned from an upload; repeats only count a hit"""
+    if not mappings:
+        return
+    updated_at = datetime.now().isoformat(timespec='seconds')
+    with engine.begin() as conn:
+        ensure_header_mappings(conn)
+        conn.execute(
+            text(
+                f'INSERT INTO {HEADER_MAP_TABLE} (header, column_name, hits, updated_at) VALUES (:header, :column_name, 1, :updated_at) '
+                f'ON CONFLICT (header) DO UPDATE SET hits = {HEADER_MAP_TABLE}.hits + 1, updated_at = excluded.updated_at'
+            ),
+            [{'header': header, 'column_name': column_name, 'updated_at': updated_at} for header, column_name in mappings.items()]
+        )
+
+def ensure_change_log(conn):
+    """Create the append-only change log: one batch per write, one before/after image per changed row (with its record id when known)
+    The key indexes serve per-email history and rollback checks; the batch index serves rollback and as-of replays
+    """
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {CHANGE_BATCH_TABLE} ('
+        f'batch_id INTEGER PRIMARY KEY, operation TEXT NOT NULL, source TEXT, created_at TEXT, '
+        f'rollback_of INTEGER, rolled_back_by INTEGER)'
+    ))
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {CHANGE_LOG_TABLE} ('
+        f'change_id INTEGER PRIMARY KEY, batch_id INTEGER NOT NULL, op TEXT NOT NULL, '
+        f'before_key TEXT, after_key TEXT, before_row TEXT, after_row TEXT, record_id INTEGER)'
+    ))
+    # Logs written by older versions have no record ids (their rows are restored under new ids)
+    if 'record_id' not in [col['name'] for col in inspect(conn).get_columns(CHANGE_LOG_TABLE)]:
+        conn.execute(text(f'ALTER TABLE {CHANGE_LOG_TABLE} ADD COLUMN record_id INTEGER'))
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{CHANGE_LOG_TABLE}_batch ON {CHANGE_LOG_TABLE} (batch_id)'))
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{CHANGE_LOG_TABLE}_before_key ON {CHANGE_LOG_TABLE} (before_key, batch_id)'))
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{CHANGE_LOG_TABLE}_after_key ON {CHANGE_LOG_TABLE} (after_key, batch_id)'))
+
+def start_change_batch(conn, operation, source='', rollback_of=None):
+    """Open a change batch in the caller's transaction and return its id"""
+    ensure_change_log(conn)
+    result = conn.execute(
+        text(
+            f'INSERT INTO {CHANGE_BATCH_TABLE} (operation, source, created_at, rollback_of) '
+            f'VALUES (:operation, :source, :created_at, :rollback_of)'
+        ),
+        {
+            'operation': operation,
+            'source': source,
+            'created_at': datetime.now().isoformat(timespec='seconds'),
+            'rollback_of': rollback_of
+        }
+    )
+    return result.lastrowid
+
+def email_key_of(row):
+    """email_key of a row dict (None for no row or no email), same rule as normalize_email_key
+    A row dict carrying its own 'email_key' is keyed by it (None keeps a row apart from the one stored under its email)
+    """
+    if row is None:
+        return None
+    if 'email_key' in row:
+        return row['email_key'] or None
+    return str(row.get('Email') or '').lower().strip() or None
+
+def row_image(row):
+    """JSON text of a row's required columns (None for no row)"""
+    if row is None:
+        return None
+    return json.dumps({col: '' if row.get(col) is None else str(row.get(col)) for col in REQUIRED_COLUMNS}, ensure_ascii=False)
+
+def record_id_of(before, after):
+    """Record id carried by a logged row dict ('id' key), None when unknown (e.g. rows inserted by an upload)"""
+    record_id = (after or before or {}).get('id')
+    return None if record_id is None or pd.isna(record_id) else int(record_id)
+
+def log_changes(conn, batch_id, changes):
+    """Append (op, before_row, after_row) changes to a batch; op is 'insert', 'update' or 'delete', rows are dicts or None
+    A row dict may carry its record 'id', which is logged next to the row images
+    """
+    if not changes:
+        return
+    conn.execute(
+        text(
+            f'INSERT INTO {CHANGE_LOG_TABLE} (batch_id, op, before_key, after_key, before_row, after_row, record_id) '
+            f'VALUES (:batch_id, :op, :before_key, :after_key, :before_row, :after_row, :record_id)'
+        ),
+        [
+            {
+                'batch_id': batch_id,
+                'op': op,
+                'before_key': email_key_of(before),
+                'after_key': email_key_of(after),
+                'before_row': row_image(before),
+                'after_row': row_image(after),
+                'record_id': record_id_of(before, after)
+            }
+            for op, before, after in changes
+        ]
+    )
+
+def read_change_entries(conn, query, params):
+    """Run a change log query and decode the row images into dicts"""
+    entries = [dict(row) for row in conn.execute(text(query), params).mappings().all()]
+    for entry in entries:
+        entry['before_row'] = json.loads(entry['before_row']) if entry['before_row'] else None
+        entry['after_row'] = json.loads(entry['after_row']) if entry['after_row'] else None
+    return entries
+
+def list_change_batches(engine, limit=100):
+    """Most recent change batches (newest first) with the number of rows each one changed"""
+    try:
+        with engine.begin() as conn:
+            ensure_change_log(conn)
+            return pd.read_sql_query(
+                text(
+                    f'SELECT b.batch_id, b.operation, b.source, b.created_at, b.rollback_of, b.rolled_back_by, '
+                    f'COUNT(l.change_id) AS changes FROM {CHANGE_BATCH_TABLE} b '
+                    f'LEFT JOIN {CHANGE_LOG_TABLE} l ON l.batch_id = b.batch_id '
+                    f'GROUP BY b.batch_id ORDER BY b.batch_id DESC LIMIT :limit'
+                ),
+                conn,
+                params={'limit': limit}
+            ).astype({'rollback_of': 'Int64', 'rolled_back_by': 'Int64'})
+    except Exception:
+        return pd.DataFrame(columns=['batch_id', 'operation', 'source', 'created_at', 'rollback_of', 'rolled_back_by', 'changes'])
+
+def changes_to_frame(entries):
+    """One row per logged change: batch, change type, email and every column ('old → new' where it changed)"""
+    records = []
+    for entry in entries:
+        before = entry['before_row'] or {}
+        after = entry['after_row'] or {}
+        record = {'Batch': entry['batch_id'], 'Change': entry['op']}
+        for col in REQUIRED_COLUMNS:
+            if before and after and before[col] != after[col]:
+                record[col] = f"{before[col] or '(empty)'} → {after[col] or '(empty)'}"
+            else:
+                record[col] = (after or before).get(col, '')
+        records.append(record)
+    return pd.DataFrame(records, columns=['Batch', 'Change'] + REQUIRED_COLUMNS)
+
+def load_batch_changes(engine, batch_id):
+    """Rows changed by one batch (see changes_to_frame)"""
+    with engine.begin() as conn:
+        ensure_change_log(conn)
+        entries = read_change_entries(
+            conn,
+            f'SELECT batch_id, op, before_row, after_row FROM {CHANGE_LOG_TABLE} WHERE batch_id = :batch_id ORDER BY change_id',
+            {'batch_id': batch_id}
+        )
+    return changes_to_frame(entries)
+
+def load_email_history(engine, email):
+    """Every logged change of one email, newest first (see changes_to_frame)"""
+    email_key = email_key_of({'Email': canonicalize_emails(pd.Series([email])).iloc[0]})
+    with engine.begin() as conn:
+        ensure_change_log(conn)
+        entries = read_change_entries(
+            conn,
+            f'SELECT batch_id, op, before_row, after_row FROM {CHANGE_LOG_TABLE} '
+            f'WHERE before_key = :email_key OR after_key = :email_key ORDER BY change_id DESC',
+            {'email_key': email_key}
+        )
+    return changes_to_frame(entries)
+
+def load_rows_as_of(engine, batch_id):
+    """Table contents right after batch_id was written (batch_id 0: before the first logged batch)
+    Built from the current rows by undoing the later changes in the log, newest first; only the emails those changes
+    touched are replayed (indexed lookups), every other row is streamed through unchanged and nothing is copied beforehand
+    """
+    with engine.begin() as conn:
+        ensure_change_log(conn)
+        later_entries = read_change_entries(
+            conn,
+            f'SELECT before_key, after_key, before_row, after_row FROM {CHANGE_LOG_TABLE} '
+            f'WHERE batch_id > :batch_id ORDER BY change_id DESC',
+            {'batch_id': batch_id}
+        )
+        table_exists = ensure_table(conn, create=False)
+        
+        # Current rows of the touched emails, then each change undone: remove its after image, put its before image back
+        touched_keys = {key for entry in later_entries for key in (entry['before_key'], entry['after_key']) if key}
+        touched_df = fetch_rows_by_email_keys(conn, touched_keys) if table_exists else pd.DataFrame(columns=REQUIRED_COLUMNS)
+        touched_rows = dict(zip(normalize_email_key(touched_df['Email']), touched_df[REQUIRED_COLUMNS].to_dict('records')))
+        # Rows without an email are matched on their values: removed from the stream below, or put back at the end
+        removed_unkeyed = Counter()
+        restored_unkeyed = Counter()
+        for entry in later_entries:
+            if entry['after_row'] is not None:
+                if entry['after_key']:
+                    touched_rows[entry['after_key']] = None
+                else:
+                    values = tuple(entry['after_row'][col] for col in REQUIRED_COLUMNS)
+                    if restored_unkeyed[values] > 0:
+                        restored_unkeyed[values] -= 1
+                    else:
+                        removed_unkeyed[values] += 1
+            if entry['before_row'] is not None:
+                if entry['before_key']:
+                    touched_rows[entry['before_key']] = entry['before_row']
+                else:
+                    restored_unkeyed[tuple(entry['before_row'][col] for col in REQUIRED_COLUMNS)] += 1
+        
+        frames = []
+        if table_exists:
+            result = conn.execution_options(stream_results=True).execute(
+                text(f'SELECT {REQUIRED_COLUMNS_SQL} FROM {TABLE_NAME} ORDER BY id')
+            )
+            while True:
+                rows = result.fetchmany(CHUNK_SIZE)
+                if not rows:
+                    break
+                chunk = normalize_frame(pd.DataFrame(rows, columns=REQUIRED_COLUMNS))
+                email_keys = normalize_email_key(chunk['Email'])
+                keep = ~email_keys.isin(touched_keys)
+                if sum(removed_unkeyed.values()) > 0:
+                    for pos in (email_keys == '').to_numpy().nonzero()[0]:
+                        values = tuple(chunk.iloc[pos])
+                        if removed_unkeyed[values] > 0:
+                            removed_unkeyed[values] -= 1
+                            keep.iloc[pos] = False
+                frames.append(chunk[keep])
+    
+    replayed = [row for row in touched_rows.values() if row is not None]
+    replayed += [dict(zip(REQUIRED_COLUMNS, values)) for values, count in restored_unkeyed.items() for _ in range(count)]
+    frames.append(normalize_frame(pd.DataFrame(replayed, columns=REQUIRED_COLUMNS)))
+    return pd.concat(frames, ignore_index=True)
+
+def rollback_change_batch(engine, batch_id):
+    """Undo one change batch; the undo is logged as a new 'rollback' batch, so it can be rolled back in turn
+    Refused when any of the batch's rows has been changed again since (roll back the later batch first)
+    """
+    try:
+        with engine.begin() as conn:
+            ensure_change_log(conn)
+            batch = conn.execute(
+                text(f'SELECT operation, rolled_back_by FROM {CHANGE_BATCH_TABLE} WHERE batch_id = :batch_id'),
+                {'batch_id': batch_id}
+            ).mappings().first()
+            if batch is None:
+                return False, f"❌ Change batch {batch_id} not found"
+            if batch['rolled_back_by'] is not None:
+                return False, f"❌ Change batch {batch_id} was already rolled back (batch {batch['rolled_back_by']})"
+            
+            entries = read_change_entries(
+                conn,
+                f'SELECT before_key, after_key, before_row, after_row, record_id FROM {CHANGE_LOG_TABLE} WHERE batch_id = :batch_id ORDER BY change_id',
+                {'batch_id': batch_id}
+            )
+            
+            # Current rows for every email the batch touched (indexed lookup)
+            table_exists = ensure_table(conn, create=False)
+            touched_keys = [key for entry in entries for key in (entry['before_key'], entry['after_key']) if key]
+            current_df = fetch_rows_by_email_keys(conn, touched_keys) if table_exists else pd.DataFrame(columns=REQUIRED_COLUMNS)
+            current_rows = dict(zip(normalize_email_key(current_df['Email']), current_df[REQUIRED_COLUMNS].to_dict('records')))
+            
+            # A row the batch wrote must still hold what it wrote; a row it removed must not be back
+            conflicts = 0
+            for entry in entries:
+                if entry['after_key'] and current_rows.get(entry['after_key']) != entry['after_row']:
+                    conflicts += 1
+                elif entry['before_key'] and entry['before_key'] != entry['after_key'] and entry['before_key'] in current_rows:
+                    conflicts += 1
+            # Rows without an email the batch wrote must all still be there with the same values
+            unkeyed_written = Counter(
+                tuple(entry['after_row'][col] for col in REQUIRED_COLUMNS)
+                for entry in entries if entry['after_row'] is not None and not entry['after_key']
+            )
+            values_sql = " AND ".join(f'"{col}" = :v_{idx}' for idx, col in enumerate(REQUIRED_COLUMNS))
+            for values, written in unkeyed_written.items():
+                stored = conn.execute(
+                    text(f'SELECT COUNT(*) FROM {TABLE_NAME} WHERE email_key IS NULL AND {values_sql}'),
+                    {f'v_{idx}': value for idx, value in enumerate(values)}
+                ).scalar() if table_exists else 0
+                conflicts += max(written - stored, 0)
+            if conflicts:
+                return False, f"❌ {conflicts} row(s) of change batch {batch_id} were changed again later. Roll back the later batches first."
+            
+            ensure_table(conn)
+            undo_batch_id = start_change_batch(conn, 'rollback', f"batch {batch_id}", rollback_of=batch_id)
+            set_sql = ", ".join(f'"{col}" = :new_{idx}' for idx, col in enumerate(REQUIRED_COLUMNS))
+            unkeyed_sql = " AND ".join(f'"{col}" = :old_{idx}' for idx, col in enumerate(REQUIRED_COLUMNS))
+            # Rows without an email are found by their values (one row per logged change)
+            unkeyed_match = f'rowid IN (SELECT rowid FROM {TABLE_NAME} WHERE email_key IS NULL AND {unkeyed_sql} LIMIT 1)'
+            
+            def row_params(prefix, row):
+                return {f'{prefix}_{idx}': row[col] for idx, col in enumerate(REQUIRED_COLUMNS)}
+            
+            # Each email appears once per batch, so the undo statements are grouped into executemany calls
+            statements = {}
+            undo_changes = []
+            for entry in reversed(entries):
+                before, after = entry['before_row'], entry['after_row']
+                # Logged rows carry their key and record id into the undo log
+                before = {**before, 'email_key': entry['before_key']} if before is not None else None
+                after = {**after, 'email_key': entry['after_key']} if after is not None else None
+                if entry['record_id'] is not None:
+                    before = {**before, 'id': entry['record_id']} if before is not None else None
+                    after = {**after, 'id': entry['record_id']} if after is not None else None
+                if after is not None and before is None:
+                    # Inserted row: remove it
+                    if entry['after_key']:
+                        statements.setdefault(f'DELETE FROM {TABLE_NAME} WHERE email_key = :email_key', []).append({'email_key': entry['after_key']})
+                    else:
+                        statements.setdefault(f'DELETE FROM {TABLE_NAME} WHERE {unkeyed_match}', []).append(row_params('old', after))
+                    undo_changes.append(('delete', after, None))
+                elif after is not None:
+                    # Updated row: write the old values (and key) back
+                    where_sql = 'email_key = :email_key' if entry['after_key'] else unkeyed_match
+                    statements.setdefault(f'UPDATE {TABLE_NAME} SET {set_sql}, email_key = :new_key WHERE {where_sql}', []).append(
+                        {**row_params('new', before), **row_params('old', after), 'email_key': entry['after_key'], 'new_key': entry['before_key']}
+                    )
+                    undo_changes.append(('update', after, before))
+                else:
+                    undo_changes.append(('insert', None, before))
+            
+            for statement, params in statements.items():
+                conn.execute(text(statement), params)
+            
+            # Deleted rows: insert them again in their original order, under their logged id while it is still free
+            restored = [before for op, _, before in reversed(undo_changes) if op == 'insert']
+            logged_ids = [row['id'] for row in restored if row.get('id') is not None]
+            taken_ids = set()
+            for placeholders, params in in_clause_chunks(logged_ids, 'id'):
+                taken_ids.update(conn.execute(text(f'SELECT id FROM {TABLE_NAME} WHERE id IN ({placeholders})'), params).scalars())
+            for row in restored:
+                if row.get('id') in taken_ids:
+                    row.pop('id')
+            rows_with_ids = [row for row in restored if row.get('id') is not None]
+            upsert_rows(conn, rows_with_ids, update_existing=False, with_ids=True)
+            upsert_rows(conn, [row for row in restored if row.get('id') is None], update_existing=False)
+            
+            log_changes(conn, undo_batch_id, undo_changes)
+            conn.execute(
+                text(f'UPDATE {CHANGE_BATCH_TABLE} SET rolled_back_by = :undo_batch_id WHERE batch_id = :batch_id'),
+                {'undo_batch_id': undo_batch_id, 'batch_id': batch_id}
+            )
+            bump_data_version(conn)
+        
+        return True, f"✅ Rolled back change batch {batch_id} ({len(entries)} row(s)) as batch {undo_batch_id}"
+    except Exception as e:
+        return False, f"❌ Error rolling back change batch {batch_id}: {str(e)}"
+
+def ensure_metrics_table(conn):
+    """Create the upload metrics table (one row per finished stage of an upload run)"""
+    conn.execute(text(
+        f'CREATE TABLE IF NOT EXISTS {METRICS_TABLE} ('
+        f'metric_id INTEGER PRIMARY KEY, run_id TEXT NOT NULL, source TEXT, stage TEXT NOT NULL, status TEXT, '
+        f'started_at TEXT, seconds REAL, rows_in INTEGER, rows_out INTEGER, bytes_read INTEGER, peak_rss INTEGER)'
+    ))
+    conn.execute(text(f'CREATE INDEX IF NOT EXISTS ix_{METRICS_TABLE}_run ON {METRICS_TABLE} (run_id)'))
+
+def save_upload_metrics(engine, records):
+    """Store finished stage records (see metrics.UploadMetrics)"""
+    columns = ['run_id', 'source', 'stage', 'status', 'started_at', 'seconds', 'rows_in', 'rows_out', 'bytes_read', 'peak_rss']
+    with engine.begin() as conn:
+        ensure_metrics_table(conn)
+        conn.execute(
+            text(f'INSERT INTO {METRICS_TABLE} ({", ".join(columns)}) VALUES ({", ".join(f":{col}" for col in columns)})'),
+            [{col: record.get(col) for col in columns} for record in records]
+        )
+
+def load_recent_metrics(engine, run_limit=20):
+    """Stage records of the most recent upload runs, oldest stage first"""
+    with engine.begin() as conn:
+        ensure_metrics_table(conn)
+        return pd.read_sql_query(
+            text(
+                f'SELECT run_id, source, stage, status, started_at, seconds, rows_in, rows_out, bytes_read, peak_rss '
+                f'FROM {METRICS_TABLE} WHERE run_id IN ('
+                f'SELECT run_id FROM {METRICS_TABLE} GROUP BY run_id ORDER BY MAX(metric_id) DESC LIMIT :run_limit'
+                f') ORDER BY metric_id'
+            ),
+            conn,
+            params={'run_limit': run_limit}
+        )
+
+def load_metrics_totals(engine):
+    """Per-stage totals over every recorded run, plus the latest duration and the highest peak RSS"""
+    with engine.begin() as conn:
+        ensure_metrics_table(conn)
+        return pd.read_sql_query(
+            text(
+                f'SELECT stage, COUNT(*) AS runs, SUM(seconds) AS seconds, SUM(rows_out) AS rows_out, '
+                f'SUM(bytes_read) AS bytes_read, SUM(CASE WHEN status = \'failed\' THEN 1 ELSE 0 END) AS failures, '
+                f'(SELECT m2.seconds FROM {METRICS_TABLE} m2 WHERE m2.stage = m.stage ORDER BY m2.metric_id DESC LIMIT 1) AS last_seconds, '
+                f'MAX(peak_rss) AS peak_rss '
+                f'FROM {METRICS_TABLE} m GROUP BY stage ORDER BY MIN(metric_id)'
+            ),
+            conn
+        )
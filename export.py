@@ -0,0 +1,98 @@
+"""Database export: stream the records to a CSV, Parquet or Excel file in a spooled temp file (no Streamlit imports)
+
+Rows are read from a streaming cursor in chunks and written as they arrive, so the table is never held in memory
+as one DataFrame; the temp file stays in memory up to EXPORT_SPOOL_BYTES and moves to disk beyond that.
+"""
+import os
+import tempfile
+
+import pyarrow as pa
+import pyarrow.parquet as pq
+from openpyxl import Workbook
+
+from ingest import REQUIRED_COLUMNS
+from database import iter_records_from_db
+from snapshot import current_snapshot, iter_snapshot_records
+
+# Export file size kept in memory before the temp file rolls over to disk
+EXPORT_SPOOL_BYTES = int(os.environ.get('EXPORT_SPOOL_BYTES', 32 * 1024 * 1024))
+
+# Excel sheets hold at most 1,048,576 rows including the header; larger exports continue on a new sheet
+XLSX_MAX_ROWS = 1048575
+
+# Format -> (label, file extension, MIME type)
+EXPORT_FORMATS = {
+    'csv': ("CSV", '.csv', 'text/csv'),
+    'parquet': ("Parquet", '.parquet', 'application/vnd.apache.parquet'),
+    'xlsx': ("Excel (.xlsx)", '.xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet')
+}
+
+def write_csv(chunks, file):
+    """CSV with one header row; returns the number of data rows"""
+    row_count = 0
+    for chunk in chunks:
+        chunk.to_csv(file, index=False, header=row_count == 0, mode='wb', encoding='utf-8')
+        row_count += len(chunk)
+    if row_count == 0:
+        file.write((",".join(REQUIRED_COLUMNS) + "\n").encode('utf-8'))
+    return row_count
+
+def write_parquet(chunks, file):
+    """Parquet with one row group per chunk, every column as a string; returns the number of rows"""
+    schema = pa.schema([(col, pa.string()) for col in REQUIRED_COLUMNS])
+    row_count = 0
+    with pq.ParquetWriter(file, schema) as writer:
+        for chunk in chunks:
+            writer.write_table(pa.Table.from_pandas(chunk, schema=schema, preserve_index=False))
+            row_count += len(chunk)
+    return row_count
+
+def write_xlsx(chunks, file):
+    """Excel workbook in write-only mode (rows are streamed, not kept as cells); returns the number of rows"""
+    workbook = Workbook(write_only=True)
+    worksheet = None
+    sheet_rows = 0
+    row_count = 0
+    for chunk in chunks:
+        for row in chunk.itertuples(index=False, name=None):
+            if worksheet is None or sheet_rows == XLSX_MAX_ROWS:
+                worksheet = workbook.create_sheet("Contacts" if worksheet is None else f"Contacts {len(workbook.worksheets) + 1}")
+                worksheet.append(REQUIRED_COLUMNS)
+                sheet_rows = 0
+            worksheet.append(row)
+            sheet_rows += 1
+            row_count += 1
+    if worksheet is None:
+        workbook.create_sheet("Contacts").append(REQUIRED_COLUMNS)
+    workbook.save(file)
+    return row_count
+
+EXPORT_WRITERS = {'csv': write_csv, 'parquet': write_parquet, 'xlsx': write_xlsx}
+
+def build_export(engine, export_format='csv', search_term='', search_method='like'):
+    """Write the records matching the search term (every record without one) to a spooled temp file
+    Returns (file rewound to the start, row count); the caller closes the file
+    """
+    if export_format not in EXPORT_WRITERS:
+        raise ValueError(f"Unsupported export format: {export_format}")
+    # Whole-table exports read the columnar snapshot while it is current; searches and a stale (or failed) snapshot
+    # stream from the database rather than refreshing the snapshot first
+    chunks = None
+    if not search_term:
+        try:
+            snapshot = current_snapshot(engine)
+            if snapshot is not None:
+                chunks = iter_snapshot_records(snapshot)
+        except Exception:
+            chunks = None
+    if chunks is None:
+        chunks = iter_records_from_db(engine, search_term, search_method)
+    
+    file = tempfile.SpooledTemporaryFile(max_size=EXPORT_SPOOL_BYTES, mode='w+b', suffix=EXPORT_FORMATS[export_format][1])
+    try:
+        row_count = EXPORT_WRITERS[export_format](chunks, file)
+    except Exception:
+        file.close()
+        raise
+    file.seek(0)
+    return file, row_count
@@ -0,0 +1,122 @@
+"""Header resolution: map a sheet's header row to the required columns with synonyms and similarity scoring (no Streamlit imports)
+
+Headers are compared in a normalized form (lowercase letters and digits only). Exact and synonym matches are
+taken first, remaining columns are matched by difflib similarity. Each distinct header tuple is resolved once
+per process; fuzzy matches can be stored in the database and loaded back with add_learned_synonyms, so the
+next file with the same layout resolves by lookup alone.
+"""
+import json
+import os
+import re
+from difflib import SequenceMatcher
+from functools import lru_cache
+
+# Synonyms per required column (in required column order); extend with a JSON file in HEADER_SYNONYMS_FILE
+HEADER_SYNONYMS = {
+    'Company': ['Company Name', 'Organization', 'Organisation', 'Organization Name', 'Employer', 'Account', 'Account Name', 'Firm'],
+    'Name': ['First Name', 'Firstname', 'Given Name', 'Forename', 'FName'],
+    'Surname': ['Last Name', 'Lastname', 'Family Name', 'LName'],
+    'Email': ['E-mail', 'Email Address', 'E-mail Address', 'Mail', 'Work Email', 'Business Email', 'Email ID'],
+    'Position': ['Job Title', 'Title', 'Role', 'Designation', 'Job Position', 'Job Role'],
+    'Phone': ['Phone Number', 'Phone No', 'Mobile', 'Mobile Number', 'Mobile No', 'Telephone', 'Tel', 'Cell', 'Contact Number']
+}
+
+# difflib ratio a fuzzy match must exceed ('Username' scores exactly 0.8 against 'Surname')
+FUZZY_THRESHOLD = 0.8
+
+NON_ALPHANUMERIC_PATTERN = re.compile(r'[\W_]+')
+
+def normalize_header(name):
+    """Header text compared by the resolver: lowercase letters and digits only"""
+    return NON_ALPHANUMERIC_PATTERN.sub('', str(name).strip().lower())
+
+def load_synonyms(synonyms_file=None):
+    """Built-in synonyms merged with the JSON file {required column: [synonyms]} in HEADER_SYNONYMS_FILE (if set)"""
+    synonyms = {req_col: list(names) for req_col, names in HEADER_SYNONYMS.items()}
+    synonyms_file = synonyms_file or os.environ.get('HEADER_SYNONYMS_FILE')
+    if synonyms_file:
+        with open(synonyms_file, encoding='utf-8') as f:
+            for req_col, names in json.load(f).items():
+                if req_col in synonyms:
+                    synonyms[req_col].extend(names)
+    return synonyms
+
+def build_synonym_index(synonyms):
+    """Normalized synonym -> required column; a required column's own name always maps to itself"""
+    index = {}
+    for req_col, names in synonyms.items():
+        for name in names:
+            index.setdefault(normalize_header(name), req_col)
+    for req_col in synonyms:
+        index[normalize_header(req_col)] = req_col
+    return index
+
+REQUIRED_ORDER = list(HEADER_SYNONYMS)
+SYNONYM_INDEX = build_synonym_index(load_synonyms())
+
+def add_learned_synonyms(learned):
+    """Add stored {normalized header: required column} pairs to the synonym index
+    Configured synonyms win over learned ones; memoized resolutions are dropped only when something was added
+    """
+    added = False
+    for header, req_col in learned.items():
+        if req_col in HEADER_SYNONYMS and header and header not in SYNONYM_INDEX:
+            SYNONYM_INDEX[header] = req_col
+            added = True
+    if added:
+        resolve_headers.cache_clear()
+    return added
+
+def learned_synonyms(column_mapping):
+    """{normalized header: required column} for mapped headers the synonym index does not know yet (fuzzy matches)"""
+    return {
+        normalize_header(header): req_col
+        for req_col, header in column_mapping.items()
+        if normalize_header(header) not in SYNONYM_INDEX
+    }
+
+def similarity(left, right):
+    """difflib ratio of two normalized headers, skipping the full comparison when the quick bound is already too low"""
+    matcher = SequenceMatcher(None, left, right)
+    if matcher.real_quick_ratio() <= FUZZY_THRESHOLD or matcher.quick_ratio() <= FUZZY_THRESHOLD:
+        return 0.0
+    return matcher.ratio()
+
+@lru_cache(maxsize=1024)
+def resolve_headers(headers):
+    """Map a header tuple to required columns: ((required column, header position), ...) in required column order
+    Unmatched required columns are left out; each header is used at most once
+    """
+    normalized = [normalize_header(header) for header in headers]
+    resolved = {}
+    
+    # Exact and synonym matches: a column's own name beats a synonym, a longer (more specific) synonym beats a shorter
+    # one ('Job Title' over 'Title'), then the last such header wins (as before)
+    for pos, header in enumerate(normalized):
+        req_col = SYNONYM_INDEX.get(header)
+        if req_col is None:
+            continue
+        rank = (0, 0) if header == normalize_header(req_col) else (1, -len(header))
+        if req_col not in resolved or rank <= resolved[req_col][0]:
+            resolved[req_col] = (rank, pos)
+    resolved = {req_col: pos for req_col, (rank, pos) in resolved.items()}
+    used_positions = set(resolved.values())
+    
+    # Fuzzy matches for what is left, best score first
+    missing = [req_col for req_col in REQUIRED_ORDER if req_col not in resolved]
+    if missing:
+        candidates = []
+        for pos, header in enumerate(normalized):
+            if pos in used_positions or not header:
+                continue
+            for synonym, req_col in SYNONYM_INDEX.items():
+                if req_col in missing:
+                    score = similarity(synonym, header)
+                    if score > FUZZY_THRESHOLD:
+                        candidates.append((score, -pos, req_col))
+        for score, neg_pos, req_col in sorted(candidates, reverse=True):
+            if req_col not in resolved and -neg_pos not in used_positions:
+                resolved[req_col] = -neg_pos
+                used_positions.add(-neg_pos)
+    
+    return tuple((req_col, resolved[req_col]) for req_col in REQUIRED_ORDER if req_col in resolved)
@@ -0,0 +1,439 @@
+"""Excel ingestion: workbook opening, column validation and sheet streaming (no Streamlit imports)"""
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+from openpyxl import load_workbook
+
+from header_mapper import resolve_headers
+
+# Required columns in order
+REQUIRED_COLUMNS = ['Company', 'Name', 'Surname', 'Email', 'Position', 'Phone']
+
+# Rows per DataFrame chunk when streaming sheets
+CHUNK_SIZE = 10000
+
+# Worker processes used when several sheets are selected (SHEET_WORKERS=1 disables the pool)
+SHEET_WORKERS = int(os.environ.get('SHEET_WORKERS', os.cpu_count() or 1))
+
+# HTML-wrapped emails (<a href="mailto:x@y">x@y</a>): the link text wins, then the mailto target
+EMAIL_LINK_TEXT_PATTERN = re.compile(r'<a\s[^>]*>\s*(.*?)\s*</a>', re.IGNORECASE | re.DOTALL)
+EMAIL_MAILTO_PATTERN = re.compile(r'mailto:\s*([^"\'>?\s]+)', re.IGNORECASE)
+
+# Text dtype for every normalized column: Arrow-backed when pyarrow is installed
+try:
+    import pyarrow  # noqa: F401
+    STRING_DTYPE = pd.StringDtype('pyarrow')
+except ImportError:
+    STRING_DTYPE = pd.StringDtype()
+
+def validate_columns(df):
+    """Validate that DataFrame has all required columns
+    Headers are matched by name, synonym or similarity (see header_mapper); resolution is memoized per header tuple
+    """
+    resolved = resolve_headers(tuple(str(col) for col in df.columns))
+    column_mapping = {req_col: df.columns[pos] for req_col, pos in resolved}
+    missing_cols = [req_col for req_col in REQUIRED_COLUMNS if req_col not in column_mapping]
+    
+    return len(missing_cols) == 0, missing_cols, column_mapping
+
+def normalize_text_column(values):
+    """Convert a column to STRING_DTYPE in one pass; missing cells become '' and whole-number floats lose their '.0'"""
+    text_values = values.astype(STRING_DTYPE)
+    if pd.api.types.is_float_dtype(values):
+        # Same text as cell_to_str gives on the openpyxl path (Excel stores every number as a float)
+        is_whole = values.notna() & values.mod(1).eq(0) & values.abs().lt(2 ** 53)
+        text_values[is_whole] = values[is_whole].astype('int64').astype(STRING_DTYPE)
+    return text_values.fillna('')
+
+def normalize_frame(df):
+    """Normalize the required columns (in order) to text; used once per upload and for rows read back from the database"""
+    return pd.DataFrame(
+        {col: normalize_text_column(df[col]) for col in REQUIRED_COLUMNS},
+        index=df.index
+    )
+
+def canonicalize_emails(emails):
+    """Canonical Email text: link markup and mailto: prefixes removed, surrounding whitespace stripped
+    The match key is this value lower-cased, so display and matching always agree
+    """
+    emails = emails.astype(STRING_DTYPE).fillna('')
+    is_markup = emails.str.contains('<a ', case=False, regex=False) | emails.str.contains('mailto:', case=False, regex=False)
+    if is_markup.any():
+        wrapped = emails[is_markup]
+        extracted = wrapped.str.extract(EMAIL_LINK_TEXT_PATTERN, expand=False)
+        # Link text that is empty or not an address falls back to the mailto target
+        extracted = extracted.where(extracted.str.contains('@', regex=False).fillna(False))
+        extracted = extracted.fillna(wrapped.str.extract(EMAIL_MAILTO_PATTERN, expand=False))
+        emails = emails.copy()
+        emails[is_markup] = extracted.fillna(wrapped)
+    return emails.str.strip()
+
+def normalize_email_key(emails):
+    """Normalized Email used to match rows: lower-case with surrounding whitespace removed"""
+    return emails.astype(STRING_DTYPE).fillna('').str.lower().str.strip()
+
+def keep_last_per_email(df):
+    """Rows of df with only the last row per email kept (same key as the database match); rows without an email are all kept"""
+    email_key = normalize_email_key(df['Email'])
+    return df[(email_key == '') | ~email_key.duplicated(keep='last')]
+
+def extract_required_columns(df, column_mapping):
+    """Extract and reorder DataFrame to have required columns in correct order"""
+    result_df = pd.DataFrame(index=df.index)
+    
+    for req_col in REQUIRED_COLUMNS:
+        if req_col in column_mapping:
+            result_df[req_col] = df[column_mapping[req_col]]
+        else:
+            result_df[req_col] = None
+    
+    # Single conversion to text; a literal "nan" typed in a cell is kept
+    result_df = normalize_frame(result_df)
+    result_df['Email'] = canonicalize_emails(result_df['Email'])
+    return result_df
+
+def validate_file_format(uploaded_file):
+    """Validate file format and return file extension and validation status
+    uploaded_file is a Streamlit upload or a path on disk (command line)
+    """
+    if isinstance(uploaded_file, (str, os.PathLike)):
+        file_name = os.fspath(uploaded_file)
+        file_size = os.path.getsize(file_name)
+    else:
+        # Reset file pointer
+        uploaded_file.seek(0)
+        file_name = uploaded_file.name
+        file_size = uploaded_file.size
+    
+    # Check if file is empty
+    if file_size == 0:
+        return False, "Empty", "Uploaded file is empty!"
+    
+    # Get file extension
+    file_extension = file_name.split('.')[-1].lower()
+    
+    # Validate file type
+    if file_extension not in ['xlsx', 'xls']:
+        return False, file_extension, f"Invalid file type '{file_extension}'. Please upload .xlsx or .xls files."
+    
+    # Determine engine
+    engine_name = 'xlrd' if file_extension == 'xls' else 'openpyxl'
+    
+    return True, file_extension, engine_name
+
+# Workbook files picked up from a directory; Excel leaves '~$Book.xlsx' lock files next to open workbooks
+EXCEL_EXTENSIONS = ('.xlsx', '.xls')
+EXCEL_LOCK_PREFIX = '~$'
+
+def is_excel_lock_file(file_path):
+    """True for the lock file Excel keeps next to an open workbook"""
+    return os.path.basename(file_path).startswith(EXCEL_LOCK_PREFIX)
+
+def list_workbooks(directory):
+    """Excel files directly inside directory in name order, without lock files (empty when it cannot be read)"""
+    try:
+        names = os.listdir(directory)
+    except OSError:
+        return []
+    return sorted(
+        os.path.join(directory, name) for name in names
+        if name.lower().endswith(EXCEL_EXTENSIONS) and not is_excel_lock_file(name)
+        and os.path.isfile(os.path.join(directory, name))
+    )
+
+# Leading bytes of the two Excel container formats
+ZIP_SIGNATURE = b'PK\x03\x04'  # .xlsx
+OLE2_SIGNATURE = b'\xd0\xcf\x11\xe0'  # .xls, or an encrypted .xlsx
+
+def detect_excel_engines(file_path, preferred_engine):
+    """Order the engines to try from the file signature, falling back to the extension-based engine"""
+    with open(file_path, 'rb') as f:
+        signature = f.read(8)
+    
+    if signature.startswith(ZIP_SIGNATURE):
+        return ['openpyxl', 'xlrd']
+    if signature.startswith(OLE2_SIGNATURE):
+        return ['xlrd', 'openpyxl']
+    return ['xlrd', 'openpyxl'] if preferred_engine == 'xlrd' else ['openpyxl', 'xlrd']
+
+class WorkbookSession:
+    """Workbook opened once per upload; serves the sheet list and every sheet read from that one handle"""
+    
+    def __init__(self, file_path, engine_name, book):
+        self.file_path = file_path
+        self.engine_name = engine_name
+        self.book = book  # openpyxl read-only Workbook, or pandas ExcelFile for xlrd
+    
+    @classmethod
+    def open(cls, file_path, engine_name):
+        """Open the workbook with a single engine"""
+        if engine_name == 'openpyxl':
+            return cls(file_path, engine_name, load_workbook(file_path, read_only=True, data_only=True))
+        return cls(file_path, engine_name, pd.ExcelFile(file_path, engine=engine_name))
+    
+    @property
+    def sheet_names(self):
+        if self.engine_name == 'openpyxl':
+            return self.book.sheetnames
+        return self.book.sheet_names
+    
+    def close(self):
+        try:
+            self.book.close()
+        except Exception:
+            pass
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc_info):
+        self.close()
+
+def read_excel_file(tmp_file_path, file_extension, engine_name):
+    """Open Excel file once and return sheet names plus the open WorkbookSession - temp file should already exist
+    The file signature decides which engine is tried first; engine_name is the fallback guess
+    """
+    try:
+        engines_to_try = detect_excel_engines(tmp_file_path, engine_name)
+        
+        errors = []
+        
+        for engine_to_try in engines_to_try:
+            try:
+                workbook = WorkbookSession.open(tmp_file_path, engine_to_try)
+            except Exception as e:
+                errors.append(str(e))
+                continue
+            
+            sheet_names = workbook.sheet_names
+            if not sheet_names:
+                workbook.close()
+                return False, None, None, "❌ Could not read file with any method", ""
+            return True, sheet_names, workbook, None, None
+        
+        error_lower = " ".join(errors).lower()
+        
+        # Check if file might be encrypted
+        is_encrypted = any(keyword in error_lower for keyword in [
+            'password', 'encrypted', 'protected', 
+            'ole2', 'compound document',
+            'permission denied', 'access denied',
+            'locked', 'security'
+        ])
+        
+        if is_encrypted:
+            error_msg = "🔒 File is Encrypted or Password-Protected"
+            details = "⚠️ The document appears to be encrypted or is an internal Excel file format."
+            return False, None, None, error_msg, details
+        
+        error_msg = f"❌ Error reading Excel file: All methods failed"
+        details = f"Last error ({engines_to_try[-1]}): {errors[-1]}"
+        return False, None, None, error_msg, details
+    
+    except Exception as e:
+        return False, None, None, f"Error reading file: {str(e)}", ""
+
+def header_column_names(header_values):
+    """Name header cells the way pandas does: blanks become 'Unnamed: n', repeats get a '.n' suffix"""
+    names = []
+    seen = {}
+    for idx, value in enumerate(header_values):
+        name = f"Unnamed: {idx}" if value is None or str(value).strip() == '' else str(value)
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}.{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+def read_header(workbook, sheet_name):
+    """Column names of a sheet's header row (pandas-style), reading nothing past the first row with openpyxl"""
+    if workbook.engine_name == 'openpyxl':
+        first_row = next(workbook.book[sheet_name].iter_rows(max_row=1, values_only=True), ())
+        return header_column_names(first_row)
+    return [str(col) for col in workbook.book.parse(sheet_name, header=0, nrows=0).columns]
+
+def cell_to_str(value):
+    """Convert a cell value to text; whole-number floats lose their '.0' like pandas' Excel reader"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+def stream_sheet(workbook, sheet_name, chunk_size=CHUNK_SIZE):
+    """Resolve the column mapping from the header row and stream only the required columns
+    Returns (is_valid, missing_cols, column_mapping, chunks); chunks yields DataFrames of at most chunk_size rows
+    """
+    if workbook.engine_name == 'openpyxl':
+        rows = workbook.book[sheet_name].iter_rows(values_only=True)
+        header = header_column_names(next(rows, ()))
+        is_valid, missing_cols, column_mapping = validate_columns(pd.DataFrame(columns=header))
+        
+        if not is_valid:
+            return False, missing_cols, column_mapping, None
+        
+        mapped_cols = [column_mapping[req_col] for req_col in REQUIRED_COLUMNS]
+        positions = [header.index(col) for col in mapped_cols]
+        
+        def chunks():
+            batch = []
+            for row in rows:
+                values = [cell_to_str(row[pos]) if pos < len(row) else '' for pos in positions]
+                # Skip fully blank rows (openpyxl reports formatted but empty rows too)
+                if not any(value.strip() for value in values):
+                    continue
+                batch.append(values)
+                if len(batch) >= chunk_size:
+                    yield extract_required_columns(pd.DataFrame(batch, columns=mapped_cols), column_mapping)
+                    batch = []
+            if batch:
+                yield extract_required_columns(pd.DataFrame(batch, columns=mapped_cols), column_mapping)
+        
+        return True, None, column_mapping, chunks()
+    
+    # xlrd has no streaming mode: read the header first, then only the required columns
+    header_df = workbook.book.parse(sheet_name, header=0, nrows=0)
+    is_valid, missing_cols, column_mapping = validate_columns(header_df)
+    if not is_valid:
+        return False, missing_cols, column_mapping, None
+    
+    positions = [list(header_df.columns).index(column_mapping[req_col]) for req_col in REQUIRED_COLUMNS]
+    df = workbook.book.parse(sheet_name, header=0, usecols=sorted(set(positions)))
+    df = extract_required_columns(df, column_mapping)
+    
+    def chunks():
+        for start in range(0, len(df), chunk_size):
+            yield df.iloc[start:start + chunk_size].reset_index(drop=True)
+    
+    return True, None, column_mapping, chunks()
+
+def process_sheet(workbook, sheet_name):
+    """Process a single sheet of an open workbook: read, validate columns, and return processed DataFrame"""
+    try:
+        # Validate columns from the header row and stream the required columns
+        is_valid, missing_cols, column_mapping, chunks = stream_sheet(workbook, sheet_name)
+        
+        if not is_valid:
+            return False, None, f"Missing required columns: {', '.join(missing_cols)}", missing_cols, column_mapping
+        
+        chunk_list = list(chunks)
+        if chunk_list:
+            df_processed = pd.concat(chunk_list, ignore_index=True)
+        else:
+            df_processed = pd.DataFrame(columns=REQUIRED_COLUMNS)
+        
+        return True, df_processed, None, None, column_mapping
+    
+    except Exception as e:
+        return False, None, f"Error reading sheet '{sheet_name}': {str(e)}", None, None
+
+def _process_sheet_in_worker(file_path, engine_name, sheet_name):
+    """Worker entry point: open the workbook with the already detected engine and process one sheet"""
+    try:
+        with WorkbookSession.open(file_path, engine_name) as workbook:
+            return process_sheet(workbook, sheet_name)
+    except Exception as e:
+        return False, None, f"Error reading sheet '{sheet_name}': {str(e)}", None, None
+
+def process_sheets(workbook, sheet_names, max_workers=None):
+    """Process several sheets, one sheet per worker process
+    Results come back in sheet order so later sheets still win when merging
+    """
+    if max_workers is None:
+        max_workers = SHEET_WORKERS
+    max_workers = min(max_workers, len(sheet_names))
+    
+    if max_workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(
+                    _process_sheet_in_worker,
+                    [workbook.file_path] * len(sheet_names),
+                    [workbook.engine_name] * len(sheet_names),
+                    sheet_names
+                ))
+        except Exception:
+            # Process pools are unavailable in some hosts; fall back to the shared handle
+            pass
+    
+    return [process_sheet(workbook, sheet_name) for sheet_name in sheet_names]
+
+def combine_sheets(workbook, sheet_names, max_workers=None):
+    """Process the selected sheets and merge them; later sheets win on repeated emails
+    Returns (df_processed or None, processed_sheets, failed_sheets)
+    """
+    all_processed_data = []
+    processed_sheets = []
+    failed_sheets = []
+    
+    for sheet_name, sheet_result in zip(sheet_names, process_sheets(workbook, sheet_names, max_workers)):
+        success, df_processed, error_msg, missing_cols, column_mapping = sheet_result
+        
+        if success:
+            all_processed_data.append(df_processed)
+            processed_sheets.append({
+                'name': sheet_name,
+                'rows': len(df_processed),
+                'mapping': column_mapping
+            })
+        else:
+            failed_sheets.append({
+                'name': sheet_name,
+                'error': error_msg,
+                'missing_cols': missing_cols
+            })
+    
+    if not all_processed_data:
+        return None, processed_sheets, failed_sheets
+    
+    df_processed = pd.concat(all_processed_data, ignore_index=True)
+    # Remove duplicates based on Email (if any sheet had duplicate emails)
+    df_processed = keep_last_per_email(df_processed)
+    return df_processed, processed_sheets, failed_sheets
+
+def _combine_file_in_worker(file_path, engine_name, sheet_names):
+    """Worker entry point: open one workbook and combine its selected sheets (sheets one after another)"""
+    try:
+        with WorkbookSession.open(file_path, engine_name) as workbook:
+            return combine_sheets(workbook, sheet_names, max_workers=1)
+    except Exception as e:
+        return None, [], [{'name': sheet_name, 'error': f"Error reading file: {str(e)}", 'missing_cols': None} for sheet_name in sheet_names]
+
+def combine_files(jobs, max_workers=None):
+    """Process several open workbooks, one file per worker process; jobs are (workbook, sheet_names) pairs
+    Returns one combine_sheets result per job, in job order
+    """
+    if max_workers is None:
+        max_workers = SHEET_WORKERS
+    max_workers = min(max_workers, len(jobs))
+    
+    if max_workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(
+                    _combine_file_in_worker,
+                    [workbook.file_path for workbook, _ in jobs],
+                    [workbook.engine_name for workbook, _ in jobs],
+                    [sheet_names for _, sheet_names in jobs]
+                ))
+        except Exception:
+            # Process pools are unavailable in some hosts; fall back to the open handles
+            pass
+    
+    # One file (or no pool): its sheets can still be processed in parallel
+    return [combine_sheets(workbook, sheet_names) for workbook, sheet_names in jobs]
+
+def merge_files(file_frames):
+    """Merge processed files in the given order; the last file wins on repeated emails (sheets already merged the same way)
+    file_frames is a list of (file_name, df_processed); the result carries the winning file in '_source_file'
+    """
+    frames = [df.assign(_source_file=file_name) for file_name, df in file_frames if df is not None]
+    if not frames:
+        return None
+    
+    df_merged = pd.concat(frames, ignore_index=True)
+    return keep_last_per_email(df_merged).reset_index(drop=True)
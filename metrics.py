@@ -0,0 +1,169 @@
+"""Upload instrumentation: per-stage wall time, rows in/out, bytes read and peak RSS during the stage (no Streamlit imports)
+
+Every finished stage is logged as one JSON line (METRICS_LOG: 'stderr' by default, a file path, or 'off'),
+stored in the upload_metrics table when an engine is given, and, with METRICS_PROMETHEUS_FILE set,
+summarized into a Prometheus text-format file for a node_exporter textfile collector.
+"""
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+from database import save_upload_metrics, load_metrics_totals
+
+METRICS_LOG = os.environ.get('METRICS_LOG', 'stderr')
+METRICS_PROMETHEUS_FILE = os.environ.get('METRICS_PROMETHEUS_FILE')
+
+# Seconds between memory samples while a stage runs
+RSS_SAMPLE_SECONDS = float(os.environ.get('METRICS_RSS_SAMPLE_SECONDS', 0.05))
+
+# Watch-folder workers finish stages concurrently
+_prometheus_lock = threading.Lock()
+
+# JSON lines only, not mixed into the root logger's output
+logger = logging.getLogger('upload_metrics')
+logger.setLevel(logging.INFO)
+logger.propagate = False
+if not logger.handlers and METRICS_LOG != 'off':
+    handler = logging.StreamHandler(sys.stderr) if METRICS_LOG == 'stderr' else logging.FileHandler(METRICS_LOG, encoding='utf-8')
+    handler.setFormatter(logging.Formatter('%(message)s'))
+    logger.addHandler(handler)
+
+def current_rss_bytes(process):
+    """Resident set size of a psutil process and its worker processes (sheets may be parsed in a process pool)"""
+    rss = process.memory_info().rss
+    for child in process.children(recursive=True):
+        try:
+            rss += child.memory_info().rss
+        except psutil.Error:  # Worker exited between the listing and the read
+            continue
+    return rss
+
+class RssSampler:
+    """Highest RSS seen while a stage runs, sampled on a background thread (peak is None without psutil)
+    Works on Windows too; stages running at the same time in one process see the same process memory
+    """
+    
+    def __init__(self, interval=RSS_SAMPLE_SECONDS):
+        self.interval = interval
+        self.peak = None
+        self._process = psutil.Process() if psutil is not None else None
+        self._stopped = threading.Event()
+        self._thread = None
+    
+    def sample(self):
+        try:
+            rss = current_rss_bytes(self._process)
+        except psutil.Error:
+            return
+        self.peak = rss if self.peak is None else max(self.peak, rss)
+    
+    def _run(self):
+        while not self._stopped.wait(self.interval):
+            self.sample()
+    
+    def start(self):
+        if self._process is None:
+            return self
+        self.sample()
+        self._thread = threading.Thread(target=self._run, name='rss-sampler', daemon=True)
+        self._thread.start()
+        return self
+    
+    def stop(self):
+        """Stop sampling and return the peak in bytes"""
+        if self._thread is not None:
+            self._stopped.set()
+            self._thread.join()
+            self._thread = None
+            self.sample()
+        return self.peak
+
+class UploadMetrics:
+    """Stage timings of one upload run; stages are recorded as they finish"""
+    
+    def __init__(self, source='', engine=None):
+        self.run_id = uuid.uuid4().hex[:12]
+        self.source = source
+        self.engine = engine  # None: log only, nothing stored
+        self.stages = []
+    
+    @contextmanager
+    def stage(self, name, rows_in=None, bytes_read=None):
+        """Time the enclosed block; set record['rows_out'] (or 'rows_in', 'bytes_read') inside it when known"""
+        record = {
+            'run_id': self.run_id,
+            'source': self.source,
+            'stage': name,
+            'status': 'ok',
+            'started_at': datetime.now().isoformat(timespec='seconds'),
+            'rows_in': rows_in,
+            'rows_out': None,
+            'bytes_read': bytes_read
+        }
+        sampler = RssSampler().start()
+        started = time.perf_counter()
+        try:
+            yield record
+        except BaseException:
+            record['status'] = 'failed'
+            raise
+        finally:
+            record['seconds'] = round(time.perf_counter() - started, 6)
+            record['peak_rss'] = sampler.stop()
+            self.record(record)
+    
+    def record(self, record):
+        """Log a finished stage and store it; storing problems never interrupt an upload"""
+        self.stages.append(record)
+        logger.info(json.dumps({'event': 'upload_stage', **record}, default=str))
+        if self.engine is None:
+            return
+        try:
+            save_upload_metrics(self.engine, [record])
+            if METRICS_PROMETHEUS_FILE:
+                write_prometheus_file(self.engine, METRICS_PROMETHEUS_FILE)
+        except Exception as e:
+            logger.info(json.dumps({'event': 'upload_metrics_error', 'run_id': self.run_id, 'error': str(e)}))
+
+def format_prometheus(totals):
+    """Prometheus text exposition of the per-stage totals from load_metrics_totals"""
+    series = [
+        ('bulkupdate_stage_runs_total', 'counter', 'Upload stages recorded', 'runs'),
+        ('bulkupdate_stage_seconds_total', 'counter', 'Wall time spent in the stage', 'seconds'),
+        ('bulkupdate_stage_rows_total', 'counter', 'Rows produced by the stage', 'rows_out'),
+        ('bulkupdate_stage_bytes_read_total', 'counter', 'Bytes read by the stage', 'bytes_read'),
+        ('bulkupdate_stage_failures_total', 'counter', 'Stage runs that raised an error', 'failures'),
+        ('bulkupdate_stage_last_seconds', 'gauge', 'Wall time of the latest run of the stage', 'last_seconds'),
+        ('bulkupdate_stage_peak_rss_bytes', 'gauge', 'Highest RSS seen while the stage ran', 'peak_rss')
+    ]
+    lines = []
+    for name, metric_type, help_text, column in series:
+        lines.append(f"# HELP {name} {help_text}")
+        lines.append(f"# TYPE {name} {metric_type}")
+        for row in totals.to_dict('records'):
+            value = row[column]
+            if value is None or value != value:  # NULL / NaN
+                continue
+            if float(value).is_integer():
+                value = int(value)
+            lines.append(f'{name}{{stage="{row["stage"]}"}} {value}')
+    return "\n".join(lines) + "\n"
+
+def write_prometheus_file(engine, file_path):
+    """Rewrite the Prometheus text file atomically (collectors never see a half-written file)"""
+    tmp_path = f"{file_path}.tmp"
+    with _prometheus_lock:
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(format_prometheus(load_metrics_totals(engine)))
+        os.replace(tmp_path, file_path)
@@ -0,0 +1,87 @@
+"""Workbook schema scanner: read only header rows and check them against REQUIRED_COLUMNS (no Streamlit imports)"""
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from ingest import (
+    REQUIRED_COLUMNS,
+    SHEET_WORKERS,
+    validate_columns,
+    validate_file_format,
+    read_excel_file,
+    read_header,
+    list_workbooks,
+)
+
+def scan_file(file_path, all_sheets=False):
+    """Open a workbook once and read the header row of its first sheet (or of every sheet)
+    Returns {'file', 'error', 'sheets': [{'sheet', 'columns', 'is_valid', 'missing_cols', 'mapping'}]}
+    """
+    result = {'file': os.path.basename(file_path), 'path': file_path, 'error': None, 'sheets': []}
+    
+    is_valid_file, file_extension, file_result = validate_file_format(file_path)
+    if not is_valid_file:
+        result['error'] = file_result
+        return result
+    
+    success, sheet_names, workbook, error_msg, error_details = read_excel_file(file_path, file_extension, file_result)
+    if not success:
+        result['error'] = error_msg
+        return result
+    
+    try:
+        for sheet_name in (sheet_names if all_sheets else sheet_names[:1]):
+            columns = read_header(workbook, sheet_name)
+            # Same matching rules as an upload
+            is_valid, missing_cols, column_mapping = validate_columns(pd.DataFrame(columns=columns))
+            result['sheets'].append({
+                'sheet': sheet_name,
+                'columns': columns,
+                'is_valid': is_valid,
+                'missing_cols': missing_cols,
+                'mapping': column_mapping
+            })
+    except Exception as e:
+        result['error'] = f"Error reading header: {str(e)}"
+    finally:
+        workbook.close()
+    return result
+
+def scan_directory(directory, all_sheets=False, max_workers=None):
+    """Scan every workbook in a directory, one file per worker process; results are in file name order"""
+    file_paths = list_workbooks(directory)
+    if max_workers is None:
+        max_workers = SHEET_WORKERS
+    max_workers = min(max_workers, len(file_paths))
+    
+    if max_workers > 1:
+        try:
+            with ProcessPoolExecutor(max_workers=max_workers) as executor:
+                return list(executor.map(scan_file, file_paths, [all_sheets] * len(file_paths)))
+        except Exception:
+            # Process pools are unavailable in some hosts; scan one file after another
+            pass
+    
+    return [scan_file(file_path, all_sheets) for file_path in file_paths]
+
+def compatibility_matrix(results):
+    """One row per scanned sheet (or unreadable file): the header column matched to each required column
+    Missing required columns are empty; 'Compatible' is True when the sheet can be uploaded as is
+    """
+    rows = []
+    for result in results:
+        if result['error']:
+            rows.append({'File': result['file'], 'Sheet': '', **dict.fromkeys(REQUIRED_COLUMNS, ''),
+                         'Compatible': False, 'Problem': result['error']})
+            continue
+        for sheet in result['sheets']:
+            problem = f"Missing: {', '.join(sheet['missing_cols'])}" if sheet['missing_cols'] else ''
+            rows.append({
+                'File': result['file'],
+                'Sheet': sheet['sheet'],
+                **{col: str(sheet['mapping'].get(col, '')) for col in REQUIRED_COLUMNS},
+                'Compatible': sheet['is_valid'],
+                'Problem': problem
+            })
+    return pd.DataFrame(rows, columns=['File', 'Sheet'] + REQUIRED_COLUMNS + ['Compatible', 'Problem'])
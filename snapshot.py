@@ -0,0 +1,234 @@
+"""Columnar snapshot of contacts_data: a versioned Parquet file read memory-mapped with pyarrow (no Streamlit imports)
+
+Snapshots live in one directory per database (named by its database id) and carry the data version and the last
+change log entry they contain; a file is reused only when both still match the database. When the data version
+moves on, only the change log entries written since are replayed onto it (plus indexed id lookups); a full rebuild,
+streamed from the table chunk by chunk, is used for the first snapshot and whenever the replay cannot be trusted. SNAPSHOT_DIR=off disables it.
+"""
+import os
+import threading
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from sqlalchemy import inspect, text
+
+from ingest import REQUIRED_COLUMNS, CHUNK_SIZE, normalize_frame
+from database import (
+    TABLE_NAME,
+    META_TABLE,
+    CHANGE_LOG_TABLE,
+    REQUIRED_COLUMNS_SQL,
+    get_meta_value,
+    get_database_id,
+    in_clause_chunks,
+    read_change_entries,
+)
+
+SNAPSHOT_DIR = os.environ.get('SNAPSHOT_DIR', 'snapshots')
+SNAPSHOT_PREFIX = "contacts_v"
+
+SNAPSHOT_SCHEMA = pa.schema(
+    [('id', pa.int64())] + [(col, pa.string()) for col in REQUIRED_COLUMNS] + [('email_key', pa.string())]
+)
+
+# Sessions and watch-folder workers may refresh at the same time
+_snapshot_lock = threading.Lock()
+
+def database_directory(directory, database_id):
+    """Snapshot directory of one database"""
+    return os.path.join(directory, f"db_{database_id}")
+
+def snapshot_path(directory, data_version):
+    """File of the snapshot taken at a data version"""
+    return os.path.join(directory, f"{SNAPSHOT_PREFIX}{data_version}.parquet")
+
+def find_snapshot(directory):
+    """(path, data version) of the newest snapshot file in directory, or (None, None)"""
+    if not os.path.isdir(directory):
+        return None, None
+    versions = []
+    for name in os.listdir(directory):
+        if name.startswith(SNAPSHOT_PREFIX) and name.endswith('.parquet'):
+            try:
+                versions.append(int(name[len(SNAPSHOT_PREFIX):-len('.parquet')]))
+            except ValueError:
+                continue
+    if not versions:
+        return None, None
+    return snapshot_path(directory, max(versions)), max(versions)
+
+def read_snapshot(path):
+    """Memory-mapped pyarrow Table of a snapshot file (pages are read from disk only when touched)"""
+    return pq.read_table(path, memory_map=True)
+
+def snapshot_change_id(table):
+    """Last change log entry contained in a snapshot"""
+    return int((table.schema.metadata or {}).get(b'change_id', b'0'))
+
+def snapshot_database_id(table):
+    """Database a snapshot was taken from (None for files without the stamp)"""
+    database_id = (table.schema.metadata or {}).get(b'database_id')
+    return int(database_id) if database_id is not None else None
+
+def to_snapshot_table(df):
+    """pyarrow Table in the snapshot schema"""
+    return pa.Table.from_pandas(df[SNAPSHOT_SCHEMA.names], schema=SNAPSHOT_SCHEMA, preserve_index=False)
+
+def snapshot_stamp(database_id, data_version, change_id):
+    """Schema metadata of a snapshot: the database id, data version and change log position"""
+    return {'database_id': str(database_id), 'data_version': str(data_version), 'change_id': str(change_id)}
+
+def iter_table_chunks(conn, chunk_size=CHUNK_SIZE):
+    """Yield every stored row in snapshot form (text normalized like a page of the View Database tab) as Table chunks, in id order"""
+    if not inspect(conn).has_table(TABLE_NAME):
+        return
+    result = conn.execution_options(stream_results=True).execute(
+        text(f'SELECT id, {REQUIRED_COLUMNS_SQL}, email_key FROM {TABLE_NAME} ORDER BY id')
+    )
+    while True:
+        rows = result.fetchmany(chunk_size)
+        if not rows:
+            break
+        chunk = pd.DataFrame(rows, columns=SNAPSHOT_SCHEMA.names)
+        yield to_snapshot_table(pd.concat([chunk[['id']], normalize_frame(chunk), chunk[['email_key']]], axis=1))
+
+def write_table_snapshot(conn, path, stamp):
+    """Write every stored row to a snapshot file one row group per chunk, so the table is never held in memory as a whole"""
+    with pq.ParquetWriter(path, SNAPSHOT_SCHEMA.with_metadata(stamp)) as writer:
+        for chunk in iter_table_chunks(conn):
+            writer.write_table(chunk)
+
+def replay_changes(conn, table, entries):
+    """Apply change log entries to a snapshot Table; None when the result cannot be trusted (rows without an email)
+    Only the net effect per email is applied, in pyarrow: rows are dropped by email_key, written rows come back with their current id
+    """
+    final_rows = {}
+    for entry in entries:
+        if not entry['before_key'] and not entry['after_key']:
+            return None
+        if entry['before_key']:
+            final_rows[entry['before_key']] = None
+        if entry['after_key']:
+            final_rows[entry['after_key']] = entry['after_row']
+    
+    table = table.replace_schema_metadata(None)
+    kept = table.filter(pc.invert(pc.is_in(table['email_key'], value_set=pa.array(list(final_rows), pa.string()))))
+    written = {key: row for key, row in final_rows.items() if row is not None}
+    if not written:
+        return kept
+    
+    # Ids of the written rows (indexed lookups); a missing one means the log and the table disagree
+    ids = {}
+    keys = list(written)
+    for placeholders, params in in_clause_chunks(keys):
+        result = conn.execute(text(f'SELECT email_key, id FROM {TABLE_NAME} WHERE email_key IN ({placeholders})'), params)
+        ids.update((email_key, record_id) for email_key, record_id in result)
+    if len(ids) != len(written):
+        return None
+    
+    rows = pd.DataFrame(list(written.values()), columns=REQUIRED_COLUMNS)
+    new_df = pd.concat(
+        [pd.DataFrame({'id': [ids[key] for key in written]}), normalize_frame(rows), pd.DataFrame({'email_key': keys})],
+        axis=1
+    )
+    new_rows = pa.Table.from_pandas(new_df[SNAPSHOT_SCHEMA.names], schema=SNAPSHOT_SCHEMA, preserve_index=False)
+    return pa.concat_tables([kept, new_rows]).sort_by('id')
+
+def refresh_snapshot(engine, directory=None):
+    """Memory-mapped snapshot Table matching the current data version, refreshed first when it is stale
+    Returns None when snapshots are disabled (SNAPSHOT_DIR=off)
+    """
+    directory = directory or SNAPSHOT_DIR
+    if directory == 'off':
+        return None
+    
+    with _snapshot_lock:
+        # One transaction: the version, the change log position and the rows are read from the same state
+        with engine.begin() as conn:
+            database_id = get_database_id(conn)
+            directory = database_directory(directory, database_id)
+            data_version = (conn.execute(text(f"SELECT value FROM {META_TABLE} WHERE key = 'data_version'")).scalar()) or 0
+            has_log = inspect(conn).has_table(CHANGE_LOG_TABLE)
+            change_id = (conn.execute(text(f'SELECT MAX(change_id) FROM {CHANGE_LOG_TABLE}')).scalar() if has_log else 0) or 0
+            
+            # A file from another database (or one that no longer matches the change log) is never reused
+            path, snapshot_version = find_snapshot(directory)
+            old_table = read_snapshot(path) if path is not None else None
+            if old_table is not None and (snapshot_database_id(old_table) != database_id or snapshot_change_id(old_table) > change_id):
+                old_table = None
+            if old_table is not None and snapshot_version == data_version and snapshot_change_id(old_table) == change_id:
+                return old_table
+            
+            table = None
+            if old_table is not None and has_log and snapshot_version < data_version:
+                # Replay what was logged since the snapshot
+                entries = read_change_entries(
+                    conn,
+                    f'SELECT before_key, after_key, before_row, after_row FROM {CHANGE_LOG_TABLE} WHERE change_id > :change_id ORDER BY change_id',
+                    {'change_id': snapshot_change_id(old_table)}
+                )
+                table = replay_changes(conn, old_table, entries)
+                row_count = conn.execute(text(f'SELECT COUNT(*) FROM {TABLE_NAME}')).scalar() if inspect(conn).has_table(TABLE_NAME) else 0
+                if table is not None and table.num_rows != row_count:
+                    table = None
+            old_table = None
+            
+            # Written next to the old file and renamed, so readers never see a half-written snapshot
+            os.makedirs(directory, exist_ok=True)
+            new_path = snapshot_path(directory, data_version)
+            tmp_path = f"{new_path}.tmp"
+            stamp = snapshot_stamp(database_id, data_version, change_id)
+            if table is None:
+                # Full rebuild: streamed from the table chunk by chunk
+                write_table_snapshot(conn, tmp_path, stamp)
+            else:
+                pq.write_table(table.replace_schema_metadata(stamp), tmp_path)
+            table = None
+        os.replace(tmp_path, new_path)
+        
+        # Older versions are no longer needed (a file still mapped elsewhere is left for the next refresh)
+        for name in os.listdir(directory):
+            old_path = os.path.join(directory, name)
+            if name.startswith(SNAPSHOT_PREFIX) and name.endswith('.parquet') and old_path != new_path:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+        return read_snapshot(new_path)
+
+def current_snapshot(engine, directory=None):
+    """Memory-mapped snapshot Table when one matches the database right now, else None
+    Nothing is built or rewritten, so cheap readers can use the snapshot without paying for a refresh
+    """
+    directory = directory or SNAPSHOT_DIR
+    if directory == 'off':
+        return None
+    with engine.connect() as conn:
+        database_id = get_meta_value(conn, 'database_id')
+        if database_id is None:
+            return None
+        data_version = get_meta_value(conn, 'data_version') or 0
+        has_log = inspect(conn).has_table(CHANGE_LOG_TABLE)
+        change_id = (conn.execute(text(f'SELECT MAX(change_id) FROM {CHANGE_LOG_TABLE}')).scalar() if has_log else 0) or 0
+    
+    path, snapshot_version = find_snapshot(database_directory(directory, database_id))
+    if path is None or snapshot_version != data_version:
+        return None
+    table = read_snapshot(path)
+    if snapshot_database_id(table) != database_id or snapshot_change_id(table) != change_id:
+        return None
+    return table
+
+def snapshot_filled_cells(table):
+    """Number of non-empty required-column cells in a snapshot"""
+    return sum(
+        int(pc.sum(pc.and_(pc.is_valid(table[col]), pc.not_equal(table[col], ''))).as_py() or 0)
+        for col in REQUIRED_COLUMNS
+    )
+
+def iter_snapshot_records(table, chunk_size=CHUNK_SIZE):
+    """Yield the required columns of a snapshot as DataFrame chunks, in id order"""
+    for batch in table.select(REQUIRED_COLUMNS).to_batches(max_chunksize=chunk_size):
+        yield batch.to_pandas()
@@ -0,0 +1,91 @@
+"""Change log round trips: writes are logged and rolled back"""
+import pandas as pd
+from sqlalchemy import create_engine
+
+from database import (
+    REQUIRED_COLUMNS,
+    update_database,
+    load_page_from_db,
+    delete_rows_by_id,
+    delete_entire_database,
+    update_rows_by_id,
+    list_change_batches,
+    load_rows_as_of,
+    load_data_from_db,
+    rollback_change_batch,
+)
+
+
+def make_engine(tmp_path, emails):
+    engine = create_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    rows = [[f"Company {idx}", "Name", "Surname", email, "Position", str(idx)] for idx, email in enumerate(emails)]
+    update_database(engine, pd.DataFrame(rows, columns=REQUIRED_COLUMNS), 'replace')
+    return engine
+
+
+def stored_ids(engine):
+    page = load_page_from_db(engine, 0, 100, with_ids=True)
+    return list(zip(page.index.tolist(), page['Email'].tolist()))
+
+
+def latest_batch_id(engine):
+    return int(list_change_batches(engine)['batch_id'].iloc[0])
+
+
+def test_rollback_of_a_delete_restores_the_ids(tmp_path):
+    engine = make_engine(tmp_path, ['a@x.com', 'b@x.com', '', 'd@x.com'])
+    before = stored_ids(engine)
+    
+    assert delete_rows_by_id(engine, [2, 3, 4])[0]
+    assert stored_ids(engine) == [(1, 'a@x.com')]
+    assert rollback_change_batch(engine, latest_batch_id(engine))[0]
+    assert stored_ids(engine) == before
+
+
+def test_rollback_of_delete_all_restores_the_ids(tmp_path):
+    engine = make_engine(tmp_path, ['a@x.com', 'b@x.com', 'c@x.com'])
+    before = stored_ids(engine)
+    
+    assert delete_entire_database(engine)[0]
+    assert rollback_change_batch(engine, latest_batch_id(engine))[0]
+    assert stored_ids(engine) == before
+
+
+def test_restored_row_gets_a_new_id_when_its_id_was_reused(tmp_path):
+    engine = make_engine(tmp_path, ['a@x.com', 'b@x.com'])
+    assert delete_rows_by_id(engine, [2])[0]
+    delete_batch_id = latest_batch_id(engine)
+    # The next insert takes the freed id
+    update_database(engine, pd.DataFrame([["Z", "Z", "Z", 'z@x.com', "Z", "9"]], columns=REQUIRED_COLUMNS), 'append')
+    
+    assert rollback_change_batch(engine, delete_batch_id)[0]
+    assert stored_ids(engine) == [(1, 'a@x.com'), (2, 'z@x.com'), (3, 'b@x.com')]
+
+
+def rows_of(frame):
+    return sorted(map(tuple, frame[REQUIRED_COLUMNS].values.tolist()))
+
+
+def test_rows_as_of_each_batch(tmp_path):
+    engine = make_engine(tmp_path, ['a@x.com', '', '', 'd@x.com'])
+    states = {latest_batch_id(engine): rows_of(load_data_from_db(engine))}
+    for change in [
+        lambda: update_rows_by_id(engine, [(2, None, {'Phone': "9"}), (4, None, {'Email': 'e@x.com'})]),
+        lambda: delete_rows_by_id(engine, [1, 3]),
+        lambda: update_database(engine, pd.DataFrame([["New", "N", "N", '', "P", "7"]], columns=REQUIRED_COLUMNS), 'append'),
+    ]:
+        assert change()[0] is not False
+        states[latest_batch_id(engine)] = rows_of(load_data_from_db(engine))
+    
+    assert rows_of(load_rows_as_of(engine, 0)) == []
+    for batch_id, rows in states.items():
+        assert rows_of(load_rows_as_of(engine, batch_id)) == rows
+
+
+def test_rollback_refused_when_a_row_without_email_is_gone(tmp_path):
+    engine = make_engine(tmp_path, ['a@x.com', ''])
+    upload_batch_id = latest_batch_id(engine)
+    assert delete_rows_by_id(engine, [2])[0]
+    
+    success, message = rollback_change_batch(engine, upload_batch_id)
+    assert not success and "changed again later" in message
@@ -0,0 +1,21 @@
+"""Header resolution: synonyms and fuzzy matches"""
+from header_mapper import resolve_headers
+
+
+def test_username_is_not_taken_for_surname():
+    resolved = dict(resolve_headers(('Company', 'Name', 'Username', 'Email')))
+    
+    assert 'Surname' not in resolved
+
+
+def test_close_misspelling_is_still_matched():
+    resolved = dict(resolve_headers(('Compnay', 'Name', 'Surname', 'Email', 'Phone Numbr')))
+    
+    assert resolved['Company'] == 0
+    assert resolved['Phone'] == 4
+
+
+def test_specific_synonym_beats_a_generic_one():
+    # 'Title' holds the honorific here, 'Job Title' the position, whichever comes last
+    assert dict(resolve_headers(('Title', 'Name', 'Job Title', 'Email')))['Position'] == 2
+    assert dict(resolve_headers(('Job Title', 'Name', 'Title', 'Email')))['Position'] == 0
@@ -0,0 +1,44 @@
+"""Sheets and files merged into one upload"""
+from openpyxl import Workbook
+
+from ingest import REQUIRED_COLUMNS, WorkbookSession, combine_sheets, merge_files
+
+
+def make_workbook(path, sheets):
+    """Excel file with one sheet per {sheet name: rows}, each under the required header"""
+    workbook = Workbook()
+    workbook.remove(workbook.active)
+    for sheet_name, rows in sheets.items():
+        worksheet = workbook.create_sheet(sheet_name)
+        worksheet.append(REQUIRED_COLUMNS)
+        for row in rows:
+            worksheet.append(row)
+    workbook.save(path)
+    return path
+
+
+def test_rows_without_an_email_are_all_kept(tmp_path):
+    path = make_workbook(tmp_path / 'contacts.xlsx', {
+        'First': [
+            ["A", "Ann", "One", None, "P", "1"],
+            ["B", "Bob", "Two", "b@x.com", "P", "2"],
+        ],
+        'Second': [
+            ["C", "Cid", "Three", None, "P", "3"],
+            ["B2", "Bob", "Two", " B@X.com", "P", "4"],
+        ],
+    })
+    with WorkbookSession.open(str(path), 'openpyxl') as workbook:
+        df_file, processed_sheets, failed_sheets = combine_sheets(workbook, ['First', 'Second'], max_workers=1)
+    
+    assert failed_sheets == []
+    # Emails are repeats whatever their case and spacing; the two rows without an email are different contacts
+    assert sorted(df_file['Company']) == ["A", "B2", "C"]
+    
+    other = df_file.iloc[:0].copy()
+    other.loc[0] = ["D", "Dee", "Four", "", "P", "5"]
+    other.loc[1] = ["B3", "Bob", "Two", "b@x.com", "P", "6"]
+    df_merged = merge_files([('contacts.xlsx', df_file), ('other.xlsx', other)])
+    
+    assert sorted(df_merged['Company']) == ["A", "B3", "C", "D"]
+    assert df_merged.loc[df_merged['Company'] == "B3", '_source_file'].tolist() == ['other.xlsx']
@@ -0,0 +1,83 @@
+"""Migrations of contacts tables written by older versions"""
+from sqlalchemy import create_engine, text
+
+from database import (
+    TABLE_NAME,
+    ensure_table,
+    list_change_batches,
+    load_batch_changes,
+    load_rows_as_of,
+    rollback_change_batch,
+)
+
+
+def make_legacy_engine(tmp_path, emails):
+    """SQLite database holding a pre-email_key contacts table with one row per email"""
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            f'CREATE TABLE {TABLE_NAME} ("Company" TEXT, "Name" TEXT, "Surname" TEXT, "Email" TEXT, "Position" TEXT, "Phone" TEXT)'
+        ))
+        conn.execute(
+            text(f'INSERT INTO {TABLE_NAME} ("Company", "Name", "Email") VALUES (:company, :name, :email)'),
+            [{'company': f"Company {idx}", 'name': f"Name {idx}", 'email': email} for idx, email in enumerate(emails)]
+        )
+    return engine
+
+
+def stored_emails(engine):
+    with engine.connect() as conn:
+        return conn.execute(text(f'SELECT "Email", email_key FROM {TABLE_NAME} ORDER BY id')).all()
+
+
+def test_wrapped_email_is_rewritten_not_deleted(tmp_path):
+    engine = make_legacy_engine(tmp_path, ['<a href="mailto:b@x.com">b@x.com</a>', 'c@x.com'])
+    with engine.begin() as conn:
+        ensure_table(conn)
+    
+    assert stored_emails(engine) == [('b@x.com', 'b@x.com'), ('c@x.com', 'c@x.com')]
+
+
+def test_wrapped_email_repeating_a_plain_one_keeps_the_first(tmp_path):
+    engine = make_legacy_engine(tmp_path, ['B@x.com', '<a href="mailto:b@x.com">b@x.com</a>', 'c@x.com'])
+    with engine.begin() as conn:
+        ensure_table(conn)
+    
+    assert stored_emails(engine) == [('B@x.com', 'b@x.com'), ('c@x.com', 'c@x.com')]
+
+
+def test_rows_removed_by_migration_are_logged(tmp_path):
+    engine = make_legacy_engine(tmp_path, ['b@x.com', ' B@x.com', '<a href="mailto:c@x.com">c@x.com</a>', 'c@x.com'])
+    with engine.begin() as conn:
+        ensure_table(conn)
+    
+    assert stored_emails(engine) == [('b@x.com', 'b@x.com'), ('c@x.com', 'c@x.com')]
+    batches = list_change_batches(engine)
+    assert batches['operation'].tolist() == ['migration']
+    removed = load_batch_changes(engine, int(batches['batch_id'].iloc[0]))
+    assert removed['Change'].tolist() == ['delete', 'delete']
+    assert removed['Company'].tolist() == ['Company 1', 'Company 3']
+    assert removed['Email'].tolist() == ['B@x.com', 'c@x.com']
+
+
+def test_rows_removed_by_migration_are_kept_apart_from_the_kept_row(tmp_path):
+    engine = make_legacy_engine(tmp_path, ['b@x.com', ' B@x.com', 'c@x.com'])
+    with engine.begin() as conn:
+        ensure_table(conn)
+    batch_id = int(list_change_batches(engine)['batch_id'].iloc[0])
+    
+    # The as-of view shows both rows, the kept one is not replaced by the removed one
+    as_of = load_rows_as_of(engine, 0)
+    assert sorted(zip(as_of['Company'], as_of['Email'])) == [
+        ('Company 0', 'b@x.com'), ('Company 1', 'B@x.com'), ('Company 2', 'c@x.com')
+    ]
+    
+    # The rollback puts the removed row back next to the kept one, without a key
+    success, message = rollback_change_batch(engine, batch_id)
+    assert success, message
+    assert stored_emails(engine) == [('b@x.com', 'b@x.com'), ('B@x.com', None), ('c@x.com', 'c@x.com')]
+    
+    # And the rollback can be rolled back in turn
+    success, message = rollback_change_batch(engine, int(list_change_batches(engine)['batch_id'].iloc[0]))
+    assert success, message
+    assert stored_emails(engine) == [('b@x.com', 'b@x.com'), ('c@x.com', 'c@x.com')]
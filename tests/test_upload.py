@@ -0,0 +1,94 @@
+"""Uploads diffed against the stored rows and written"""
+import pandas as pd
+from sqlalchemy import create_engine
+
+import database
+from database import REQUIRED_COLUMNS, update_database, preview_changes, load_data_from_db, list_change_batches
+
+
+def frame(rows):
+    return pd.DataFrame(rows, columns=REQUIRED_COLUMNS)
+
+
+def test_last_row_per_email_wins(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    upload = frame([
+        ["First", "A", "A", 'a@x.com', "P", "1"],
+        ["Other", "B", "B", 'b@x.com', "P", "2"],
+        ["Last", "A", "A", 'A@x.com ', "P", "3"],
+    ])
+    
+    preview = preview_changes(engine, upload)
+    assert [row['row']['Company'] for row in preview['new_rows']] == ["Other", "Last"]
+    assert update_database(engine, upload)[0]
+    assert sorted(load_data_from_db(engine)['Company'].tolist()) == ["Last", "Other"]
+
+
+def test_rows_without_email_are_not_stored_twice(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    upload = frame([
+        ["Acme", "No", "Email", '', "P", "1"],
+        ["Acme", "No", "Email", '', "P", "1"],
+        ["Acme", "Other", "Row", '', "P", "2"],
+        ["Beta", "B", "B", 'b@x.com', "P", "3"],
+    ])
+    assert update_database(engine, upload, 'replace')[0]
+    assert len(load_data_from_db(engine)) == 3
+    
+    for update_mode in ['replace', 'append']:
+        preview = preview_changes(engine, upload, update_mode)
+        assert preview['new_rows'] == []
+        assert [dup['name'] for dup in preview['duplicates'] if not dup['email_key']] == ["No", "No", "Other"]
+        success, result = update_database(engine, upload, update_mode)
+        assert success and result['new_count'] == 0
+        assert len(load_data_from_db(engine)) == 3
+
+
+def test_rows_without_email_are_selected_one_by_one(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'contacts.db'}")
+    upload = frame([
+        ["Acme", "First", "Row", '', "P", "1"],
+        ["Beta", "B", "B", 'b@x.com', "P", "2"],
+        ["Acme", "Second", "Row", '', "P", "3"],
+    ])
+    preview = preview_changes(engine, upload)
+    review_keys = [row['review_key'] for row in preview['new_rows']]
+    assert len(set(review_keys)) == 3
+    
+    # Cancelling one row without an email keeps the other one
+    selected = {review_key: True for review_key in review_keys}
+    selected[preview['new_rows'][1]['review_key']] = False
+    assert preview['new_rows'][1]['name'] == "First"
+    assert update_database(engine, upload, 'replace', selected)[0]
+    assert sorted(load_data_from_db(engine)['Name'].tolist()) == ["B", "Second"]
+
+
+def test_upload_written_in_chunks_matches_one_pass(tmp_path, monkeypatch):
+    stored = frame([
+        ["Old", "A", "A", 'a@x.com', "P", "1"],
+        ["Same", "S", "S", 's@x.com', "P", "2"],
+    ])
+    upload = frame([
+        ["First", "A", "A", 'a@x.com', "P", "1"],
+        ["Acme", "No", "Email", '', "P", "3"],
+        ["Same", "S", "S", 's@x.com', "P", "2"],
+        ["New", "N", "N", 'n@x.com', "P", "4"],
+        ["Acme", "No", "Email", '', "P", "3"],
+        ["Last", "A", "A", 'A@x.com', "P", "5"],
+    ])
+    results = []
+    for chunk_size, name in [(1000, 'one_pass.db'), (2, 'chunks.db')]:
+        monkeypatch.setattr(database, 'CHUNK_SIZE', chunk_size)
+        engine = create_engine(f"sqlite:///{tmp_path / name}")
+        assert update_database(engine, stored)[0]
+        success, result = update_database(engine, upload)
+        assert success
+        counts = {key: result[key] for key in ['updated_count', 'unchanged_count', 'new_count', 'duplicates_count']}
+        results.append((counts, sorted(load_data_from_db(engine)['Company'].tolist()), len(list_change_batches(engine))))
+    
+    assert results[1] == results[0]
+    assert results[0] == (
+        {'updated_count': 2, 'unchanged_count': 1, 'new_count': 2, 'duplicates_count': 1},
+        ["Acme", "Last", "New", "Same"],
+        2
+    )
@@ -0,0 +1,57 @@
+"""LRU cache for parsed uploads and their previews, shared across Streamlit reruns"""
+import hashlib
+import threading
+from collections import OrderedDict
+
+# Default limits: entries kept and approximate memory held by cached DataFrames/previews
+MAX_ENTRIES = 16
+MAX_BYTES = 512 * 1024 * 1024
+
+def hash_upload(file_bytes):
+    """SHA-256 of the uploaded file content"""
+    return hashlib.sha256(file_bytes).hexdigest()
+
+def frame_size(df):
+    """Approximate memory held by a DataFrame, used as the cache entry size"""
+    if df is None:
+        return 0
+    return int(df.memory_usage(deep=True).sum())
+
+class UploadCache:
+    """Thread-safe LRU mapping with an entry-count and a total-size cap"""
+
+    def __init__(self, max_entries=MAX_ENTRIES, max_bytes=MAX_BYTES):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.total_bytes = 0
+        self._entries = OrderedDict()  # key -> (value, size)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached value (marking it most recently used) or None"""
+        with self._lock:
+            if key not in self._entries:
+                return None
+            self._entries.move_to_end(key)
+            return self._entries[key][0]
+
+    def put(self, key, value, size=0):
+        """Store a value and evict least recently used entries until both caps hold"""
+        with self._lock:
+            if key in self._entries:
+                self.total_bytes -= self._entries.pop(key)[1]
+            self._entries[key] = (value, size)
+            self.total_bytes += size
+
+            # Always keep the newest entry, even if it alone exceeds the size cap
+            while len(self._entries) > 1 and (len(self._entries) > self.max_entries or self.total_bytes > self.max_bytes):
+                _, (_, evicted_size) = self._entries.popitem(last=False)
+                self.total_bytes -= evicted_size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.total_bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
@@ -0,0 +1,140 @@
+"""Watch-folder ingestion: poll a drop directory and load new or changed workbooks (no Streamlit imports)
+
+Files are picked up once their size and modification time have been stable for the debounce period,
+parsed by a bounded worker pool and written one at a time. A ledger of content hashes makes sure the
+same workbook is never ingested twice, even when it is copied again under another name.
+"""
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from ingest import list_workbooks
+from upload_cache import hash_upload
+from database import get_ingested_file, record_ingested_file
+
+# Defaults for the watch loop
+POLL_INTERVAL_SECONDS = 2.0
+DEBOUNCE_SECONDS = 5.0
+WATCH_WORKERS = 2
+
+def file_signature(file_path):
+    """(size, mtime_ns) of a file, or None when it disappeared"""
+    try:
+        stat = os.stat(file_path)
+    except OSError:
+        return None
+    return stat.st_size, stat.st_mtime_ns
+
+class FolderWatcher:
+    """Polling watcher that queues stable new/changed workbooks and ingests them through the app pipeline"""
+    
+    def __init__(self, directory, engine, update_mode='replace', dry_run=False, on_report=None,
+                 poll_interval=POLL_INTERVAL_SECONDS, debounce_seconds=DEBOUNCE_SECONDS, max_workers=WATCH_WORKERS):
+        self.directory = directory
+        self.engine = engine
+        self.update_mode = update_mode
+        self.dry_run = dry_run
+        self.on_report = on_report
+        self.poll_interval = poll_interval
+        self.debounce_seconds = debounce_seconds
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='ingest')
+        
+        self._pending = {}  # path -> (signature, time the signature was first seen)
+        self._queued = {}  # path -> signature submitted to the pool
+        self._in_flight = set()
+        self._state_lock = threading.Lock()
+        # Parsing runs in parallel; database writes happen one at a time
+        self._write_lock = threading.Lock()
+        self._report_lock = threading.Lock()
+        self._stop = threading.Event()
+    
+    def poll_once(self, now=None):
+        """Scan the directory once and submit files whose signature has been stable for the debounce period
+        Returns the paths submitted in this poll
+        """
+        now = time.monotonic() if now is None else now
+        submitted = []
+        current = {path: file_signature(path) for path in list_workbooks(self.directory)}
+        
+        with self._state_lock:
+            # Forget files that were removed
+            for path in list(self._pending):
+                if path not in current:
+                    del self._pending[path]
+            
+            for path, signature in current.items():
+                if signature is None or self._queued.get(path) == signature or path in self._in_flight:
+                    continue
+                
+                seen = self._pending.get(path)
+                if seen is None or seen[0] != signature:
+                    # New or still being written: restart the debounce timer
+                    self._pending[path] = (signature, now)
+                elif now - seen[1] >= self.debounce_seconds:
+                    del self._pending[path]
+                    self._queued[path] = signature
+                    self._in_flight.add(path)
+                    self.executor.submit(self._process, path)
+                    submitted.append(path)
+        return submitted
+    
+    def run(self):
+        """Poll until stop() is called (or Ctrl+C), then wait for queued files to finish"""
+        try:
+            while not self._stop.is_set():
+                self.poll_once()
+                self._stop.wait(self.poll_interval)
+        except KeyboardInterrupt:
+            pass
+        finally:
+            self.executor.shutdown(wait=True)
+    
+    def stop(self):
+        self._stop.set()
+    
+    def _process(self, file_path):
+        try:
+            report = self.ingest_file(file_path)
+        except Exception as e:
+            report = {'file': file_path, 'status': 'failed', 'error': str(e), 'sheets': [], 'failed_sheets': []}
+        finally:
+            with self._state_lock:
+                self._in_flight.discard(file_path)
+        
+        if self.on_report:
+            with self._report_lock:
+                self.on_report(report)
+    
+    def ingest_file(self, file_path):
+        """Validate, parse and apply one workbook unless its content is already in the ledger
+        Returns a bulkupdate.run_file report, with status 'skipped' for content that was already ingested
+        """
+        # Imported here: bulkupdate imports this module for --watch
+        from bulkupdate import run_file
+        
+        with open(file_path, 'rb') as f:
+            file_bytes = f.read()
+        file_hash = hash_upload(file_bytes)
+        
+        ledger_entry = get_ingested_file(self.engine, file_hash)
+        if ledger_entry is not None:
+            return {
+                'file': file_path,
+                'status': 'skipped',
+                'file_hash': file_hash,
+                'message': f"Already ingested on {ledger_entry['ingested_at']} as {ledger_entry['file_path']} ({ledger_entry['status']})",
+                'sheets': [],
+                'failed_sheets': []
+            }
+        
+        report = run_file(self.engine, file_path, self.update_mode, self.dry_run, write_lock=self._write_lock)
+        report['file_hash'] = file_hash
+        
+        # Failed files are recorded too, so a broken workbook is retried only when its content changes
+        if not self.dry_run:
+            record_ingested_file(
+                self.engine, file_hash, file_path, len(file_bytes), report['status'],
+                report.get('rows', 0), report.get('error', '')
+            )
+        return report